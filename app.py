@@ -1,6 +1,7 @@
 from flask import Flask, redirect, url_for, render_template
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy.orm import joinedload
 from datetime import timedelta
 import os
 import logging
@@ -23,14 +24,25 @@ app = Flask(
 # App configuration
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///lms.db')
-app.config['SQLALCHEMY_ECHO'] = True  # Log SQL queries for debugging
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_REPLICA_URI'] = os.getenv('DATABASE_REPLICA_URL')  # GET pages of students, courses and messages read from it
+app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv('REPLICA_STICKY_SECONDS', 10))  # Reads stay on the primary this long after a user's write
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lms/static/uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload
+app.config['UPLOAD_ACCEL_REDIRECT'] = os.getenv('UPLOAD_ACCEL_REDIRECT')  # Internal nginx location of the upload folder, e.g. /protected-uploads/
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'  # Let Apache/lighttpd stream files
+app.config['PUBSUB_URL'] = os.getenv('PUBSUB_URL', 'local')  # 'sqlite:///path' to share events between workers
+app.config['SSE_MAX_STREAMS'] = int(os.getenv('SSE_MAX_STREAMS', max(int(os.getenv('GUNICORN_THREADS', 8)) // 2, 1)))  # Open message streams per process; pages poll beyond that
+app.config['SSE_MAX_SECONDS'] = int(os.getenv('SSE_MAX_SECONDS', 300))  # Streams end after this and browsers reconnect, sharing the slots
+app.config['CACHE_URL'] = os.getenv('CACHE_URL', 'memory')  # 'sqlite:///path' or 'redis://...' to share between workers
+app.config['API_TOKEN_TTL'] = int(os.getenv('API_TOKEN_TTL', 900))  # Lifetime in seconds of /api access tokens
+app.config['TOKEN_REVOCATION_REFRESH_SECONDS'] = int(os.getenv('TOKEN_REVOCATION_REFRESH_SECONDS', 30))  # How often each process reloads revoked tokens
 app.permanent_session_lifetime = timedelta(days=7)
 
-# Initialize database
+# Initialize database with the pool, timeouts and SQL logging of the DB_PROFILE (development/production/testing)
 from lms.utils.db import db
+from lms.utils.engine import configure_engine
+configure_engine(app)
 db.init_app(app)
 
 # Setup CSRF protection
@@ -40,7 +52,23 @@ csrf.init_app(app)
 # Import models (after db initialization)
 from lms.models.user import User
 from lms.models.message import Message
+from lms.models.job import Job
+from lms.models.token import RevokedToken
+from lms.models.stored_file import StoredFile
 from lms.utils.db import init_db
+from lms.utils.fragments import FragmentCacheExtension
+from lms.utils.conditional import add_validators
+from lms.utils.files import block_static_uploads, upload_url
+
+# {% cache %} blocks for rendered fragments of course and module pages
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+# ETags of the views decorated with @conditional
+app.after_request(add_validators)
+
+# Uploads are served by course.download_file, which checks who may see them
+app.before_request(block_static_uploads)
+app.jinja_env.globals['upload_url'] = upload_url
 
 # Enable more detailed error logging
 app.config['PROPAGATE_EXCEPTIONS'] = True
@@ -52,7 +80,9 @@ from lms.routes.teacher import teacher_bp
 from lms.routes.student import student_bp
 from lms.routes.course import course_bp
 from lms.routes.messages import messages_bp
+from lms.routes.jobs import jobs_bp
 from swagger import swagger_bp
+from lms.utils.tokens import load_user_from_request
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -62,7 +92,11 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # The role comes in the same query; role names are cached per process (Role.name_for)
+    return db.session.get(User, int(user_id), options=[joinedload(User.role)])
+
+# /api requests without a session authenticate with a bearer token, without touching the database
+login_manager.request_loader(load_user_from_request)
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(admin_bp, url_prefix='/admin')
@@ -70,7 +104,9 @@ app.register_blueprint(teacher_bp, url_prefix='/teacher')
 app.register_blueprint(student_bp, url_prefix='/student')
 app.register_blueprint(course_bp, url_prefix='/courses')
 app.register_blueprint(messages_bp, url_prefix='/messages')
+app.register_blueprint(jobs_bp, url_prefix='/jobs')
 app.register_blueprint(swagger_bp)
+csrf.exempt(swagger_bp)  # Checked in the blueprint for cookie sessions only (lms.utils.api.protect_cookie_sessions)
 
 @app.route('/')
 def index():
@@ -82,7 +118,7 @@ if __name__ == '__main__':
         
         # Ensure the messages table exists and create it if needed
         try:
-            from lms.models.message import Message
+            from lms.models.message import Message, Conversation
             
             # Check if messages table exists
             from sqlalchemy import inspect
@@ -110,10 +146,19 @@ if __name__ == '__main__':
                         content='Thanks for the welcome! I have a question about the courses.'
                     )
                     db.session.add(test_reply)
-                    
+                    db.session.flush()
+                    Conversation.backfill()
+
                     db.session.commit()
                     print("Test messages created.")
         except Exception as e:
             print(f"Error setting up messages: {str(e)}")
     
+    # Run queued jobs in this process unless a separate `python -m lms.worker` is started;
+    # with the reloader, only its child process serves requests
+    if os.getenv('RUN_WORKER', 'true').lower() == 'true' and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        import lms.utils.tasks  # registers the tasks
+        from lms.utils.jobs import Worker
+        Worker(app).start()
+
     app.run(debug=True, port=5002)
\ No newline at end of file
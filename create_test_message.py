@@ -8,7 +8,7 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 from lms.utils.db import db
 from lms.models.course import Course, Enrollment
 from lms.models.user import User
-from lms.models.message import Message
+from lms.models.message import Message, Conversation
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///lms.db'
@@ -40,6 +40,10 @@ with app.app_context():
             )
             db.session.add(test_message2)
             
+            # Keep the conversation list and unread counts in step, as messages.send_message does
+            db.session.flush()
+            Conversation.record_message(test_message)
+            Conversation.record_message(test_message2)
             db.session.commit()
             print('Test messages created successfully')
             
@@ -0,0 +1,8 @@
+# Gunicorn settings, read automatically from the working directory.
+# The database pool of each worker is sized from the same variables (lms/utils/engine.py).
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5002')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+# Message streams take at most SSE_MAX_STREAMS of these threads (half by default); the rest serve pages
+threads = int(os.getenv('GUNICORN_THREADS', 8))
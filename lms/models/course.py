@@ -44,17 +44,16 @@ class Course(db.Model):
     payment_receipt_path = db.Column(db.String(255))  # Path to the teacher's payment receipt
     payment_verified = db.Column(db.Boolean, default=False)  # Whether the teacher's payment has been verified
     
+    # Number of enrollments, maintained by lms.utils.enrollment on every flush
+    enrollment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    content_version = db.Column(db.Integer, default=0)  # Bumped whenever the course or its materials change
+    
     # Relationships
     materials = db.relationship('Material', backref='course', lazy='dynamic', cascade="all, delete-orphan")
     assignments = db.relationship('Assignment', backref='course', lazy='dynamic', cascade="all, delete-orphan")
     enrollments = db.relationship('Enrollment', back_populates='course', lazy='dynamic', cascade="all, delete-orphan")
     modules = db.relationship('Module', backref='course', lazy='dynamic', cascade="all, delete-orphan")
-    subscription_plan = db.relationship('TeacherSubscriptionPlan', backref='courses')
-    
-    # Get the enrollment count for this course
-    @property
-    def enrollment_count(self):
-        return self.enrollments.count()
+    subscription_plan = db.relationship('TeacherSubscriptionPlan', backref='courses', lazy='joined')
     
     @property
     def is_at_capacity(self):
@@ -151,6 +150,7 @@ class Module(db.Model):
     order = db.Column(db.Integer, default=0)  # For ordering modules in a course
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    content_version = db.Column(db.Integer, default=0)  # Bumped whenever the module, its materials or tests change
     
     # Relationships
     materials = db.relationship('Material', backref='module', lazy='dynamic', cascade="all, delete-orphan")
@@ -168,6 +168,7 @@ class Test(db.Model):
     passing_score = db.Column(db.Float, default=70.0)  # Default passing score is 70%
     module_id = db.Column(db.Integer, db.ForeignKey('modules.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    answer_key_version = db.Column(db.Integer, default=0)  # Bumped whenever questions or options change
     
     # Relationships
     questions = db.relationship('Question', backref='test', lazy='dynamic', cascade="all, delete-orphan")
@@ -283,6 +284,22 @@ class Enrollment(db.Model):
     def __repr__(self):
         return f'<Enrollment {self.id}>'
 
+class EnrollmentProgress(db.Model):
+    """Denormalized progress of a student in a course, kept current by session hooks"""
+    __tablename__ = 'enrollment_progress'
+
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id', ondelete='CASCADE'), primary_key=True)
+    modules_completed = db.Column(db.Integer, default=0, nullable=False)
+    tests_passed = db.Column(db.Integer, default=0, nullable=False)
+    assignments_submitted = db.Column(db.Integer, default=0, nullable=False)
+    assignments_graded = db.Column(db.Integer, default=0, nullable=False)
+    overall_grade = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<EnrollmentProgress {self.student_id}:{self.course_id}>'
+
 
 class Wishlist(db.Model):
     __tablename__ = 'wishlist'
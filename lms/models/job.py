@@ -0,0 +1,55 @@
+import json
+from datetime import datetime
+from lms.utils.db import db
+
+class Job(db.Model):
+    """Background task queued in the database and run by `python -m lms.worker`"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_priority_run_at', 'status', 'priority', 'run_at'),
+    )
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments of the task
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    priority = db.Column(db.Integer, nullable=False, default=0)  # Higher runs first
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not picked up before this time
+    locked_by = db.Column(db.String(100))  # Worker running the job
+    locked_at = db.Column(db.DateTime)  # Renewed by the worker's heartbeat while the job runs
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)  # JSON return value of the task
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.task} {self.status}>'
+
+    @property
+    def arguments(self):
+        return json.loads(self.payload or '{}')
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task': self.task,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'error': self.last_error,
+            'result': json.loads(self.result) if self.result else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
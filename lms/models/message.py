@@ -1,10 +1,15 @@
 from datetime import datetime
 from lms.utils.db import db
 from flask import current_app
+from sqlalchemy.exc import IntegrityError
 import logging
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_sender_recipient_created', 'sender_id', 'recipient_id', 'created_at'),
+        db.Index('ix_messages_recipient_read', 'recipient_id', 'read'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -20,69 +25,248 @@ class Message(db.Model):
     def __repr__(self):
         return f'<Message {self.id} from {self.sender_id} to {self.recipient_id}>'
     
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sender_id': self.sender_id,
+            'recipient_id': self.recipient_id,
+            'content': self.content,
+            'read': self.read,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
     @staticmethod
     def get_conversation(user1_id, user2_id, limit=50):
         """Get the conversation between two users"""
         try:
-            return Message.query.filter(
-                ((Message.sender_id == user1_id) & (Message.recipient_id == user2_id)) | 
-                ((Message.sender_id == user2_id) & (Message.recipient_id == user1_id))
-            ).order_by(Message.created_at.desc()).limit(limit).all()
+            messages, _ = Message.get_conversation_page(user1_id, user2_id, limit=limit)
+            messages.reverse()
+            return messages
         except Exception as e:
             logging.error(f"Error getting conversation: {str(e)}")
             return []
     
+    @staticmethod
+    def get_conversation_page(user1_id, user2_id, before_id=None, after_id=None, limit=50):
+        """Get one page of the conversation between two users, oldest message first
+
+        Pages are selected with a keyset on (created_at, id) relative to the
+        before_id/after_id cursor message rather than an OFFSET, so every page
+        is an index range scan. A cursor that is not a message, such as 0,
+        is ignored. Returns (messages, has_more).
+        """
+        query = Message.query.filter(
+            ((Message.sender_id == user1_id) & (Message.recipient_id == user2_id)) | 
+            ((Message.sender_id == user2_id) & (Message.recipient_id == user1_id))
+        )
+
+        if after_id is not None:
+            cursor_time = db.select(Message.created_at).where(Message.id == after_id).scalar_subquery()
+            query = query.filter(
+                cursor_time.is_(None) |
+                (Message.created_at > cursor_time) |
+                ((Message.created_at == cursor_time) & (Message.id > after_id))
+            ).order_by(Message.created_at, Message.id)
+        else:
+            if before_id is not None:
+                cursor_time = db.select(Message.created_at).where(Message.id == before_id).scalar_subquery()
+                query = query.filter(
+                    cursor_time.is_(None) |
+                    (Message.created_at < cursor_time) |
+                    ((Message.created_at == cursor_time) & (Message.id < before_id))
+                )
+            query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+        # Fetch one extra row to know whether another page exists
+        messages = query.limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after_id is None:
+            messages.reverse()
+        return messages, has_more
+    
     @staticmethod
     def get_conversations_for_user(user_id):
-        """Get all conversations for a user with the most recent message for each conversation"""
+        """Get all conversations for a user with the most recent message for each conversation
+
+        Reads the denormalized conversations table, one row per conversation.
+        """
         try:
-            # First, find all users this user has either sent messages to or received messages from
-            sent_to = db.session.query(Message.recipient_id).filter(Message.sender_id == user_id).distinct().all()
-            received_from = db.session.query(Message.sender_id).filter(Message.recipient_id == user_id).distinct().all()
-            
-            # Combine and deduplicate user IDs
-            sent_to_ids = [user[0] for user in sent_to]
-            received_from_ids = [user[0] for user in received_from]
-            contact_ids = list(set(sent_to_ids + received_from_ids))
-            
-            conversations = []
-            for contact_id in contact_ids:
-                # Get the most recent message between the two users
-                latest_message = Message.query.filter(
-                    ((Message.sender_id == user_id) & (Message.recipient_id == contact_id)) | 
-                    ((Message.sender_id == contact_id) & (Message.recipient_id == user_id))
-                ).order_by(Message.created_at.desc()).first()
-                
-                if latest_message:
-                    conversations.append({
-                        'contact_id': contact_id,
-                        'latest_message': latest_message
-                    })
-            
-            # Sort conversations by latest message timestamp
-            conversations.sort(key=lambda x: x['latest_message'].created_at, reverse=True)
-            return conversations
+            return Conversation.for_user(user_id)
         except Exception as e:
             logging.error(f"Error getting conversations: {str(e)}")
             return []
         
     @staticmethod
     def mark_conversation_as_read(user_id, other_user_id):
-        """Mark all messages from other_user to user as read"""
+        """Mark all messages from other_user to user as read and return how many changed
+
+        Runs a single UPDATE, and no write at all when the conversation's
+        unread counter is already zero.
+        """
         try:
-            unread_messages = Message.query.filter_by(sender_id=other_user_id, recipient_id=user_id, read=False).all()
-            for message in unread_messages:
-                message.read = True
+            if Conversation.unread_count(user_id, other_user_id) == 0:
+                return 0
+            updated = Message.query.filter_by(
+                sender_id=other_user_id, recipient_id=user_id, read=False
+            ).update({Message.read: True})
+            Conversation.mark_read(user_id, other_user_id)
             db.session.commit()
+            return updated
         except Exception as e:
             logging.error(f"Error marking messages as read: {str(e)}")
             db.session.rollback()
+            return 0
     
     @staticmethod
     def count_unread_messages(user_id):
         """Count the total number of unread messages for a user"""
         try:
-            return Message.query.filter_by(recipient_id=user_id, read=False).count()
+            return Conversation.count_unread(user_id)
         except Exception as e:
             logging.error(f"Error counting unread messages: {str(e)}")
-            return 0
\ No newline at end of file
+            return 0
+
+
+class Conversation(db.Model):
+    """Latest message and unread counters of the messages exchanged by two users
+
+    Keyed by the ordered user pair, so user_low_id is always the smaller id.
+    """
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        db.Index('ix_conversations_low_activity', 'user_low_id', 'last_activity_at'),
+        db.Index('ix_conversations_high_activity', 'user_high_id', 'last_activity_at'),
+    )
+
+    user_low_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    user_high_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id', ondelete='SET NULL'))
+    last_activity_at = db.Column(db.DateTime, default=datetime.utcnow)
+    unread_low = db.Column(db.Integer, default=0, nullable=False)  # unread messages sent to user_low
+    unread_high = db.Column(db.Integer, default=0, nullable=False)  # unread messages sent to user_high
+
+    last_message = db.relationship('Message')
+
+    def __repr__(self):
+        return f'<Conversation {self.user_low_id}-{self.user_high_id}>'
+
+    @staticmethod
+    def pair(user1_id, user2_id):
+        """Ordered (low, high) key of the conversation between two users"""
+        return (min(user1_id, user2_id), max(user1_id, user2_id))
+
+    @classmethod
+    def _unread_column(cls, user_id, other_user_id):
+        """Counter holding the messages addressed to user_id"""
+        return cls.unread_low if user_id <= other_user_id else cls.unread_high
+
+    @classmethod
+    def _filter_pair(cls, user1_id, user2_id):
+        low, high = cls.pair(user1_id, user2_id)
+        return cls.query.filter(cls.user_low_id == low, cls.user_high_id == high)
+
+    @classmethod
+    def record_message(cls, message):
+        """Point the conversation at a flushed message and count it as unread. Does not commit."""
+        unread_column = cls._unread_column(message.recipient_id, message.sender_id)
+        values = {
+            cls.last_message_id: message.id,
+            cls.last_activity_at: message.created_at,
+            unread_column: unread_column + 1
+        }
+        if cls._filter_pair(message.sender_id, message.recipient_id).update(values):
+            return
+
+        low, high = cls.pair(message.sender_id, message.recipient_id)
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(
+                    user_low_id=low,
+                    user_high_id=high,
+                    last_message_id=message.id,
+                    last_activity_at=message.created_at,
+                    unread_low=1 if unread_column is cls.unread_low else 0,
+                    unread_high=1 if unread_column is cls.unread_high else 0
+                ))
+        except IntegrityError:
+            # Created concurrently by another request
+            cls._filter_pair(message.sender_id, message.recipient_id).update(values)
+
+    @classmethod
+    def unread_count(cls, user_id, other_user_id):
+        """Unread messages of user_id in the conversation, or None when it has no row yet"""
+        low, high = cls.pair(user_id, other_user_id)
+        return db.session.query(cls._unread_column(user_id, other_user_id)).filter(
+            cls.user_low_id == low, cls.user_high_id == high
+        ).scalar()
+
+    @classmethod
+    def mark_read(cls, user_id, other_user_id):
+        """Reset the unread counter of user_id in the conversation. Does not commit."""
+        cls._filter_pair(user_id, other_user_id).update({cls._unread_column(user_id, other_user_id): 0})
+
+    @classmethod
+    def count_unread(cls, user_id):
+        """Total unread messages of a user across all of their conversations"""
+        unread = db.case((cls.user_low_id == user_id, cls.unread_low), else_=cls.unread_high)
+        return db.session.query(db.func.sum(unread)).filter(
+            (cls.user_low_id == user_id) | (cls.user_high_id == user_id)
+        ).scalar() or 0
+
+    @classmethod
+    def for_user(cls, user_id):
+        """Conversations of a user, newest first, with their latest message and contact"""
+        from lms.models.user import User
+
+        contact_id = db.case((cls.user_low_id == user_id, cls.user_high_id), else_=cls.user_low_id)
+        unread = db.case((cls.user_low_id == user_id, cls.unread_low), else_=cls.unread_high)
+
+        rows = db.session.query(Message, User, unread).select_from(cls).join(
+            Message, Message.id == cls.last_message_id
+        ).join(
+            User, User.id == contact_id
+        ).filter(
+            (cls.user_low_id == user_id) | (cls.user_high_id == user_id)
+        ).order_by(cls.last_activity_at.desc(), Message.id.desc()).all()
+
+        return [{
+            'contact_id': contact.id,
+            'contact': contact,
+            'latest_message': latest_message,
+            'unread_count': unread_count
+        } for latest_message, contact, unread_count in rows]
+
+    @classmethod
+    def backfill(cls):
+        """Rebuild every conversation from the messages table. Does not commit."""
+        low = db.case((Message.sender_id < Message.recipient_id, Message.sender_id), else_=Message.recipient_id)
+        high = db.case((Message.sender_id < Message.recipient_id, Message.recipient_id), else_=Message.sender_id)
+        partition = (low, high)
+
+        def unread_for(side):
+            return db.func.sum(db.case(
+                ((Message.recipient_id == side) & (Message.read == False), 1), else_=0
+            )).over(partition_by=partition)
+
+        # Latest message per user pair with the unread messages of each side
+        ranked = db.session.query(
+            low.label('user_low_id'),
+            high.label('user_high_id'),
+            Message.id.label('last_message_id'),
+            Message.created_at.label('last_activity_at'),
+            db.func.row_number().over(
+                partition_by=partition,
+                order_by=(Message.created_at.desc(), Message.id.desc())
+            ).label('rank'),
+            unread_for(low).label('unread_low'),
+            unread_for(high).label('unread_high')
+        ).subquery()
+        columns = ('user_low_id', 'user_high_id', 'last_message_id', 'last_activity_at',
+                   'unread_low', 'unread_high')
+        rows = db.session.query(*(ranked.c[name] for name in columns)).filter(ranked.c.rank == 1).all()
+
+        db.session.execute(cls.__table__.delete())
+        if rows:
+            db.session.execute(cls.__table__.insert(), [dict(zip(columns, row)) for row in rows])
+        return len(rows)
@@ -0,0 +1,16 @@
+from datetime import datetime
+from lms.utils.db import db
+
+class StoredFile(db.Model):
+    """Uploaded file stored once under the hash of its content, with the number of rows referencing it"""
+    __tablename__ = 'stored_files'
+
+    path = db.Column(db.String(255), primary_key=True)  # 'uploads/ab/cd/<sha256><ext>', as the models store it
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, index=True)  # When the last reference went away, None while referenced
+
+    def __repr__(self):
+        return f'<StoredFile {self.path} refs={self.ref_count}>'
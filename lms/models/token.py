@@ -0,0 +1,14 @@
+from datetime import datetime
+from lms.utils.db import db
+
+class RevokedToken(db.Model):
+    """API access token revoked before it expired; rows are useless once expires_at has passed"""
+    __tablename__ = 'revoked_tokens'
+
+    jti = db.Column(db.String(32), primary_key=True)  # Token id from the signed claims
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
@@ -1,5 +1,7 @@
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from lms.utils.db import db
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -11,9 +13,29 @@ class Role(db.Model):
     description = db.Column(db.String(100))
     users = db.relationship('User', backref='role', lazy='dynamic')
     
+    # Role id -> name for the whole process; the roles table is tiny and practically static
+    _names = {}
+    
+    @classmethod
+    def name_for(cls, role_id):
+        """Name of a role without a query, loading every role on the first miss"""
+        if role_id not in cls._names:
+            cls._names = dict(db.session.query(cls.id, cls.name).all())
+        return cls._names.get(role_id)
+    
+    @classmethod
+    def clear_cache(cls):
+        cls._names = {}
+    
     def __repr__(self):
         return f'<Role {self.name}>'
 
+@event.listens_for(Session, 'after_flush')
+def _clear_role_cache(session, flush_context):
+    """Forget cached role names whenever roles are created, changed or deleted"""
+    if any(isinstance(obj, Role) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        Role.clear_cache()
+
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
     
@@ -56,14 +78,18 @@ class User(db.Model, UserMixin):
             print(f"Error verifying password: {str(e)}")
             return False
     
+    @property
+    def role_name(self):
+        return Role.name_for(self.role_id)
+    
     def is_admin(self):
-        return self.role.name == 'admin'
+        return self.role_name == 'admin'
     
     def is_teacher(self):
-        return self.role.name == 'teacher'
+        return self.role_name == 'teacher'
     
     def is_student(self):
-        return self.role.name == 'student'
+        return self.role_name == 'student'
     
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
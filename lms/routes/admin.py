@@ -2,13 +2,14 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from lms.utils.db import db
 from lms.utils.forms import TeacherCreationForm, CourseCreationForm, ModuleForm, AdminCreationForm
+from lms.utils.cache import memoize
+from lms.utils.tasks import delete_course as delete_course_task
 from lms.models.user import User, Role
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 from lms.models.course import (Course, Category, Enrollment, Module, Material, Test,
                                Assignment, Question, QuestionOption)
-from werkzeug.utils import secure_filename
-import os
+from lms.utils.storage import store_upload
 from datetime import datetime
 from functools import wraps
 
@@ -23,11 +24,9 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-@admin_bp.route('/dashboard')
-@login_required
-@admin_required
-def dashboard():
-    # Get statistics for dashboard
+@memoize(ttl=60, tags=['users', 'catalog'])
+def dashboard_stats():
+    """Site-wide counts for the admin dashboard"""
     total_students = User.query.join(Role).filter(Role.name == 'student').count()
     total_teachers = User.query.join(Role).filter(Role.name == 'teacher').count()
     total_courses = Course.query.count()
@@ -46,7 +45,7 @@ def dashboard():
     
     total_pending_payments = pending_teacher_payments + pending_student_payments
     
-    stats = {
+    return {
         'students': total_students,
         'teachers': total_teachers,
         'courses': total_courses,
@@ -55,8 +54,13 @@ def dashboard():
         'pending_teacher_payments': pending_teacher_payments,
         'pending_student_payments': pending_student_payments
     }
-    
-    return render_template('admin/dashboard.html', stats=stats)
+
+@admin_bp.route('/dashboard')
+@login_required
+@admin_required
+def dashboard():
+    # Statistics are cached until users, courses or enrollments change
+    return render_template('admin/dashboard.html', stats=dashboard_stats())
 
 @admin_bp.route('/teachers')
 @login_required
@@ -196,21 +200,7 @@ def edit_course(course_id):
     if form.validate_on_submit():
         # Handle image upload
         if form.course_image.data:
-            image = form.course_image.data
-            image_filename = secure_filename(image.filename)
-            # Create a unique filename to avoid collisions
-            unique_filename = f"admin_{int(datetime.utcnow().timestamp())}_{image_filename}"
-            image_path = os.path.join('uploads', 'course_images', unique_filename)
-            
-            # Make sure the directory exists
-            upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'course_images')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            # Save the file
-            image.save(os.path.join(upload_dir, unique_filename))
-            
-            # Update the course image path
-            course.image_path = image_path
+            course.image_path = store_upload(form.course_image.data)
             
         # Update other fields
         course.title = form.title.data
@@ -274,12 +264,14 @@ def edit_module(module_id):
 @admin_required
 def delete_course(course_id):
     course = Course.query.get_or_404(course_id)
+    course_title = course.title
     
-    # Delete the course and all related data
-    db.session.delete(course)
+    # Hide the course now; the worker deletes it with all related data
+    course.is_active = False
+    delete_course_task.delay(course_id=course.id)
     db.session.commit()
     
-    flash(f'Course "{course.title}" has been deleted.', 'success')
+    flash(f'Course "{course_title}" is being deleted.', 'success')
     return redirect(url_for('admin.manage_courses'))
 
 @admin_bp.route('/courses/approve/<int:course_id>', methods=['POST'])
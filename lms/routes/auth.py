@@ -33,7 +33,7 @@ def login():
         user = User.query.filter_by(email=email).first()
         
         if user:
-            logger.info(f"Found user: {user.email}, role: {user.role.name if user.role else None}, active: {user.is_active}")
+            logger.info(f"Found user: {user.email}, role: {user.role_name}, active: {user.is_active}")
             
             # Verify password using the verify_password method
             password_match = user.verify_password(password)
@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, current_app, send_from_directory
+from flask import Blueprint, render_template, redirect, url_for, flash, abort
 from flask_login import login_required, current_user
 from lms.models.course import Course, Material, Assignment
-import os
+from lms.utils.replica import route_reads_to_replica
+from lms.utils.conditional import conditional, course_version
+from lms.utils.files import stored_path, can_access_upload, send_upload
 
 course_bp = Blueprint('course', __name__)
+route_reads_to_replica(course_bp)
 
 @course_bp.route('/')
 @login_required
@@ -19,6 +22,7 @@ def list_courses():
 
 @course_bp.route('/<int:course_id>')
 @login_required
+@conditional(lambda course_id: course_version(course_id))
 def view_course(course_id):
     course = Course.query.get_or_404(course_id)
     
@@ -42,7 +46,7 @@ def view_material(material_id):
     # Check permissions: admin, course teacher, or enrolled student
     if not (current_user.is_admin() or 
             (current_user.is_teacher() and course.teacher_id == current_user.id) or 
-            (current_user.is_student() and any(e.student_id == current_user.id for e in course.enrollments))):
+            (current_user.is_student() and course.enrollments.filter_by(student_id=current_user.id).first())):
         flash('You do not have permission to access this material.', 'danger')
         return redirect(url_for('course.list_courses'))
     
@@ -51,7 +55,8 @@ def view_material(material_id):
 @course_bp.route('/uploads/<path:filename>')
 @login_required
 def download_file(filename):
-    uploads_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], '')
-    directory = os.path.dirname(uploads_folder)
-    filename = os.path.basename(filename)
-    return send_from_directory(directory, filename)
\ No newline at end of file
+    # Files the user may not see are reported missing rather than forbidden
+    path = stored_path(filename)
+    if not can_access_upload(path):
+        abort(404)
+    return send_upload(path)
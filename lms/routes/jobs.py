@@ -0,0 +1,15 @@
+from flask import Blueprint, jsonify, abort
+from flask_login import login_required, current_user
+from lms.utils.db import db
+from lms.models.job import Job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+@jobs_bp.route('/<int:job_id>')
+@login_required
+def status(job_id):
+    """Status of a background job, for pages polling until it has finished"""
+    job = db.session.get(Job, job_id)
+    if job is None or (job.created_by_id != current_user.id and not current_user.is_admin()):
+        abort(404)
+    return jsonify(job.to_dict())
@@ -1,11 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app as app
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, current_app as app
 from flask_login import login_required, current_user
 from lms.models.user import User
-from lms.models.message import Message
+from lms.models.message import Message, Conversation
 from lms.utils.db import db
+from lms.utils.pubsub import get_broker, publish, user_channel, format_sse, stream_slots
+from lms.utils.replica import route_reads_to_replica
 from sqlalchemy import or_
+import time
 
 messages_bp = Blueprint('messages', __name__)
+route_reads_to_replica(messages_bp)
 
 @messages_bp.route('/')
 @login_required
@@ -14,16 +18,13 @@ def inbox():
     try:
         conversations = Message.get_conversations_for_user(current_user.id)
         
-        # Get contact details for each conversation
-        contacts = []
-        for conv in conversations:
-            contact = User.query.get(conv['contact_id'])
-            if contact:
-                contacts.append({
-                    'user': contact,
-                    'latest_message': conv['latest_message'],
-                    'unread': not conv['latest_message'].read and conv['latest_message'].recipient_id == current_user.id
-                })
+        # Contacts are loaded together with the conversations
+        contacts = [{
+            'user': conv['contact'],
+            'latest_message': conv['latest_message'],
+            'unread': conv['unread_count'] > 0,
+            'unread_count': conv['unread_count']
+        } for conv in conversations]
         
         # Count total unread messages
         unread_count = Message.count_unread_messages(current_user.id)
@@ -188,25 +189,52 @@ def conversation(user_id):
         
         # Get messages and mark them as read
         try:
-            messages = Message.get_conversation(current_user.id, user_id)
-            Message.mark_conversation_as_read(current_user.id, user_id)
-            
-            # Reverse messages to show oldest first
-            messages.reverse()
+            # Latest page, oldest first; older pages are loaded from messages.history
+            messages, has_more = Message.get_conversation_page(current_user.id, user_id)
+            if Message.mark_conversation_as_read(current_user.id, user_id):
+                publish(user_channel(current_user.id), 'unread', {'count': Message.count_unread_messages(current_user.id)})
         except Exception as e:
             app.logger.error(f"Error getting messages: {str(e)}")
             messages = []
+            has_more = False
         
         return render_template(
             'messages/conversation.html', 
             other_user=other_user, 
-            messages=messages
+            messages=messages,
+            has_more=has_more
         )
     except Exception as e:
         app.logger.error(f"Error in conversation view: {str(e)}")
         flash("An error occurred loading the conversation. Please try again later.", "danger")
         return redirect(url_for('messages.inbox'))
 
+@messages_bp.route('/<int:user_id>/history')
+@login_required
+def history(user_id):
+    """Get a page of the conversation with a user as JSON
+
+    Pass before_id to page backwards from a message or after_id to fetch
+    the messages sent after it.
+    """
+    User.query.get_or_404(user_id)
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 100)
+
+    try:
+        messages, has_more = Message.get_conversation_page(
+            current_user.id, user_id, before_id=before_id, after_id=after_id, limit=limit
+        )
+    except Exception as e:
+        app.logger.error(f"Error getting message history: {str(e)}")
+        return jsonify({'messages': [], 'has_more': False}), 500
+
+    return jsonify({
+        'messages': [message.to_dict() for message in messages],
+        'has_more': has_more
+    })
+
 @messages_bp.route('/<int:user_id>/send', methods=['POST'])
 @login_required
 def send_message(user_id):
@@ -230,8 +258,14 @@ def send_message(user_id):
         )
         
         db.session.add(message)
+        db.session.flush()
+        Conversation.record_message(message)
         db.session.commit()
         
+        # Push the message and the new unread count to the recipient's open pages
+        publish(user_channel(user_id), 'message', message.to_dict())
+        publish(user_channel(user_id), 'unread', {'count': Message.count_unread_messages(user_id)})
+        
         return redirect(url_for('messages.conversation', user_id=user_id))
     except Exception as e:
         app.logger.error(f"Error sending message: {str(e)}")
@@ -247,4 +281,56 @@ def unread_count():
         return jsonify({'count': count})
     except Exception as e:
         app.logger.error(f"Error getting unread count: {str(e)}")
-        return jsonify({'count': 0})
\ No newline at end of file
+        return jsonify({'count': 0})
+
+@messages_bp.route('/<int:user_id>/read', methods=['POST'])
+@login_required
+def mark_read(user_id):
+    """Mark a conversation as read, for open pages showing messages as they arrive"""
+    if Message.mark_conversation_as_read(current_user.id, user_id):
+        count = Message.count_unread_messages(current_user.id)
+        publish(user_channel(current_user.id), 'unread', {'count': count})
+    else:
+        count = Message.count_unread_messages(current_user.id)
+    return jsonify({'count': count})
+
+@messages_bp.route('/stream')
+@login_required
+def stream():
+    """Server-Sent Events stream of unread counts and new messages for the current user
+
+    Every open stream holds a worker thread, so a process keeps at most
+    SSE_MAX_STREAMS of them and answers 503 beyond that; pages then poll
+    instead. Streams end after SSE_MAX_SECONDS and browsers reconnect, so
+    the slots go round the open tabs.
+    """
+    if not stream_slots.acquire(app.config.get('SSE_MAX_STREAMS', 4)):
+        return Response('Too many open message streams', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '60'})
+    try:
+        subscription = get_broker().subscribe(user_channel(current_user.id))
+        unread = Message.count_unread_messages(current_user.id)
+    except Exception:
+        stream_slots.release()
+        raise
+    keepalive = app.config.get('SSE_KEEPALIVE_SECONDS', 15)
+    deadline = time.monotonic() + app.config.get('SSE_MAX_SECONDS', 300)
+
+    # The generator runs after the request context is gone, so it must not touch the database
+    def events():
+        yield format_sse('unread', {'count': unread})
+        while time.monotonic() < deadline:
+            item = subscription.get(timeout=max(min(keepalive, deadline - time.monotonic()), 0))
+            yield format_sse(*item) if item else ': keep-alive\n\n'
+
+    # Runs when the server closes the response, even if the generator never started
+    def close():
+        subscription.close()
+        stream_slots.release()
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(close)
+    return response
@@ -6,13 +6,21 @@ from lms.models.course import (Course, Material, Assignment, Submission, Enrollm
                               Module, Test, Question, QuestionOption, TestAttempt, 
                               TestAnswer, ModuleProgress, Wishlist)
 from lms.models.user import User, Role
+from lms.utils.progress import StudentProgressService, get_enrollment_with_progress
+from lms.utils.gradebook import Gradebook
+from lms.utils.catalog import CourseCatalog
+from lms.utils.enrollment import CourseFullError
+from lms.utils.grading import (get_answer_key, save_answers, get_attempt_or_404, load_question_data,
+                               load_result_data)
+from lms.utils.replica import route_reads_to_replica
+from lms.utils.conditional import conditional, catalog_version, course_version, module_version
 from datetime import datetime
 import json
-from werkzeug.utils import secure_filename
-import os
+from lms.utils.storage import store_upload
 from functools import wraps
 
 student_bp = Blueprint('student', __name__)
+route_reads_to_replica(student_bp)
 
 def student_required(f):
     @wraps(f)
@@ -27,41 +35,12 @@ def student_required(f):
 @login_required
 @student_required
 def dashboard():
-    # Get courses this student is enrolled in
-    enrollments = Enrollment.query.filter_by(student_id=current_user.id).all()
-    enrolled_courses = [enrollment.course for enrollment in enrollments]
+    # Get courses this student is enrolled in with assignment statistics and progress
+    progress_service = StudentProgressService(current_user.id)
+    course_stats = progress_service.course_stats()
     
     # Get statistics
-    total_courses = len(enrolled_courses)
-    
-    # Get assignment statistics and progress
-    course_stats = []
-    for course in enrolled_courses:
-        assignments = Assignment.query.filter_by(course_id=course.id).all()
-        total_assignments = len(assignments)
-        
-        completed_assignments = 0
-        for assignment in assignments:
-            submission = Submission.query.filter_by(
-                assignment_id=assignment.id,
-                student_id=current_user.id
-            ).first()
-            if submission:
-                completed_assignments += 1
-        
-        if total_assignments > 0:
-            progress = (completed_assignments / total_assignments) * 100
-        else:
-            progress = 100  # No assignments means 100% complete
-        
-        course_stats.append({
-            'id': course.id,
-            'title': course.title,
-            'teacher': course.teacher.get_full_name(),
-            'total_assignments': total_assignments,
-            'completed_assignments': completed_assignments,
-            'progress': progress
-        })
+    total_courses = len(course_stats)
     
     return render_template('student/dashboard.html', 
                            total_courses=total_courses,
@@ -70,43 +49,20 @@ def dashboard():
 @student_bp.route('/courses')
 @login_required
 @student_required
+@conditional(lambda: catalog_version(current_user.id))
 def browse_courses():
     # Get search parameters
     search_query = request.args.get('search', '').strip()
     category_id = request.args.get('category_id', type=int)
-    sort_by = request.args.get('sort_by', 'popular')  # Default sort by popularity
-    
-    # Base query for available courses (active and approved)
-    query = Course.query.filter_by(is_active=True, is_approved=True)
-    
-    # Apply search filters
-    if search_query:
-        query = query.filter(Course.title.ilike(f'%{search_query}%'))
-    
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-    
-    # Get the filtered courses
-    courses = query.all()
-    
-    # Sort the courses
-    if sort_by == 'newest':
-        courses = sorted(courses, key=lambda c: c.created_at, reverse=True)
-    elif sort_by == 'title':
-        courses = sorted(courses, key=lambda c: c.title.lower())
-    else:  # Default: sort by popularity (enrollment count)
-        courses = sorted(courses, key=lambda c: c.enrollment_count, reverse=True)
-    
-    # Get all categories for the filter dropdown
-    categories = db.session.query(db.distinct(Course.category_id)).filter_by(is_active=True, is_approved=True).all()
-    category_list = []
-    for cat_id in categories:
-        if cat_id[0]:  # Skip None values
-            # Use query.get instead of get_or_404
-            from lms.models.course import Category
-            category = Category.query.get(cat_id[0])
-            if category:
-                category_list.append(category)
+    sort_by = request.args.get('sort_by')  # Defaults to relevance when searching, popularity otherwise
+    page = request.args.get('page', 1, type=int)
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    
+    # Filtering, sorting, counting and pagination all happen in SQL
+    catalog = CourseCatalog(search=search_query, category_id=category_id, sort_by=sort_by)
+    results = catalog.page(page, after=after, before=before)
+    category_facets = catalog.category_facets()
     
     # Get courses this student is already enrolled in
     enrollments = Enrollment.query.filter_by(student_id=current_user.id).all()
@@ -117,25 +73,25 @@ def browse_courses():
     wishlist_course_ids = [item.course_id for item in wishlist_items]
     
     # Get the count of students enrolled in each course for display
-    course_stats = {}
-    for course in courses:
-        course_stats[course.id] = {
-            'enrollment_count': course.enrollment_count
-        }
+    course_stats = {course_id: {'enrollment_count': count}
+                    for course_id, count in results.enrollment_counts.items()}
     
     return render_template('student/browse_courses.html', 
-                          courses=courses, 
+                          courses=results.courses, 
+                          results=results,
                           enrolled_course_ids=enrolled_course_ids,
                           wishlist_course_ids=wishlist_course_ids,
-                          categories=category_list,
+                          categories=[category for category, _ in category_facets],
+                          category_counts={category.id: count for category, count in category_facets},
                           search_query=search_query,
                           selected_category=category_id,
-                          sort_by=sort_by,
+                          sort_by=catalog.sort_by,
                           course_stats=course_stats)
 
 @student_bp.route('/courses/<int:course_id>')
 @login_required
 @student_required
+@conditional(lambda course_id: course_version(course_id, current_user.id))
 def view_course(course_id):
     course = Course.query.get_or_404(course_id)
     
@@ -163,18 +119,19 @@ def view_course(course_id):
         course_id=course.id
     ).first()
     
-    materials = Material.query.filter_by(course_id=course.id).all()
+    # Only loaded when the cached materials fragment is stale
+    materials = Material.query.filter_by(course_id=course.id).order_by(Material.id)
     assignments = Assignment.query.filter_by(course_id=course.id).all()
     
     # Check which assignments have been submitted
     submitted_assignments = []
-    for assignment in assignments:
-        submission = Submission.query.filter_by(
-            assignment_id=assignment.id,
-            student_id=current_user.id
-        ).first()
-        if submission:
-            submitted_assignments.append(assignment.id)
+    if assignments:
+        submitted_assignments = [assignment_id for (assignment_id,) in db.session.query(
+            Submission.assignment_id
+        ).filter(
+            Submission.assignment_id.in_([assignment.id for assignment in assignments]),
+            Submission.student_id == current_user.id
+        ).distinct()]
     
     return render_template('student/view_course.html', 
                            course=course, 
@@ -226,18 +183,7 @@ def enroll_course(course_id):
         
         # Handle payment receipt upload
         if form.payment_receipt.data:
-            receipt = form.payment_receipt.data
-            receipt_filename = secure_filename(receipt.filename)
-            # Create a unique filename
-            unique_receipt_name = f"student_{current_user.id}_{int(datetime.utcnow().timestamp())}_{receipt_filename}"
-            payment_receipt_path = os.path.join('uploads', 'payment_receipts', unique_receipt_name)
-            
-            # Make sure the directory exists
-            receipt_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'payment_receipts')
-            os.makedirs(receipt_dir, exist_ok=True)
-            
-            # Save the file
-            receipt.save(os.path.join(receipt_dir, unique_receipt_name))
+            payment_receipt_path = store_upload(form.payment_receipt.data)
         
         # Create enrollment with payment information
         enrollment = Enrollment(
@@ -249,7 +195,13 @@ def enroll_course(course_id):
             payment_date=datetime.utcnow()
         )
         db.session.add(enrollment)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except CourseFullError:
+            # Another student took the last seat since the check above
+            db.session.rollback()  # The stored receipt, if now unreferenced, is left to collect_garbage()
+            flash('This course has reached its maximum student capacity. Please try again later or contact the teacher.', 'warning')
+            return redirect(url_for('student.view_course', course_id=course_id))
         
         flash('Your enrollment request has been submitted with payment receipt. You will have full access to the course after payment verification.', 'success')
         return redirect(url_for('student.view_course', course_id=course.id))
@@ -371,12 +323,6 @@ def view_assignment(assignment_id):
                            submission=submission, 
                            form=form)
 
-def save_file(file):
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    file.save(file_path)
-    return os.path.join('uploads', filename)
-
 @student_bp.route('/assignments/<int:assignment_id>/submit', methods=['POST'])
 @login_required
 @student_required
@@ -408,7 +354,7 @@ def submit_assignment(assignment_id):
     if form.validate_on_submit():
         file_path = None
         if form.file.data:
-            file_path = save_file(form.file.data)
+            file_path = store_upload(form.file.data)
         
         submission = Submission(
             content=form.content.data,
@@ -430,26 +376,8 @@ def submit_assignment(assignment_id):
 @login_required
 @student_required
 def my_assignments():
-    # Get all enrollments for this student
-    enrollments = Enrollment.query.filter_by(student_id=current_user.id).all()
-    course_ids = [enrollment.course_id for enrollment in enrollments]
-    
-    # Get all assignments for these courses
-    assignments = Assignment.query.filter(Assignment.course_id.in_(course_ids)).all()
-    
-    # Get submissions for these assignments
-    assignment_data = []
-    for assignment in assignments:
-        submission = Submission.query.filter_by(
-            assignment_id=assignment.id,
-            student_id=current_user.id
-        ).first()
-        
-        assignment_data.append({
-            'assignment': assignment,
-            'course': assignment.course,
-            'submission': submission
-        })
+    # Get all assignments of the student's courses paired with their submissions
+    assignment_data = StudentProgressService(current_user.id).assignment_data()
     
     return render_template('student/my_assignments.html', assignment_data=assignment_data)
 
@@ -459,11 +387,8 @@ def my_assignments():
 def view_course_modules(course_id):
     course = Course.query.get_or_404(course_id)
     
-    # Check if student is enrolled
-    enrollment = Enrollment.query.filter_by(
-        student_id=current_user.id,
-        course_id=course.id
-    ).first()
+    # Check if student is enrolled; the stored progress counters come with the enrollment
+    enrollment, enrollment_progress = get_enrollment_with_progress(current_user.id, course.id)
     
     if not enrollment:
         flash('You must be enrolled in this course to view modules.', 'danger')
@@ -476,30 +401,33 @@ def view_course_modules(course_id):
     
     # Get all modules for this course
     modules = Module.query.filter_by(course_id=course.id).order_by(Module.order).all()
+    module_ids = [module.id for module in modules]
+    
+    # Load module completion, test counts and passed tests for all modules at once
+    completed_module_ids = {progress.module_id for progress in ModuleProgress.query.filter(
+        ModuleProgress.student_id == current_user.id,
+        ModuleProgress.module_id.in_(module_ids),
+        ModuleProgress.completed == True
+    ).all()} if module_ids else set()
+    
+    test_counts = dict(db.session.query(Test.module_id, db.func.count(Test.id)).filter(
+        Test.module_id.in_(module_ids)
+    ).group_by(Test.module_id).all()) if module_ids else {}
+    
+    passed_counts = dict(db.session.query(
+        Test.module_id, db.func.count(db.distinct(TestAttempt.test_id))
+    ).join(
+        TestAttempt, TestAttempt.test_id == Test.id
+    ).filter(
+        Test.module_id.in_(module_ids),
+        TestAttempt.student_id == current_user.id,
+        TestAttempt.passed == True
+    ).group_by(Test.module_id).all()) if module_ids else {}
     
-    # Get progress for each module
     module_data = []
     for module in modules:
-        progress = ModuleProgress.query.filter_by(
-            student_id=current_user.id,
-            module_id=module.id
-        ).first()
-        
-        # Count completed tests
-        test_count = Test.query.filter_by(module_id=module.id).count()
-        passed_tests = 0
-        
-        tests = Test.query.filter_by(module_id=module.id).all()
-        for test in tests:
-            # Check if any attempt passed
-            best_attempt = TestAttempt.query.filter_by(
-                test_id=test.id,
-                student_id=current_user.id,
-                passed=True
-            ).first()
-            
-            if best_attempt:
-                passed_tests += 1
+        test_count = test_counts.get(module.id, 0)
+        passed_tests = passed_counts.get(module.id, 0)
         
         # Calculate test completion percentage
         test_completion = 0
@@ -508,7 +436,7 @@ def view_course_modules(course_id):
         
         module_data.append({
             'module': module,
-            'completed': progress.completed if progress else False,
+            'completed': module.id in completed_module_ids,
             'test_count': test_count,
             'passed_tests': passed_tests,
             'test_completion': test_completion
@@ -517,11 +445,13 @@ def view_course_modules(course_id):
     return render_template('student/view_course_modules.html',
                           course=course,
                           module_data=module_data,
-                          enrollment=enrollment)
+                          enrollment=enrollment,
+                          enrollment_progress=enrollment_progress)
 
 @student_bp.route('/modules/<int:module_id>')
 @login_required
 @student_required
+@conditional(lambda module_id: module_version(module_id, current_user.id))
 def view_module(module_id):
     module = Module.query.get_or_404(module_id)
     course = module.course
@@ -536,27 +466,30 @@ def view_module(module_id):
         flash('You must be enrolled in this course to view modules.', 'danger')
         return redirect(url_for('student.browse_courses'))
     
-    # Get materials and tests for this module
-    materials = Material.query.filter_by(module_id=module.id).order_by(Material.order).all()
+    # Materials are only loaded when the cached fragment is stale
+    materials = Material.query.filter_by(module_id=module.id).order_by(Material.order)
     tests = Test.query.filter_by(module_id=module.id).all()
     
-    # Get test progress
+    # Get test progress: the student's attempts at every test of the module in one query
+    attempts = {}
+    if tests:
+        for attempt in TestAttempt.query.filter(
+            TestAttempt.test_id.in_([test.id for test in tests]),
+            TestAttempt.student_id == current_user.id
+        ).order_by(TestAttempt.score.desc(), TestAttempt.id):
+            attempts.setdefault(attempt.test_id, []).append(attempt)
+    
     test_data = []
     for test in tests:
-        # Get best attempt (highest score)
-        best_attempt = TestAttempt.query.filter_by(
-            test_id=test.id,
-            student_id=current_user.id
-        ).order_by(TestAttempt.score.desc()).first()
+        # Best attempt (highest score) first
+        test_attempts = attempts.get(test.id, [])
+        best_attempt = test_attempts[0] if test_attempts else None
         
         test_data.append({
             'test': test,
             'attempt': best_attempt,
             'passed': best_attempt.passed if best_attempt else False,
-            'attempts_count': TestAttempt.query.filter_by(
-                test_id=test.id,
-                student_id=current_user.id
-            ).count()
+            'attempts_count': len(test_attempts)
         })
     
     # Check if module is completed
@@ -719,7 +652,7 @@ def start_test(test_id):
 @login_required
 @student_required
 def take_test(attempt_id):
-    attempt = TestAttempt.query.get_or_404(attempt_id)
+    attempt = get_attempt_or_404(attempt_id)
     test = attempt.test
     module = test.module
     course = module.course
@@ -733,88 +666,12 @@ def take_test(attempt_id):
     if attempt.completed_at:
         return redirect(url_for('student.view_test_results', attempt_id=attempt.id))
     
-    # Get all questions for this test
-    questions = Question.query.filter_by(test_id=test.id).all()
-    
     # Process form submission
     form = TestAttemptForm()
     if form.validate_on_submit():
-        total_points = 0
-        earned_points = 0
-        
-        for question in questions:
-            # Process each question's answer
-            if question.question_type == 'multiple_choice':
-                # Get selected option IDs from form
-                option_key = f'question_{question.id}'
-                selected_options = request.form.getlist(option_key)
-                selected_options_str = ','.join(selected_options)
-                
-                # Calculate points for multiple choice
-                correct_options = QuestionOption.query.filter_by(
-                    question_id=question.id,
-                    is_correct=True
-                ).all()
-                
-                correct_option_ids = [str(opt.id) for opt in correct_options]
-                
-                # Only award points if the selection exactly matches the correct answers
-                is_correct = set(selected_options) == set(correct_option_ids)
-                points_earned = question.points if is_correct else 0
-                
-                answer = TestAnswer(
-                    attempt_id=attempt.id,
-                    question_id=question.id,
-                    selected_options=selected_options_str,
-                    points_earned=points_earned
-                )
-                db.session.add(answer)
-                
-            elif question.question_type == 'true_false':
-                # True/False is a special case of multiple choice
-                option_key = f'question_{question.id}'
-                selected_option = request.form.get(option_key)
-                
-                if selected_option:
-                    # Find if the selected option is correct
-                    option = QuestionOption.query.get(int(selected_option))
-                    points_earned = question.points if option and option.is_correct else 0
-                    
-                    answer = TestAnswer(
-                        attempt_id=attempt.id,
-                        question_id=question.id,
-                        selected_options=selected_option,
-                        points_earned=points_earned
-                    )
-                    db.session.add(answer)
-                else:
-                    # No answer provided
-                    answer = TestAnswer(
-                        attempt_id=attempt.id,
-                        question_id=question.id,
-                        points_earned=0
-                    )
-                    db.session.add(answer)
-            
-            elif question.question_type == 'essay':
-                # For essay questions, just save the response (teacher will grade manually)
-                answer_key = f'question_{question.id}_essay'
-                answer_text = request.form.get(answer_key, '')
-                
-                answer = TestAnswer(
-                    attempt_id=attempt.id,
-                    question_id=question.id,
-                    answer_text=answer_text,
-                    points_earned=0  # Essay questions need manual grading
-                )
-                db.session.add(answer)
-            
-            # Update point totals
-            total_points += question.points
-            earned_points += answer.points_earned if hasattr(answer, 'points_earned') else 0
-        
-        # Calculate score as a percentage
-        score = (earned_points / total_points * 100) if total_points > 0 else 0
+        # Grade against the cached answer key and save all answers at once
+        answers, score = get_answer_key(test).grade(attempt.id, request.form)
+        save_answers(answers)
         
         # Update the attempt record
         attempt.score = score
@@ -825,17 +682,8 @@ def take_test(attempt_id):
         flash('Test submitted successfully!', 'success')
         return redirect(url_for('student.view_test_results', attempt_id=attempt.id))
     
-    # Prepare question data for the template
-    question_data = []
-    for question in questions:
-        options = []
-        if question.question_type in ['multiple_choice', 'true_false']:
-            options = QuestionOption.query.filter_by(question_id=question.id).all()
-        
-        question_data.append({
-            'question': question,
-            'options': options
-        })
+    # Questions and their options, loaded in two queries
+    question_data = load_question_data(test.id)
     
     return render_template('student/take_test.html',
                           course=course,
@@ -849,7 +697,7 @@ def take_test(attempt_id):
 @login_required
 @student_required
 def view_test_results(attempt_id):
-    attempt = TestAttempt.query.get_or_404(attempt_id)
+    attempt = get_attempt_or_404(attempt_id)
     test = attempt.test
     module = test.module
     course = module.course
@@ -864,33 +712,8 @@ def view_test_results(attempt_id):
         flash('This test has not been completed yet.', 'warning')
         return redirect(url_for('student.take_test', attempt_id=attempt.id))
     
-    # Get all questions and answers
-    questions = Question.query.filter_by(test_id=test.id).all()
-    
-    # Prepare results data
-    result_data = []
-    for question in questions:
-        answer = TestAnswer.query.filter_by(
-            attempt_id=attempt.id,
-            question_id=question.id
-        ).first()
-        
-        options = []
-        selected_options = []
-        
-        if question.question_type in ['multiple_choice', 'true_false']:
-            options = QuestionOption.query.filter_by(question_id=question.id).all()
-            
-            if answer and answer.selected_options:
-                selected_ids = answer.selected_options.split(',')
-                selected_options = [int(opt_id) for opt_id in selected_ids if opt_id]
-        
-        result_data.append({
-            'question': question,
-            'answer': answer,
-            'options': options,
-            'selected_options': selected_options
-        })
+    # Questions, options and answers, loaded in three queries
+    result_data = load_result_data(attempt)
     
     return render_template('student/test_results.html',
                           course=course,
@@ -903,78 +726,29 @@ def view_test_results(attempt_id):
 @login_required
 @student_required
 def view_grades():
-    # Get all enrollments for this student
-    enrollments = Enrollment.query.filter_by(student_id=current_user.id).all()
+    # Get all enrollments for this student with their stored progress counters
+    progress_service = StudentProgressService(current_user.id)
+    enrollments = progress_service.enrollments
+    progress_rows = progress_service.enrollment_progress()
+    module_totals = progress_service.module_totals()
+    
+    # Load the grade of every assignment and best test attempt for every course at once
+    gradebook = Gradebook(progress_service.course_ids, [current_user.id], parts=('assignments', 'tests'))
     
     # Prepare course data with grades
     course_data = []
     for enrollment in enrollments:
         course = enrollment.course
-        
-        # Get assignment grades
-        assignment_grades = []
-        assignments = Assignment.query.filter_by(course_id=course.id).all()
-        
-        for assignment in assignments:
-            submission = Submission.query.filter_by(
-                assignment_id=assignment.id,
-                student_id=current_user.id
-            ).first()
-            
-            if submission and submission.grade is not None:
-                assignment_grades.append({
-                    'name': assignment.title,
-                    'grade': submission.grade,
-                    'feedback': submission.feedback,
-                    'submitted_at': submission.submitted_at,
-                    'graded_at': submission.graded_at
-                })
-        
-        # Get test grades
-        test_grades = []
-        module_ids = [module.id for module in Module.query.filter_by(course_id=course.id).all()]
-        
-        if module_ids:
-            tests = Test.query.filter(Test.module_id.in_(module_ids)).all()
-            
-            for test in tests:
-                # Get the best attempt
-                best_attempt = TestAttempt.query.filter_by(
-                    test_id=test.id,
-                    student_id=current_user.id
-                ).order_by(TestAttempt.score.desc()).first()
-                
-                if best_attempt and best_attempt.score is not None:
-                    test_grades.append({
-                        'name': test.title,
-                        'grade': best_attempt.score,
-                        'passed': best_attempt.passed,
-                        'completed_at': best_attempt.completed_at
-                    })
-        
-        # Calculate course completion percentage
-        modules = Module.query.filter_by(course_id=course.id).all()
-        total_modules = len(modules)
-        completed_modules = 0
-        
-        for module in modules:
-            progress = ModuleProgress.query.filter_by(
-                module_id=module.id,
-                student_id=current_user.id,
-                completed=True
-            ).first()
-            
-            if progress:
-                completed_modules += 1
-        
-        completion_percentage = (completed_modules / total_modules * 100) if total_modules > 0 else 0
+        progress = progress_rows[course.id]
+        total_modules = module_totals.get(course.id, 0)
         
         course_data.append({
             'course': course,
-            'overall_grade': enrollment.overall_grade,
-            'assignment_grades': assignment_grades,
-            'test_grades': test_grades,
-            'completion_percentage': completion_percentage
+            'progress': progress,
+            'overall_grade': progress.overall_grade,
+            'assignment_grades': gradebook.assignment_grades(current_user.id, course.id),
+            'test_grades': gradebook.test_grades(current_user.id, course.id),
+            'completion_percentage': (progress.modules_completed / total_modules * 100) if total_modules > 0 else 0
         })
     
     return render_template('student/view_grades.html', course_data=course_data)
@@ -996,21 +770,8 @@ def teacher_application():
     if form.validate_on_submit():
         try:
             # Handle certificate upload
-            certificate_file = form.certificate.data
-            filename = secure_filename(certificate_file.filename)
-            # Create a unique filename
-            unique_filename = f"certificate_{current_user.id}_{int(datetime.utcnow().timestamp())}_{filename}"
-            certificate_path = os.path.join('uploads', 'certificates', unique_filename)
-            
-            # Make sure the directory exists
-            upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'certificates')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            # Save the file
-            certificate_file.save(os.path.join(upload_dir, unique_filename))
-            
             # Update user record
-            current_user.certificate_path = certificate_path
+            current_user.certificate_path = store_upload(form.certificate.data)
             current_user.certificate_description = form.description.data
             current_user.certificate_submitted_at = datetime.utcnow()
             current_user.certificate_verified = False
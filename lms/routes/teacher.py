@@ -7,8 +7,10 @@ from lms.models.user import User, Role
 from lms.models.course import (Course, Category, Material, Assignment, Submission, Enrollment,
                               Module, Test, Question, QuestionOption, TestAttempt, TestAnswer, 
                               ModuleProgress, TeacherSubscriptionPlan)
-from werkzeug.utils import secure_filename
-import os
+from lms.utils.gradebook import Gradebook
+from lms.utils.deletion import delete_modules, delete_tests
+from lms.utils.tasks import recompute_course_grade, notify_course_students, delete_course as delete_course_task
+from lms.utils.storage import store_upload
 from functools import wraps
 from datetime import datetime
 
@@ -42,15 +44,18 @@ def dashboard():
     active_courses = sum(1 for course in all_courses if course.is_active and course.is_approved)
     
     # Process course stats for approved courses only
+    assignment_counts = dict(db.session.query(
+        Assignment.course_id, db.func.count(Assignment.id)
+    ).filter(
+        Assignment.course_id.in_([course.id for course in approved_courses])
+    ).group_by(Assignment.course_id).all()) if approved_courses else {}
     course_stats = []
     for course in approved_courses:
-        enrollments = Enrollment.query.filter_by(course_id=course.id).count()
-        assignments = Assignment.query.filter_by(course_id=course.id).count()
         course_stats.append({
             'id': course.id,
             'title': course.title,
-            'enrollments': enrollments,
-            'assignments': assignments,
+            'enrollments': course.enrollment_count,
+            'assignments': assignment_counts.get(course.id, 0),
             'is_active': course.is_active
         })
     
@@ -99,60 +104,13 @@ def delete_course(course_id):
     course_title = course.title
     
     try:
-        # Delete all enrollments
-        enrollments = Enrollment.query.filter_by(course_id=course.id).all()
-        for enrollment in enrollments:
-            db.session.delete(enrollment)
-        
-        # Delete all assignments and submissions
-        assignments = Assignment.query.filter_by(course_id=course.id).all()
-        for assignment in assignments:
-            # Delete submissions
-            from lms.models.course import Submission
-            submissions = Submission.query.filter_by(assignment_id=assignment.id).all()
-            for submission in submissions:
-                db.session.delete(submission)
-            db.session.delete(assignment)
-        
-        # Delete all modules and their content
-        modules = Module.query.filter_by(course_id=course.id).all()
-        for module in modules:
-            # Delete materials
-            Material.query.filter_by(module_id=module.id).delete()
-            
-            # Delete tests and their content
-            tests = Test.query.filter_by(module_id=module.id).all()
-            for test in tests:
-                # Delete questions and options
-                questions = Question.query.filter_by(test_id=test.id).all()
-                for question in questions:
-                    QuestionOption.query.filter_by(question_id=question.id).delete()
-                    db.session.delete(question)
-                
-                # Delete test attempts and answers
-                from lms.models.course import TestAttempt, TestAnswer
-                attempts = TestAttempt.query.filter_by(test_id=test.id).all()
-                for attempt in attempts:
-                    TestAnswer.query.filter_by(attempt_id=attempt.id).delete()
-                    db.session.delete(attempt)
-                
-                db.session.delete(test)
-            
-            # Delete module progress
-            from lms.models.course import ModuleProgress
-            ModuleProgress.query.filter_by(module_id=module.id).delete()
-            
-            # Delete the module
-            db.session.delete(module)
-        
-        # Delete course materials not associated with a module
-        Material.query.filter_by(course_id=course.id, module_id=None).delete()
-        
-        # Delete the course
-        db.session.delete(course)
+        # Hide the course now; the worker deletes it with everything below it
+        course.is_active = False
+        job = delete_course_task.delay(course_id=course.id)
         db.session.commit()
+        current_app.logger.info(f"Queued deletion of course {course_id} as job {job.id}")
         
-        flash(f'Course "{course_title}" has been deleted successfully.', 'success')
+        flash(f'Course "{course_title}" is being deleted.', 'success')
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error deleting course: {str(e)}")
@@ -177,21 +135,8 @@ def certificate():
             # Handle certificate upload
             if form.certificate.data:
                 try:
-                    certificate_file = form.certificate.data
-                    filename = secure_filename(certificate_file.filename)
-                    # Create a unique filename
-                    unique_filename = f"certificate_{current_user.id}_{int(datetime.utcnow().timestamp())}_{filename}"
-                    certificate_path = os.path.join('uploads', 'certificates', unique_filename)
-                    
-                    # Make sure the directory exists
-                    upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'certificates')
-                    os.makedirs(upload_dir, exist_ok=True)
-                    
-                    # Save the file
-                    certificate_file.save(os.path.join(upload_dir, unique_filename))
-                    
                     # Update user record
-                    current_user.certificate_path = certificate_path
+                    current_user.certificate_path = store_upload(form.certificate.data)
                     current_user.certificate_submitted_at = datetime.utcnow()
                     current_user.certificate_verified = False
                     
@@ -280,33 +225,11 @@ def create_course():
         
         # Handle course image upload
         if form.course_image.data:
-            image = form.course_image.data
-            image_filename = secure_filename(image.filename)
-            # Create a unique filename to avoid collisions
-            unique_filename = f"{current_user.id}_{int(datetime.utcnow().timestamp())}_{image_filename}"
-            image_path = os.path.join('uploads', 'course_images', unique_filename)
-            
-            # Make sure the directory exists
-            upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'course_images')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            # Save the file
-            image.save(os.path.join(upload_dir, unique_filename))
+            image_path = store_upload(form.course_image.data)
         
         # Handle payment receipt upload
         if form.payment_receipt.data:
-            receipt = form.payment_receipt.data
-            receipt_filename = secure_filename(receipt.filename)
-            # Create a unique filename
-            unique_receipt_name = f"teacher_{current_user.id}_{int(datetime.utcnow().timestamp())}_{receipt_filename}"
-            payment_receipt_path = os.path.join('uploads', 'payment_receipts', unique_receipt_name)
-            
-            # Make sure the directory exists
-            receipt_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'payment_receipts')
-            os.makedirs(receipt_dir, exist_ok=True)
-            
-            # Save the file
-            receipt.save(os.path.join(receipt_dir, unique_receipt_name))
+            payment_receipt_path = store_upload(form.payment_receipt.data)
         
         try:
             # Create the course with payment information
@@ -379,31 +302,6 @@ def add_course_content(course_id):
                            material_form=material_form, 
                            assignment_form=assignment_form)
 
-def save_file(file):
-    try:
-        # Create a meaningful filename with timestamp to avoid collisions
-        original_filename = secure_filename(file.filename)
-        # Add timestamp to make filename unique
-        filename = f"{int(datetime.utcnow().timestamp())}_{original_filename}"
-        
-        # Create upload directory if it doesn't exist
-        upload_dir = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Full path for saving
-        file_path = os.path.join(upload_dir, filename)
-        
-        # Save the file
-        file.save(file_path)
-        
-        # Return the relative path for storing in database
-        relative_path = os.path.join('uploads', filename)
-        current_app.logger.debug(f"File saved at {file_path}, relative path: {relative_path}")
-        return relative_path
-    except Exception as e:
-        current_app.logger.error(f"Error saving file: {str(e)}")
-        raise Exception(f"Error saving file: {str(e)}")
-
 @teacher_bp.route('/courses/<int:course_id>/materials/add', methods=['POST'])
 @login_required
 @teacher_required
@@ -421,7 +319,7 @@ def add_material(course_id):
         content = form.content.data
         
         if form.content_type.data == 'file' and form.file.data:
-            file_path = save_file(form.file.data)
+            file_path = store_upload(form.file.data)
         
         material = Material(
             title=form.title.data,
@@ -486,6 +384,30 @@ def course_students(course_id):
                            course=course, 
                            students=enrolled_students)
 
+@teacher_bp.route('/courses/<int:course_id>/announce', methods=['POST'])
+@login_required
+@teacher_required
+def announce(course_id):
+    course = Course.query.get_or_404(course_id)
+    
+    # Ensure the teacher is the owner of the course
+    if course.teacher_id != current_user.id:
+        flash('You do not have permission to message this course.', 'danger')
+        return redirect(url_for('teacher.dashboard'))
+    
+    content = request.form.get('content', '').strip()
+    if not content:
+        flash('Message cannot be empty.', 'danger')
+        return redirect(url_for('teacher.course_students', course_id=course.id))
+    
+    # One message per student is written by the worker
+    notify_course_students.delay(sender_id=current_user.id, course_id=course.id, content=content,
+                                 sent_at=datetime.utcnow().isoformat())
+    db.session.commit()
+    
+    flash(f'Your message is being sent to {course.enrollment_count} students.', 'success')
+    return redirect(url_for('teacher.course_students', course_id=course.id))
+
 @teacher_bp.route('/assignments/<int:assignment_id>/submissions')
 @login_required
 @teacher_required
@@ -524,10 +446,10 @@ def grade_submission(submission_id):
         submission.grade = form.grade.data
         submission.feedback = form.feedback.data
         submission.graded_at = datetime.utcnow()
-        db.session.commit()
         
-        # Update overall student grade for the course
-        update_student_course_grade(submission.student_id, course.id)
+        # Update overall student grade for the course in the background
+        recompute_course_grade.delay(student_id=submission.student_id, course_id=course.id)
+        db.session.commit()
         
         flash('Submission graded successfully!', 'success')
         return redirect(url_for('teacher.assignment_submissions', assignment_id=assignment.id))
@@ -542,61 +464,6 @@ def grade_submission(submission_id):
                            assignment=assignment, 
                            student=submission.student)
 
-def update_student_course_grade(student_id, course_id):
-    """Calculate and update the overall grade for a student in a course"""
-    # Get all assignments for this course
-    assignments = Assignment.query.filter_by(course_id=course_id).all()
-    
-    if not assignments:
-        return  # No assignments to grade
-    
-    total_points = 0
-    earned_points = 0
-    
-    # Calculate points from assignments
-    for assignment in assignments:
-        submission = Submission.query.filter_by(
-            assignment_id=assignment.id, 
-            student_id=student_id
-        ).first()
-        
-        # If the submission exists and has been graded
-        if submission and submission.grade is not None:
-            # Assume all assignments are worth 100 points
-            total_points += 100
-            earned_points += submission.grade
-    
-    # Get test attempts
-    module_ids = [module.id for module in Module.query.filter_by(course_id=course_id).all()]
-    
-    if module_ids:
-        tests = Test.query.filter(Test.module_id.in_(module_ids)).all()
-        
-        for test in tests:
-            # Get the best attempt for this test
-            best_attempt = TestAttempt.query.filter_by(
-                test_id=test.id,
-                student_id=student_id
-            ).order_by(TestAttempt.score.desc()).first()
-            
-            if best_attempt and best_attempt.score is not None:
-                total_points += 100
-                earned_points += best_attempt.score
-    
-    # Calculate overall grade if there are points possible
-    if total_points > 0:
-        overall_grade = (earned_points / total_points) * 100
-        
-        # Update the enrollment record
-        enrollment = Enrollment.query.filter_by(
-            student_id=student_id,
-            course_id=course_id
-        ).first()
-        
-        if enrollment:
-            enrollment.overall_grade = overall_grade
-            db.session.commit()
-
 # Module management routes
 @teacher_bp.route('/courses/<int:course_id>/modules')
 @login_required
@@ -634,35 +501,10 @@ def delete_module(module_id):
     module_title = module.title
     
     try:
-        # Delete all materials in the module
-        Material.query.filter_by(module_id=module.id).delete()
-        
-        # Delete all tests in the module
-        tests = Test.query.filter_by(module_id=module.id).all()
-        for test in tests:
-            # Delete all questions in the test
-            questions = Question.query.filter_by(test_id=test.id).all()
-            for question in questions:
-                # Delete all options for the question
-                QuestionOption.query.filter_by(question_id=question.id).delete()
-                db.session.delete(question)
-            
-            # Delete all attempts
-            from lms.models.course import TestAttempt, TestAnswer
-            attempts = TestAttempt.query.filter_by(test_id=test.id).all()
-            for attempt in attempts:
-                TestAnswer.query.filter_by(attempt_id=attempt.id).delete()
-                db.session.delete(attempt)
-                
-            db.session.delete(test)
-        
-        # Delete module progress
-        from lms.models.course import ModuleProgress
-        ModuleProgress.query.filter_by(module_id=module.id).delete()
-        
-        # Delete the module itself
-        db.session.delete(module)
+        # Delete the module with its materials, tests and progress
+        report = delete_modules([module.id])
         db.session.commit()
+        report.remove_files()
         
         flash(f'Module "{module_title}" has been deleted successfully.', 'success')
     except Exception as e:
@@ -758,7 +600,7 @@ def add_module_material(module_id):
         # Handle file upload
         if form.content_type.data == 'file' and form.file.data:
             try:
-                file_path = save_file(form.file.data)
+                file_path = store_upload(form.file.data)
                 current_app.logger.debug(f"File saved to {file_path}")
             except Exception as e:
                 current_app.logger.error(f"Error saving file: {str(e)}")
@@ -883,22 +725,8 @@ def delete_test(test_id):
     test_title = test.title
     
     try:
-        # Delete all questions and options
-        questions = Question.query.filter_by(test_id=test.id).all()
-        for question in questions:
-            # Delete options
-            QuestionOption.query.filter_by(question_id=question.id).delete()
-            db.session.delete(question)
-        
-        # Delete all attempts and answers
-        from lms.models.course import TestAttempt, TestAnswer
-        attempts = TestAttempt.query.filter_by(test_id=test.id).all()
-        for attempt in attempts:
-            TestAnswer.query.filter_by(attempt_id=attempt.id).delete()
-            db.session.delete(attempt)
-        
-        # Delete the test
-        db.session.delete(test)
+        # Delete the test with its questions, options, attempts and answers
+        delete_tests([test.id])
         db.session.commit()
         
         flash(f'Test "{test_title}" has been deleted successfully.', 'success')
@@ -0,0 +1,164 @@
+from collections import defaultdict
+from functools import wraps
+from flask import current_app, request
+from flask_login import current_user
+from flask_restx import abort, marshal
+from flask_restx.mask import MaskError
+from lms.utils.db import db
+from lms.models.course import Course, Module, Material, Test, Enrollment
+from lms.utils.tokens import bearer_token
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_IDS = 100
+
+
+def api_login_required(f):
+    """Answer 401 with a JSON body instead of redirecting to the login page"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401, 'Authentication required')
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def protect_cookie_sessions():
+    """CSRF check for API writes authenticated by the session cookie
+
+    The API blueprint is exempt from the global CSRF check because token
+    clients have no form to carry a CSRF token. Browsers cannot attach an
+    Authorization header to a cross-site request, and a request without the
+    session cookie acts for nobody, so only requests with the cookie and no
+    bearer token are checked; token clients can log in and register.
+    """
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or bearer_token(request):
+        return
+    if current_app.session_interface.get_cookie_name(current_app) not in request.cookies:
+        return
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        current_app.extensions['csrf'].protect()
+
+
+def field_mask():
+    """Field selection of the request, from ?fields= or the X-Fields header"""
+    return request.args.get('fields') or request.headers.get('X-Fields')
+
+
+def output(data, model):
+    """Marshal data with a model, keeping only the fields the client asked for"""
+    try:
+        return marshal(data, model, mask=field_mask())
+    except MaskError as e:
+        abort(400, f'Invalid fields: {e}')
+
+
+def parse_ids(limit=MAX_BATCH_IDS):
+    """Ids of the ?ids=1,2,3 batch parameter, in order and without duplicates, or None"""
+    raw = request.args.get('ids')
+    if raw is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        abort(400, 'ids must be a comma separated list of integers')
+    if len(ids) > limit:
+        abort(400, f'At most {limit} ids can be requested at once')
+    return ids
+
+
+def keyset_page(query, column, model):
+    """One page of a query ordered by a unique column, selected with ?after=<key>&limit=
+
+    The page starts after the key of the last item of the previous page, so
+    every page is an index range scan no matter how deep the client goes.
+    """
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.filter(column > after)
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(column).limit(limit + 1).all()
+    items = rows[:limit]
+    next_after = getattr(items[-1], column.key) if len(rows) > limit else None
+    return {'items': output(items, model), 'next_after': next_after}
+
+
+def visible_courses(query=None):
+    """Courses the current user may see: all for admins, their own and published ones otherwise"""
+    query = query if query is not None else Course.query
+    published = Course.is_active.is_(True) & Course.is_approved.is_(True)
+    if current_user.is_admin():
+        return query
+    if current_user.is_teacher():
+        return query.filter(published | (Course.teacher_id == current_user.id))
+    enrolled = db.select(Enrollment.course_id).where(Enrollment.student_id == current_user.id)
+    return query.filter(published | Course.id.in_(enrolled))
+
+
+def can_edit_course(course):
+    return current_user.is_admin() or (current_user.is_teacher() and course.teacher_id == current_user.id)
+
+
+def readable_course_ids(course_ids):
+    """The subset of course ids whose content the current user may read, in one query"""
+    if not course_ids:
+        return set()
+    if current_user.is_admin():
+        return set(course_ids)
+    if current_user.is_teacher():
+        rows = db.session.query(Course.id).filter(
+            Course.id.in_(course_ids), Course.teacher_id == current_user.id
+        )
+    else:
+        # As on the site, course content opens once the payment is verified
+        rows = db.session.query(Enrollment.course_id).filter(
+            Enrollment.course_id.in_(course_ids), Enrollment.student_id == current_user.id,
+            Enrollment.payment_verified == True
+        )
+    return {row[0] for row in rows}
+
+
+def can_read_course(course_id):
+    return course_id in readable_course_ids([course_id])
+
+
+def course_trees(courses):
+    """Courses with their modules, materials and tests as nested dicts
+
+    Loads the whole tree with one query per table, however many courses and
+    modules there are.
+    """
+    course_ids = [course.id for course in courses]
+    if not course_ids:
+        return []
+
+    modules = Module.query.filter(Module.course_id.in_(course_ids)).order_by(Module.order, Module.id).all()
+    module_ids = [module.id for module in modules]
+    materials = Material.query.filter(Material.course_id.in_(course_ids)).order_by(Material.order, Material.id).all()
+    tests = Test.query.filter(Test.module_id.in_(module_ids)).order_by(Test.id).all() if module_ids else []
+
+    tests_by_module = defaultdict(list)
+    for test in tests:
+        tests_by_module[test.module_id].append(test)
+    materials_by_module = defaultdict(list)
+    for material in materials:
+        materials_by_module[material.module_id, material.course_id].append(material)
+
+    modules_by_course = defaultdict(list)
+    for module in modules:
+        modules_by_course[module.course_id].append(dict(
+            _columns(module),
+            materials=materials_by_module[module.id, module.course_id],
+            tests=tests_by_module[module.id]
+        ))
+
+    return [dict(
+        _columns(course),
+        modules=modules_by_course[course.id],
+        materials=materials_by_module[None, course.id]
+    ) for course in courses]
+
+
+def _columns(obj):
+    return {column.key: getattr(obj, column.key) for column in obj.__mapper__.column_attrs}
@@ -0,0 +1,339 @@
+import hashlib
+import inspect
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+MISSING = object()
+
+
+class NullCache:
+    """Cache that stores nothing, for CACHE_URL='null'"""
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value, ttl=None, tags=()):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def invalidate(self, tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(NullCache):
+    """In-process LRU cache with per-entry TTL. Only shared by the threads of one worker."""
+
+    def __init__(self, max_size=1024, default_ttl=300):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires_at = time.monotonic() + (ttl or self.default_ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteCache(NullCache):
+    """Cache shared by several worker processes through an SQLite file"""
+
+    def __init__(self, path, default_ttl=300, purge_every=100):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, key)
+            )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, default=None):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None, tags=()):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                         (key, pickle.dumps(value), now + (ttl or self.default_ttl)))
+            conn.executemany('INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)',
+                             [(tag, key) for tag in tags])
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (now,))
+                conn.execute('DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)')
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        placeholders = ', '.join('?' for _ in tags)
+        with self._connect() as conn:
+            conn.execute(f'DELETE FROM cache_entries WHERE key IN '
+                         f'(SELECT key FROM cache_tags WHERE tag IN ({placeholders}))', tags)
+            conn.execute(f'DELETE FROM cache_tags WHERE tag IN ({placeholders})', tags)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_tags')
+
+
+class RedisCache(NullCache):
+    """Cache shared through Redis (or any server speaking its protocol), tags kept as sets"""
+
+    def __init__(self, url, default_ttl=300, prefix='lms:'):
+        import redis  # optional dependency, only needed for redis:// cache URLs
+        self.client = redis.Redis.from_url(url)
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        return default if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None, tags=()):
+        ttl = ttl or self.default_ttl
+        pipeline = self.client.pipeline()
+        pipeline.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+        for tag in tags:
+            pipeline.sadd(f'{self.prefix}tag:{tag}', key)
+            pipeline.expire(f'{self.prefix}tag:{tag}', ttl * 2)
+        pipeline.execute()
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def invalidate(self, tags):
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            keys = [self.prefix + key.decode() for key in self.client.smembers(tag_key)]
+            self.client.delete(tag_key, *keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(f'{self.prefix}*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_cache(url):
+    """Build a cache from a CACHE_URL setting: 'memory', 'null', 'sqlite:///path/to/file.db' or 'redis://...'"""
+    if not url or url == 'memory':
+        return MemoryCache()
+    if url == 'null':
+        return NullCache()
+    if url.startswith('sqlite:///'):
+        return SQLiteCache(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCache(url)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Cache of the current app, created on first use"""
+    with _cache_lock:
+        cache = current_app.extensions.get('cache')
+        if cache is None:
+            cache = current_app.extensions['cache'] = create_cache(current_app.config.get('CACHE_URL'))
+    return cache
+
+
+def course_tag(course_id):
+    return f'course:{course_id}'
+
+
+def module_tag(module_id):
+    return f'module:{module_id}'
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def invalidate(*tags):
+    """Drop every cached value carrying one of the tags, logging instead of raising"""
+    if not tags or not has_app_context():
+        return
+    try:
+        get_cache().invalidate(tags)
+    except Exception as e:
+        current_app.logger.error(f"Error invalidating cache tags {tags}: {str(e)}")
+
+
+def memoize(ttl=300, tags=()):
+    """Cache a function's return value by its arguments
+
+    Tags are format strings filled from the call's arguments, e.g.
+    'user:{teacher_id}'. Return values must be picklable plain data, never
+    ORM instances, since they may be shared across sessions and processes.
+    """
+    def decorator(f):
+        signature = inspect.signature(f)
+        name = f'{f.__module__}.{f.__qualname__}'
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not has_app_context():
+                return f(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            digest = hashlib.sha1(repr(sorted(arguments.arguments.items())).encode()).hexdigest()
+            key = f'{name}:{digest}'
+
+            cache = get_cache()
+            try:
+                value = cache.get(key, MISSING)
+            except Exception as e:
+                logging.error(f"Error reading cache key {key}: {str(e)}")
+                value = MISSING
+            if value is not MISSING:
+                return value
+
+            value = f(*args, **kwargs)
+            try:
+                cache.set(key, value, ttl, [tag.format(**arguments.arguments) for tag in tags])
+            except Exception as e:
+                logging.error(f"Error writing cache key {key}: {str(e)}")
+            return value
+
+        wrapper.uncached = f
+        return wrapper
+    return decorator
+
+
+def _tags_for(obj):
+    """Cache tags made stale by writing an object"""
+    from lms.models.user import User
+    from lms.models.course import Course, Module, Material, Assignment, Enrollment, Test
+
+    if isinstance(obj, Course):
+        return ['catalog', course_tag(obj.id), user_tag(obj.teacher_id)]
+    if isinstance(obj, Enrollment):
+        return ['catalog', course_tag(obj.course_id), user_tag(obj.student_id)]
+    if isinstance(obj, Module):
+        return ['catalog', course_tag(obj.course_id), module_tag(obj.id)]
+    if isinstance(obj, Material):
+        return ['catalog', course_tag(obj.course_id), module_tag(obj.module_id)]
+    if isinstance(obj, Assignment):
+        return [course_tag(obj.course_id)]
+    if isinstance(obj, Test):
+        return [module_tag(obj.module_id)]
+    if isinstance(obj, User):
+        return ['users', user_tag(obj.id)]
+    return []
+
+
+def mark_stale(session, *tags):
+    """Invalidate tags once the session's transaction commits, for writes that bypass the ORM"""
+    session.info.setdefault('stale_cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stale_tags(session, flush_context):
+    """Remember which cache tags the flushed objects make stale"""
+    if not has_app_context():
+        return
+    tags = session.info.setdefault('stale_cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags.update(_tags_for(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_tags(session):
+    """Invalidate once the writes are visible to other workers"""
+    tags = session.info.pop('stale_cache_tags', None)
+    if tags:
+        invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stale_tags(session):
+    session.info.pop('stale_cache_tags', None)
@@ -0,0 +1,181 @@
+from collections import namedtuple
+from math import ceil
+from sqlalchemy.orm import joinedload
+from lms.utils.db import db
+from lms.models.course import Course, Category
+from lms.utils.cache import memoize
+from lms.utils.search import get_backend
+
+CategoryFacet = namedtuple('CategoryFacet', ['id', 'name'])
+
+
+class CatalogPage:
+    """One page of catalog results, with the cursors of the pages around it"""
+
+    def __init__(self, courses, enrollment_counts, total, page, per_page, has_prev=False, has_next=False):
+        self.courses = courses
+        self.enrollment_counts = enrollment_counts  # course id -> enrolled students
+        self.total = total
+        self.page = page  # Page number for display; pages are selected by cursor
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+    @property
+    def pages(self):
+        return max(ceil(self.total / self.per_page), 1)
+
+    @property
+    def prev_before(self):
+        """Cursor of the previous page: it ends before the first course of this one"""
+        return self.courses[0].id if self.courses else None
+
+    @property
+    def next_after(self):
+        """Cursor of the next page: it starts after the last course of this one"""
+        return self.courses[-1].id if self.courses else None
+
+
+class CourseCatalog:
+    """Active, approved courses filtered, sorted, counted and paginated in SQL
+
+    A page costs a fixed number of queries: the total count, the page of
+    courses with their enrollment counts, category and teacher, and the
+    category facets. Pages are selected with a keyset on (sort key, id)
+    relative to a cursor course rather than an OFFSET, so deep pages are
+    as cheap as the first. Searches go through the full-text index, and results
+    are sorted by relevance unless another order is asked for.
+
+    The ids on each page, the totals and the facets are cached under the
+    'catalog' tag, so a cached page only loads its courses by primary key.
+    """
+
+    SORT_OPTIONS = ('relevance', 'popular', 'newest', 'title')
+
+    def __init__(self, search=None, category_id=None, sort_by=None, per_page=24):
+        self.search = search or None
+        self.category_id = category_id or None
+        default_sort = 'relevance' if self.search else 'popular'
+        self.sort_by = sort_by if sort_by in self.SORT_OPTIONS else default_sort
+        if self.sort_by == 'relevance' and not self.search:
+            self.sort_by = 'popular'
+        self.per_page = per_page
+        self._matches = get_backend().matches(self.search) if self.search else None
+
+    def _filtered(self, query, with_category=True):
+        query = query.filter(Course.is_active == True, Course.is_approved == True)
+        if self._matches is not None:
+            query = query.join(self._matches, self._matches.c.course_id == Course.id)
+        if with_category and self.category_id:
+            query = query.filter(Course.category_id == self.category_id)
+        return query
+
+    def _sort_key(self):
+        """Sort key expression, whether it sorts descending, and whether ties sort by descending id"""
+        if self.sort_by == 'newest':
+            return Course.created_at, True, True
+        if self.sort_by == 'title':
+            return db.func.lower(Course.title), False, False
+        if self.sort_by == 'relevance':
+            return self._matches.c.rank, True, False
+        return Course.enrollment_count, True, False
+
+    def _cursor_key(self, cursor_id):
+        """Sort key of the cursor course, as a subquery of its own"""
+        if self.sort_by == 'relevance':
+            statement = db.select(self._matches.c.rank).where(self._matches.c.course_id == cursor_id)
+        else:
+            statement = db.select(self._sort_key()[0]).where(Course.id == cursor_id)
+        return statement.correlate(None).scalar_subquery()
+
+    def _order_by(self, backwards=False):
+        key, key_desc, id_desc = self._sort_key()
+        return (key.desc() if key_desc != backwards else key.asc(),
+                Course.id.desc() if id_desc != backwards else Course.id.asc())
+
+    def count(self):
+        return self._filtered(db.session.query(db.func.count(Course.id)).select_from(Course)).scalar()
+
+    def page_ids(self, after=None, before=None):
+        """Ids of the courses on one page in order, whether more lie beyond it, and the total number of matches
+
+        The page starts after the course `after` or, going back, ends before
+        the course `before`; without either it is the first page.
+        """
+        backwards = before is not None
+        cursor_id = before if backwards else after
+        query = self._filtered(db.session.query(Course.id))
+        if cursor_id is not None:
+            key, key_desc, id_desc = self._sort_key()
+            cursor_key = self._cursor_key(cursor_id)
+            key_beyond = key < cursor_key if key_desc != backwards else key > cursor_key
+            id_beyond = Course.id < cursor_id if id_desc != backwards else Course.id > cursor_id
+            query = query.filter(key_beyond | ((key == cursor_key) & id_beyond))
+
+        # Fetch one extra row to know whether another page exists
+        ids = [course_id for (course_id,) in query.order_by(*self._order_by(backwards)).limit(self.per_page + 1)]
+        has_more = len(ids) > self.per_page
+        ids = ids[:self.per_page]
+        if backwards:
+            ids.reverse()
+        return ids, has_more, self.count()
+
+    def page(self, page=1, after=None, before=None):
+        """Courses of one page with their enrollment counts
+
+        page only numbers the page for display; after and before are the
+        cursors of CatalogPage.next_after and prev_before.
+        """
+        page = max(page or 1, 1)
+        ids, has_more, total = _cached_page_ids(self.search, self.category_id, self.sort_by, self.per_page,
+                                                after, before)
+        if not ids and (after is not None or before is not None):
+            # The cursor course is gone or no longer matches: start over
+            return self.page()
+        if after is None and before is None:
+            page, has_prev, has_next = 1, False, has_more
+        elif before is not None:
+            page, has_prev, has_next = (page if has_more else 1), has_more, True
+        else:
+            has_prev, has_next = True, has_more
+
+        courses = []
+        if ids:
+            position = {course_id: i for i, course_id in enumerate(ids)}
+            courses = sorted(Course.query.options(
+                joinedload(Course.category),
+                joinedload(Course.teacher)
+            ).filter(Course.id.in_(ids)).all(), key=lambda course: position[course.id])
+
+        return CatalogPage(
+            courses=courses,
+            enrollment_counts={course.id: course.enrollment_count for course in courses},
+            total=total,
+            page=page,
+            per_page=self.per_page,
+            has_prev=has_prev,
+            has_next=has_next
+        )
+
+    def category_facets(self):
+        """(category, course count) for every category with matching courses, ignoring the category filter"""
+        return _cached_category_facets(self.search)
+
+    def _category_facets(self):
+        rows = self._filtered(
+            db.session.query(Category.id, Category.name, db.func.count(Course.id)).join(
+                Course, Course.category_id == Category.id
+            ),
+            with_category=False
+        ).group_by(Category.id, Category.name).order_by(Category.name).all()
+        return [(CategoryFacet(category_id, name), count) for category_id, name, count in rows]
+
+
+@memoize(ttl=60, tags=['catalog'])
+def _cached_page_ids(search, category_id, sort_by, per_page, after, before):
+    return CourseCatalog(search, category_id, sort_by, per_page).page_ids(after, before)
+
+
+@memoize(ttl=60, tags=['catalog'])
+def _cached_category_facets(search):
+    return CourseCatalog(search)._category_facets()
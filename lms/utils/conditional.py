@@ -0,0 +1,163 @@
+import hashlib
+import time
+from functools import wraps
+from flask import current_app, g, request, session
+from flask_login import current_user
+from lms.utils.db import db
+from lms.models.course import (Course, Category, Module, Assignment, Submission, Enrollment, Test,
+                               TestAttempt, ModuleProgress, Wishlist)
+
+
+def compute_etag(parts):
+    """ETag value of a sequence of validator values"""
+    digest = hashlib.sha1(repr(tuple(parts)).encode()).hexdigest()
+    return digest[:32]
+
+
+def page_owner():
+    """Validator values of everything personal on an HTML page: the user and their CSRF tokens
+
+    User.updated_at moves on every profile edit, so pages showing the name
+    are rebuilt after one. CSRF tokens in the page expire after
+    WTF_CSRF_TIME_LIMIT, so the ETag changes twice as often to keep a page
+    revalidated with 304 submittable.
+    """
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    return (current_user.id, current_user.role_name, str(current_user.updated_at),
+            session.get('csrf_token'), int(time.time() // (time_limit / 2)))
+
+
+def api_caller():
+    """Validator values of an API request: the caller and the fields asked for"""
+    return (current_user.id, current_user.role_name, request.headers.get('X-Fields'))
+
+
+def conditional(validator, owner=page_owner):
+    """Answer If-None-Match with 304 before the view runs when nothing it shows has changed
+
+    The validator gets the view's keyword arguments and returns a tuple of
+    cheap values (content versions, counts, max ids) that change whenever
+    the response would, or None to let the view run, e.g. to answer 404.
+    The ETag also covers the URL and the owner values of the current user.
+    Responses carry 'Cache-Control: private, no-cache', so browsers keep
+    them but revalidate every time.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not current_user.is_authenticated:
+                return f(*args, **kwargs)
+            parts = validator(**kwargs)
+            if parts is None:
+                return f(*args, **kwargs)
+            etag = compute_etag((request.full_path, owner(), parts))
+            # Pending flash messages are only shown by rendering the page
+            if request.if_none_match.contains_weak(etag) and not session.get('_flashes'):
+                response = current_app.response_class(status=304)
+                _set_validators(response, etag)
+                return response
+            g.etag = etag
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _set_validators(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+
+def add_validators(response):
+    """after_request hook: put the ETag computed by @conditional on successful responses"""
+    etag = g.pop('etag', None)
+    if etag is not None and response.status_code == 200:
+        _set_validators(response, etag)
+    return response
+
+
+def add_body_etag(response):
+    """after_request hook for JSON endpoints without a validator: ETag of the body itself
+
+    The response is still built, but an unchanged one goes back as a bodiless 304.
+    """
+    if request.method != 'GET' or response.status_code != 200 or response.is_streamed \
+            or 'etag' in g or response.get_etag()[0]:
+        return response
+    response.add_etag(weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def _row(statement):
+    row = db.session.execute(statement).first()
+    return tuple(row) if row is not None else None
+
+
+def _rows_version(model, *criteria):
+    """Count and max id of some rows: changes when one is added or deleted"""
+    return (
+        db.select(db.func.count(model.id)).where(*criteria).scalar_subquery(),
+        db.select(db.func.max(model.id)).where(*criteria).scalar_subquery()
+    )
+
+
+def catalog_version(student_id=None):
+    """Validator of the course catalog: any course edit, enrollment or new category changes it"""
+    columns = [
+        db.func.count(Course.id), db.func.max(Course.id),
+        db.func.sum(Course.content_version), db.func.sum(Course.enrollment_count),
+        *_rows_version(Category)
+    ]
+    if student_id is not None:
+        columns += [*_rows_version(Enrollment, Enrollment.student_id == student_id),
+                    *_rows_version(Wishlist, Wishlist.student_id == student_id)]
+    return _row(db.select(*columns).select_from(Course))
+
+
+def course_version(course_id, student_id=None):
+    """Validator of a course page; with a student, also their enrollment, wishlist and submissions"""
+    columns = [Course.content_version, Course.is_active, Course.is_approved, Course.enrollment_count,
+               *_rows_version(Assignment, Assignment.course_id == course_id)]
+    if student_id is not None:
+        course_assignments = db.select(Assignment.id).where(Assignment.course_id == course_id)
+        columns += [
+            db.select(Enrollment.payment_verified).where(
+                Enrollment.course_id == course_id, Enrollment.student_id == student_id
+            ).scalar_subquery(),
+            *_rows_version(Wishlist, Wishlist.course_id == course_id, Wishlist.student_id == student_id),
+            *_rows_version(Submission, Submission.assignment_id.in_(course_assignments),
+                           Submission.student_id == student_id)
+        ]
+    return _row(db.select(*columns).where(Course.id == course_id))
+
+
+def module_version(module_id, student_id=None):
+    """Validator of a module page; with a student, also their enrollment, progress and test attempts"""
+    columns = [Module.course_id, Module.content_version, Course.content_version, Course.is_active]
+    if student_id is not None:
+        module_tests = db.select(Test.id).where(Test.module_id == module_id)
+        columns += [
+            db.select(Enrollment.id).where(
+                Enrollment.course_id == Module.course_id, Enrollment.student_id == student_id
+            ).scalar_subquery(),
+            db.select(ModuleProgress.completed_at).where(
+                ModuleProgress.module_id == module_id, ModuleProgress.student_id == student_id
+            ).scalar_subquery(),
+            *_rows_version(TestAttempt, TestAttempt.test_id.in_(module_tests), TestAttempt.student_id == student_id),
+            db.select(db.func.max(TestAttempt.completed_at)).where(
+                TestAttempt.test_id.in_(module_tests), TestAttempt.student_id == student_id
+            ).scalar_subquery()
+        ]
+    return _row(db.select(*columns).join(Course, Course.id == Module.course_id).where(Module.id == module_id))
+
+
+def tree_version(course_ids):
+    """Validator of the content of some courses: their versions and those of their modules"""
+    if not course_ids:
+        return ()
+    return _row(db.select(
+        *[db.select(column).where(Course.id.in_(course_ids)).scalar_subquery()
+          for column in (db.func.count(Course.id), db.func.sum(Course.content_version), db.func.max(Course.id))],
+        *[db.select(column).where(Module.course_id.in_(course_ids)).scalar_subquery()
+          for column in (db.func.count(Module.id), db.func.sum(Module.content_version), db.func.max(Module.id))]
+    ))
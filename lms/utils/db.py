@@ -1,14 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
+from lms.utils.replica import RoutingSession
 from werkzeug.security import generate_password_hash
 import os
 import sys
 
-db = SQLAlchemy()
+# Reads of GET handlers can go to a replica (lms/utils/replica.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 def init_db():
     """Initialize the database and create admin user if needed"""
     from lms.models.user import User, Role
     from lms.models.message import Message
+    from lms.models.job import Job
+    from lms.models.token import RevokedToken
+    from lms.models.stored_file import StoredFile
+    import lms.utils.search  # creates the full-text search index with the other tables
     
     print("Creating all database tables...")
     db.create_all()
@@ -0,0 +1,199 @@
+import os
+from collections import Counter, OrderedDict
+from flask import current_app
+from sqlalchemy import select, or_
+from lms.utils.db import db
+from lms.utils.cache import mark_stale, course_tag, module_tag, user_tag
+from lms.utils.fragments import bump_content_versions
+from lms.utils.grading import answer_keys
+from lms.utils.progress import refresh_enrollment_progress
+from lms.utils.search import get_backend, index_courses
+from lms.utils.files import is_content_addressed
+from lms.utils.storage import FILE_COLUMNS, change_references
+from lms.models.course import (Course, Module, Material, Assignment, Submission, Test, Question,
+                               QuestionOption, TestAttempt, TestAnswer, ModuleProgress, Enrollment,
+                               EnrollmentProgress, Wishlist)
+
+
+class DeletionReport:
+    """Rows deleted per table and the legacy uploaded files left without any reference"""
+
+    def __init__(self):
+        self.counts = OrderedDict()  # table name -> deleted rows
+        self.files = []
+
+    def add(self, table_name, count):
+        self.counts[table_name] = self.counts.get(table_name, 0) + max(count or 0, 0)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def remove_files(self):
+        """Delete the orphaned files from disk. Call after the transaction has committed."""
+        static_folder = os.path.dirname(os.path.normpath(current_app.config['UPLOAD_FOLDER']))
+        removed = 0
+        for path in self.files:
+            try:
+                os.remove(os.path.join(static_folder, path))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                current_app.logger.error(f"Error removing file {path}: {str(e)}")
+        return removed
+
+    def summary(self):
+        return ', '.join(f'{count} {table}' for table, count in self.counts.items() if count)
+
+
+class CascadeDelete:
+    """Delete courses, modules or tests with everything below them, table by table
+
+    Each table is cleared with one DELETE ... WHERE ... IN (subquery) in
+    dependency order, so the cost does not grow with the number of
+    questions, attempts or submissions. Bulk deletes bypass the ORM, so the
+    session hooks' work is redone here: stored enrollment progress, answer
+    keys, fragment versions, the search index, cache tags and the reference
+    counts of stored files. Nothing is committed.
+    """
+
+    def __init__(self, session=None):
+        self.session = session or db.session
+        self.report = DeletionReport()
+        self._paths = Counter()  # path -> deleted rows referring to it
+
+    def _delete(self, model, condition):
+        self.report.add(model.__tablename__, self.session.execute(
+            model.__table__.delete().where(condition)
+        ).rowcount)
+
+    def _collect_files(self, column, condition):
+        self._paths.update(path for (path,) in self.session.execute(
+            select(column).where(condition, column.isnot(None))
+        ))
+
+    def _delete_tests(self, tests):
+        """Delete the tests selected by a subquery of ids, with questions, options, attempts and answers"""
+        questions = select(Question.id).where(Question.test_id.in_(tests))
+        attempts = select(TestAttempt.id).where(TestAttempt.test_id.in_(tests))
+        self._delete(TestAnswer, or_(TestAnswer.attempt_id.in_(attempts), TestAnswer.question_id.in_(questions)))
+        self._delete(QuestionOption, QuestionOption.question_id.in_(questions))
+        self._delete(TestAttempt, TestAttempt.test_id.in_(tests))
+        self._delete(Question, Question.test_id.in_(tests))
+        self._delete(Test, Test.id.in_(tests))
+
+    def _delete_modules(self, modules):
+        """Delete the modules selected by a subquery of ids, with their tests, materials and progress"""
+        self._delete_tests(select(Test.id).where(Test.module_id.in_(modules)))
+        self._collect_files(Material.file_path, Material.module_id.in_(modules))
+        self._delete(Material, Material.module_id.in_(modules))
+        self._delete(ModuleProgress, ModuleProgress.module_id.in_(modules))
+        self._delete(Module, Module.id.in_(modules))
+
+    def _test_ids(self, condition):
+        return [test_id for (test_id,) in self.session.execute(select(Test.id).where(condition))]
+
+    def _refresh_progress(self, course_ids):
+        """Recompute stored progress of every student of courses that lost modules or tests"""
+        refresh_enrollment_progress(self.session.execute(
+            select(Enrollment.student_id, Enrollment.course_id).where(Enrollment.course_id.in_(course_ids))
+        ).all())
+
+    def tests(self, test_ids):
+        test_ids = list(test_ids)
+        rows = self.session.execute(select(Test.module_id, Module.course_id).join(
+            Module, Module.id == Test.module_id
+        ).where(Test.id.in_(test_ids))).all()
+        module_ids = {module_id for module_id, _ in rows}
+        course_ids = {course_id for _, course_id in rows}
+
+        self._delete_tests(select(Test.id).where(Test.id.in_(test_ids)))
+        answer_keys.invalidate(test_ids)
+        self._refresh_progress(course_ids)
+        bump_content_versions(self.session, module_ids=module_ids)
+        mark_stale(self.session, *[module_tag(module_id) for module_id in module_ids])
+        return self._finish()
+
+    def modules(self, module_ids):
+        module_ids = list(module_ids)
+        course_ids = set(self.session.execute(
+            select(Module.course_id).where(Module.id.in_(module_ids))
+        ).scalars())
+        test_ids = self._test_ids(Test.module_id.in_(module_ids))
+
+        self._delete_modules(select(Module.id).where(Module.id.in_(module_ids)))
+        answer_keys.invalidate(test_ids)
+        self._refresh_progress(course_ids)
+        bump_content_versions(self.session, course_ids=course_ids)
+        if course_ids:
+            index_courses(course_ids, self.session)
+        mark_stale(self.session, 'catalog', *[course_tag(course_id) for course_id in course_ids],
+                   *[module_tag(module_id) for module_id in module_ids])
+        return self._finish()
+
+    def courses(self, course_ids):
+        course_ids = list(course_ids)
+        teacher_ids = set(self.session.execute(
+            select(Course.teacher_id).where(Course.id.in_(course_ids))
+        ).scalars())
+        test_ids = self._test_ids(Test.module_id.in_(select(Module.id).where(Module.course_id.in_(course_ids))))
+
+        self._delete_modules(select(Module.id).where(Module.course_id.in_(course_ids)))
+
+        assignments = select(Assignment.id).where(Assignment.course_id.in_(course_ids))
+        self._collect_files(Submission.file_path, Submission.assignment_id.in_(assignments))
+        self._delete(Submission, Submission.assignment_id.in_(assignments))
+        self._delete(Assignment, Assignment.course_id.in_(course_ids))
+
+        self._collect_files(Material.file_path, Material.course_id.in_(course_ids))
+        self._delete(Material, Material.course_id.in_(course_ids))
+        self._collect_files(Enrollment.payment_receipt_path, Enrollment.course_id.in_(course_ids))
+        self._delete(EnrollmentProgress, EnrollmentProgress.course_id.in_(course_ids))
+        self._delete(Enrollment, Enrollment.course_id.in_(course_ids))
+        self._delete(Wishlist, Wishlist.course_id.in_(course_ids))
+
+        self._collect_files(Course.image_path, Course.id.in_(course_ids))
+        self._collect_files(Course.payment_receipt_path, Course.id.in_(course_ids))
+        get_backend(self.session.get_bind().dialect.name).delete_documents(self.session, course_ids)
+        self._delete(Course, Course.id.in_(course_ids))
+
+        answer_keys.invalidate(test_ids)
+        mark_stale(self.session, 'catalog', *[course_tag(course_id) for course_id in course_ids],
+                   *[user_tag(teacher_id) for teacher_id in teacher_ids])
+        return self._finish()
+
+    def _finish(self):
+        """Release the stored files of the deleted rows and keep the legacy ones no remaining row refers to
+
+        Stored files are reclaimed by a background job once the transaction
+        commits; files saved before content-addressed storage are left to
+        DeletionReport.remove_files().
+        """
+        change_references(self.session, Counter({
+            path: -count for path, count in self._paths.items() if is_content_addressed(path)
+        }))
+        legacy = {path for path in self._paths if not is_content_addressed(path)}
+        paths = list(legacy)
+        if paths:
+            for column in FILE_COLUMNS:
+                legacy.difference_update(self.session.execute(
+                    select(column).where(column.in_(paths))
+                ).scalars())
+        self.report.files = sorted(legacy)
+        return self.report
+
+
+def delete_courses(course_ids):
+    """Delete courses and all their content. Does not commit."""
+    return CascadeDelete().courses(course_ids)
+
+
+def delete_modules(module_ids):
+    """Delete modules with their materials, tests and progress. Does not commit."""
+    return CascadeDelete().modules(module_ids)
+
+
+def delete_tests(test_ids):
+    """Delete tests with their questions, options, attempts and answers. Does not commit."""
+    return CascadeDelete().tests(test_ids)
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+# Engine settings per environment, picked with DB_PROFILE (or FLASK_ENV)
+PROFILES = {
+    'development': {
+        'echo': True,
+        'pool_pre_ping': False,
+        'pool_recycle': None,
+        'pool_timeout': 30,
+        'statement_timeout': None,
+        'sqlite_journal_mode': 'WAL',
+        'sqlite_busy_timeout': 5,
+    },
+    'production': {
+        'echo': False,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,  # Below the usual idle timeouts of Postgres proxies and load balancers
+        'pool_timeout': 10,
+        'statement_timeout': 30,
+        'sqlite_journal_mode': 'WAL',
+        'sqlite_busy_timeout': 15,
+    },
+    'testing': {
+        'echo': False,
+        'pool_pre_ping': False,
+        'pool_recycle': None,
+        'pool_timeout': 5,
+        'statement_timeout': None,
+        'sqlite_journal_mode': None,  # Test databases are deleted between tests, keep them to one file
+        'sqlite_busy_timeout': 5,
+    },
+}
+
+PROFILE_ALIASES = {'dev': 'development', 'prod': 'production', 'test': 'testing'}
+
+# Pragmas run on every new SQLite connection of any engine in this process
+_sqlite_pragmas = {}
+
+
+def get_profile(name=None):
+    """Name and settings of an engine profile, defaulting to DB_PROFILE, then FLASK_ENV, then development"""
+    name = name or os.getenv('DB_PROFILE') or os.getenv('FLASK_ENV') or 'development'
+    name = PROFILE_ALIASES.get(name, name)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown database profile: {name}")
+    return name, PROFILES[name]
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def pool_size_for(threads, workers=1, max_connections=None):
+    """Pool size and overflow of one web process
+
+    Each request thread holds at most one connection, so the pool keeps one
+    per thread. Overflow covers streaming responses and background threads
+    as long as all processes together stay within max_connections.
+    """
+    pool_size = max(threads, 1)
+    if max_connections:
+        max_overflow = max(0, min(pool_size, max_connections // max(workers, 1) - pool_size))
+    else:
+        max_overflow = pool_size
+    return pool_size, max_overflow
+
+
+def engine_options(database_uri, profile):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URI and profile settings"""
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite':
+        # Pragmas are set per connection below; the pool settings do not apply to SQLite
+        return {}
+
+    # Sized from the gunicorn settings in gunicorn.conf.py
+    pool_size, max_overflow = pool_size_for(
+        threads=_env_int('GUNICORN_THREADS', 8),
+        workers=_env_int('WEB_CONCURRENCY', 1),
+        max_connections=_env_int('DB_MAX_CONNECTIONS', None)
+    )
+    options = {
+        'pool_size': _env_int('DB_POOL_SIZE', pool_size),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', max_overflow),
+        'pool_pre_ping': profile['pool_pre_ping'],
+        'pool_timeout': profile['pool_timeout'],
+    }
+    if profile['pool_recycle']:
+        options['pool_recycle'] = profile['pool_recycle']
+
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT', profile['statement_timeout'])
+    if statement_timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout * 1000}'}
+    return options
+
+
+def configure_engine(app, profile=None):
+    """Fill in the engine settings of an app from a profile. Call before db.init_app."""
+    name, settings = get_profile(profile)
+    app.config['DB_PROFILE'] = name
+    app.config['SQLALCHEMY_ECHO'] = os.getenv('SQLALCHEMY_ECHO', str(settings['echo'])).lower() in ('1', 'true')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config['SQLALCHEMY_DATABASE_URI'], settings),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+
+    _sqlite_pragmas.clear()
+    if settings['sqlite_journal_mode']:
+        # WAL lets readers continue while a request writes; NORMAL sync is safe with WAL
+        _sqlite_pragmas['journal_mode'] = settings['sqlite_journal_mode']
+        _sqlite_pragmas['synchronous'] = 'NORMAL'
+    _sqlite_pragmas['busy_timeout'] = settings['sqlite_busy_timeout'] * 1000
+    return name
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not _sqlite_pragmas or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in _sqlite_pragmas.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
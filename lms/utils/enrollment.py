@@ -0,0 +1,80 @@
+from collections import Counter
+from flask import has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from lms.utils.db import db
+from lms.models.course import Course, Enrollment, TeacherSubscriptionPlan
+
+
+class CourseFullError(Exception):
+    """Raised from a flush that would enroll more students than a course's plan allows"""
+
+    def __init__(self, course_ids):
+        super().__init__(f'Courses at capacity: {sorted(course_ids)}')
+        self.course_ids = course_ids
+
+
+def _seats_available(courses, added):
+    """SQL condition that a course still has room for `added` more students"""
+    max_students = select(TeacherSubscriptionPlan.max_students).where(
+        TeacherSubscriptionPlan.id == courses.c.subscription_plan_id
+    ).scalar_subquery()
+    return courses.c.subscription_plan_id.is_(None) | (courses.c.enrollment_count + added <= max_students)
+
+
+def _enrollment_changes(session):
+    """Map course id -> change in its number of enrollments for the objects being flushed"""
+    changes = Counter()
+    for obj in session.new:
+        if isinstance(obj, Enrollment):
+            changes[obj.course_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Enrollment):
+            changes[obj.course_id] -= 1
+    changes.pop(None, None)
+    return {course_id: change for course_id, change in changes.items() if change}
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_enrollment_counts(session, flush_context):
+    """Keep Course.enrollment_count current and refuse enrollments over capacity
+
+    Each course is updated with a single conditional UPDATE, so the check and
+    the increment happen atomically under the row lock: concurrent enrollments
+    cannot both take the last seat.
+    """
+    if not has_app_context() or session is not db.session():
+        return
+    changes = _enrollment_changes(session)
+    if not changes:
+        return
+
+    courses = Course.__table__
+    full = []
+    for course_id, change in changes.items():
+        statement = courses.update().where(courses.c.id == course_id).values(
+            enrollment_count=db.func.coalesce(courses.c.enrollment_count, 0) + change
+        )
+        if change > 0:
+            statement = statement.where(_seats_available(courses, change))
+        if session.execute(statement).rowcount == 0 and change > 0:
+            full.append(course_id)
+
+        key = session.identity_key(Course, course_id)
+        if key in session.identity_map:
+            session.expire(session.identity_map[key], ['enrollment_count'])
+
+    if full:
+        raise CourseFullError(full)
+
+
+def recount_enrollments(course_id=None):
+    """Recompute the stored enrollment counters from the enrollments table. Does not commit."""
+    courses = Course.__table__
+    count = select(db.func.count(Enrollment.id)).where(
+        Enrollment.course_id == courses.c.id
+    ).scalar_subquery()
+    statement = courses.update().values(enrollment_count=count)
+    if course_id is not None:
+        statement = statement.where(courses.c.id == course_id)
+    return db.session.execute(statement).rowcount
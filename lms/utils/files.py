@@ -0,0 +1,110 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+from flask import abort, current_app, request, send_file, url_for
+from flask_login import current_user
+from werkzeug.security import safe_join
+from lms.utils.db import db
+from lms.models.user import User
+from lms.models.course import Course, Material, Assignment, Submission, Enrollment
+
+UPLOADS_PREFIX = 'uploads/'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_CONTENT_HASH = re.compile(r'[0-9a-f]{64}')
+
+
+def stored_path(filename):
+    """Path of an upload as the models store it, relative to the static folder ('uploads/...')"""
+    filename = filename.replace('\\', '/').lstrip('/')
+    return filename if filename.startswith(UPLOADS_PREFIX) else UPLOADS_PREFIX + filename
+
+
+def upload_url(path):
+    """URL that serves an uploaded file after checking the user may see it"""
+    if not path:
+        return ''
+    return url_for('course.download_file', filename=stored_path(path)[len(UPLOADS_PREFIX):])
+
+
+def is_content_addressed(path):
+    """Whether a file is named after the hash of its content, so it never changes"""
+    return bool(_CONTENT_HASH.fullmatch(os.path.splitext(os.path.basename(path))[0]))
+
+
+def can_access_upload(path):
+    """Whether the current user may download an uploaded file, judged by the rows referencing it
+
+    Course images are visible to every signed-in user. Material files need
+    the course's teacher or an enrolled student, submissions their student or
+    the course's teacher, receipts and certificates the uploader; admins may
+    see everything referenced anywhere.
+    """
+    user_id = current_user.id
+    is_admin = current_user.is_admin()
+    session = db.session
+
+    if session.query(Course.id).filter(Course.image_path == path).first():
+        return True
+
+    course_ids = [course_id for (course_id,) in session.query(Material.course_id).filter(Material.file_path == path)]
+    if course_ids:
+        if is_admin or session.query(Course.id).filter(Course.id.in_(course_ids), Course.teacher_id == user_id).first():
+            return True
+        if session.query(Enrollment.id).filter(Enrollment.course_id.in_(course_ids),
+                                               Enrollment.student_id == user_id).first():
+            return True
+
+    submissions = session.query(Submission.student_id, Course.teacher_id).join(
+        Assignment, Assignment.id == Submission.assignment_id
+    ).join(Course, Course.id == Assignment.course_id).filter(Submission.file_path == path).all()
+    receipts = session.query(Course.teacher_id).filter(Course.payment_receipt_path == path).all()
+    receipts += session.query(Enrollment.student_id).filter(Enrollment.payment_receipt_path == path).all()
+    certificates = session.query(User.id).filter(User.certificate_path == path).all()
+
+    if is_admin:
+        return bool(course_ids or submissions or receipts or certificates)
+    return any(user_id in row for row in submissions + receipts + certificates)
+
+
+def send_upload(path):
+    """Response serving an uploaded file: Range requests, ETags and cache headers
+
+    Content-addressed files never change, so browsers may keep them for a
+    year without asking again; everything else is revalidated with its ETag.
+    When UPLOAD_ACCEL_REDIRECT names an internal nginx location mapped to the
+    upload folder, nginx streams the file and the worker is free at once;
+    USE_X_SENDFILE does the same for servers that understand X-Sendfile.
+    """
+    relative = path[len(UPLOADS_PREFIX):]
+    full_path = safe_join(current_app.config['UPLOAD_FOLDER'], relative)
+    if full_path is None or not os.path.isfile(full_path):
+        abort(404)
+
+    immutable = is_content_addressed(relative)
+    accel_prefix = current_app.config.get('UPLOAD_ACCEL_REDIRECT')
+    if accel_prefix:
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        )
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(relative)}"
+    else:
+        etag = os.path.splitext(os.path.basename(relative))[0] if immutable else True
+        response = send_file(full_path, conditional=True, etag=etag, max_age=None)
+
+    response.headers.pop('Expires', None)
+    if immutable:
+        response.headers['Cache-Control'] = f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def block_static_uploads():
+    """before_request hook: uploads are only served through the authorizing route"""
+    if request.endpoint != 'static':
+        return
+    filename = posixpath.normpath(request.view_args.get('filename', '').replace('\\', '/')).lstrip('/')
+    if filename.startswith(UPLOADS_PREFIX):
+        abort(404)
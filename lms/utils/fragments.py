@@ -0,0 +1,123 @@
+from flask import has_app_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session
+from lms.utils.db import db
+from lms.utils.cache import get_cache, course_tag, module_tag
+from lms.models.user import User
+from lms.models.course import Course, Category, Module, Material, Test, Assignment
+
+# Columns of other rows shown in course fragments, such as the teacher's name on the course page
+SHOWN_ON_COURSES = {
+    User: (('first_name', 'last_name'), Course.teacher_id),
+    Category: (('name',), Course.category_id),
+}
+
+
+def fragment_identity(obj):
+    """Key part and invalidation tag of a versioned object a fragment is rendered from"""
+    if isinstance(obj, Course):
+        return f'course:{obj.id}:v{obj.content_version or 0}', course_tag(obj.id)
+    if isinstance(obj, Module):
+        return f'module:{obj.id}:v{obj.content_version or 0}', module_tag(obj.id)
+    return str(obj), None
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache 'name', course, module %}...{% endcache %}
+
+    Caches the rendered body under the fragment name and the id and content
+    version of every course or module given. Since the version is read from
+    the row being rendered, every worker sees a change as soon as it is
+    committed, even with a per-process cache that missed the invalidation.
+    Personalized markup must stay outside the block.
+    """
+
+    tags = {'cache'}
+    ttl = 3600
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        if not has_app_context():
+            return caller()
+        identities = [fragment_identity(part) for part in parts]
+        key = 'fragment:' + '/'.join(identity for identity, _ in identities)
+        cache = get_cache()
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, str(fragment), self.ttl, [tag for _, tag in identities if tag])
+        return Markup(fragment)
+
+
+def _changed_content(session):
+    """Ids of the courses and modules whose rendered content the flushed objects change
+
+    The versions also validate the ETags of course and module pages
+    (lms.utils.conditional), so everything shown on them counts.
+    """
+    course_ids, module_ids = set(), set()
+    shown_ids = {model: set() for model in SHOWN_ON_COURSES}
+    for obj in session.dirty:
+        if type(obj) in SHOWN_ON_COURSES:
+            attributes = inspect(obj).attrs
+            if any(attributes[key].history.has_changes() for key in SHOWN_ON_COURSES[type(obj)][0]):
+                shown_ids[type(obj)].add(obj.id)
+    criteria = [SHOWN_ON_COURSES[model][1].in_(list(ids)) for model, ids in shown_ids.items() if ids]
+    if criteria:
+        course_ids.update(session.execute(select(Course.id).where(or_(*criteria))).scalars())
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Course):
+            course_ids.add(obj.id)
+        elif isinstance(obj, Module):
+            course_ids.add(obj.course_id)
+            module_ids.add(obj.id)
+        elif isinstance(obj, Material):
+            course_ids.add(obj.course_id)
+            module_ids.add(obj.module_id)
+        elif isinstance(obj, Test):
+            module_ids.add(obj.module_id)
+        elif isinstance(obj, Assignment):
+            course_ids.add(obj.course_id)
+    course_ids.discard(None)
+    module_ids.discard(None)
+    return course_ids, module_ids
+
+
+def _bump(session, model, ids):
+    table = model.__table__
+    session.execute(table.update().where(table.c.id.in_(list(ids))).values(
+        content_version=db.func.coalesce(table.c.content_version, 0) + 1
+    ))
+    for object_id in ids:
+        key = session.identity_key(model, object_id)
+        if key in session.identity_map:
+            session.expire(session.identity_map[key], ['content_version'])
+
+
+def bump_content_versions(session, course_ids=(), module_ids=()):
+    """Retire the cached fragments of some courses and modules. Does not commit."""
+    if course_ids:
+        _bump(session, Course, set(course_ids))
+    if module_ids:
+        _bump(session, Module, set(module_ids))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_content_versions(session, flush_context):
+    """Retire cached fragments whenever course or module content changes"""
+    if not has_app_context() or session is not db.session():
+        return
+    bump_content_versions(session, *_changed_content(session))
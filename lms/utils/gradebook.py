@@ -0,0 +1,264 @@
+from lms.utils.db import db
+from lms.models.course import (Assignment, Submission, Enrollment, Module, Test,
+                               TestAttempt, ModuleProgress)
+
+# Groups of gradebook queries, loaded together
+PARTS = ('assignments', 'tests', 'passed_tests', 'modules')
+
+# Parts each counter of progress_summary() is computed from
+SUMMARY_PARTS = {
+    'modules_completed': ('modules',),
+    'tests_passed': ('passed_tests',),
+    'assignments_submitted': ('assignments',),
+    'assignments_graded': ('assignments',),
+    'overall_grade': ('assignments', 'tests'),
+}
+
+
+class Gradebook:
+    """Assignment grades, best test scores and module completion for a set of courses.
+
+    All data is loaded with a fixed number of set-based queries, either for a
+    few students (``student_ids``) or for every student of the courses when
+    ``student_ids`` is None. ``parts`` limits the queries to some of PARTS,
+    e.g. those of summary_parts() when only a few counters are needed.
+    """
+
+    def __init__(self, course_ids, student_ids=None, parts=PARTS):
+        self.course_ids = list(course_ids)
+        self.student_ids = list(student_ids) if student_ids is not None else None
+        self.parts = set(parts)
+        self._loaded = False
+
+    @classmethod
+    def for_student(cls, student_id, course_ids=None):
+        """Gradebook of one student, for all of their enrolled courses by default"""
+        if course_ids is None:
+            course_ids = [course_id for (course_id,) in db.session.query(Enrollment.course_id).filter(
+                Enrollment.student_id == student_id
+            ).all()]
+        return cls(course_ids, [student_id])
+
+    @classmethod
+    def for_course(cls, course_id):
+        """Gradebook of every student in a course"""
+        return cls([course_id])
+
+    def _filter_students(self, query, column):
+        if self.student_ids is not None:
+            query = query.filter(column.in_(self.student_ids))
+        return query
+
+    def load(self):
+        """Run the gradebook queries once"""
+        if self._loaded:
+            return self
+
+        self.assignments = {}  # course id -> [Assignment]
+        self.submissions = {}  # (student id, assignment id) -> Submission
+        self.tests = {}  # course id -> [Test]
+        self.best_attempts = {}  # (student id, test id) -> TestAttempt
+        self.module_totals = {}  # course id -> number of modules
+        self.completed_modules = {}  # (student id, course id) -> completed modules
+        self.passed_tests = {}  # (student id, course id) -> tests passed at least once
+
+        if not self.course_ids or self.student_ids == []:
+            self._loaded = True
+            return self
+
+        if 'assignments' in self.parts:
+            self._load_assignments()
+        if 'tests' in self.parts:
+            self._load_tests()
+        if 'passed_tests' in self.parts:
+            self._load_passed_tests()
+        if 'modules' in self.parts:
+            self._load_modules()
+
+        self._loaded = True
+        return self
+
+    def _load_assignments(self):
+        """Assignments and their submissions"""
+        assignments = Assignment.query.filter(
+            Assignment.course_id.in_(self.course_ids)
+        ).order_by(Assignment.id).all()
+        for assignment in assignments:
+            self.assignments.setdefault(assignment.course_id, []).append(assignment)
+
+        submissions = self._filter_students(
+            Submission.query.join(Assignment, Submission.assignment_id == Assignment.id).filter(
+                Assignment.course_id.in_(self.course_ids)
+            ),
+            Submission.student_id
+        ).order_by(Submission.id).all()
+        for submission in submissions:
+            self.submissions.setdefault((submission.student_id, submission.assignment_id), submission)
+
+    def _load_tests(self):
+        """Tests of every module in the courses and the best scored attempt per student and test"""
+        tests = db.session.query(Test, Module.course_id).join(
+            Module, Test.module_id == Module.id
+        ).filter(
+            Module.course_id.in_(self.course_ids)
+        ).order_by(Test.id).all()
+        for test, course_id in tests:
+            self.tests.setdefault(course_id, []).append(test)
+
+        rank = db.func.row_number().over(
+            partition_by=(TestAttempt.student_id, TestAttempt.test_id),
+            order_by=(TestAttempt.score.desc(), TestAttempt.id)
+        ).label('rank')
+        ranked = self._filter_students(
+            db.session.query(TestAttempt.id.label('attempt_id'), rank).join(
+                Test, TestAttempt.test_id == Test.id
+            ).join(
+                Module, Test.module_id == Module.id
+            ).filter(
+                Module.course_id.in_(self.course_ids),
+                TestAttempt.score.isnot(None)
+            ),
+            TestAttempt.student_id
+        ).subquery()
+        best_attempts = TestAttempt.query.join(
+            ranked, ranked.c.attempt_id == TestAttempt.id
+        ).filter(ranked.c.rank == 1).all()
+        for attempt in best_attempts:
+            self.best_attempts[(attempt.student_id, attempt.test_id)] = attempt
+
+    def _load_passed_tests(self):
+        """Tests each student has passed at least once"""
+        passed = self._filter_students(
+            db.session.query(
+                TestAttempt.student_id, Module.course_id, db.func.count(db.distinct(TestAttempt.test_id))
+            ).join(
+                Test, TestAttempt.test_id == Test.id
+            ).join(
+                Module, Test.module_id == Module.id
+            ).filter(
+                Module.course_id.in_(self.course_ids),
+                TestAttempt.passed == True
+            ),
+            TestAttempt.student_id
+        ).group_by(TestAttempt.student_id, Module.course_id).all()
+        self.passed_tests = {(student_id, course_id): count for student_id, course_id, count in passed}
+
+    def _load_modules(self):
+        """Module counts of the courses and modules each student has completed"""
+        self.module_totals = dict(db.session.query(
+            Module.course_id, db.func.count(Module.id)
+        ).filter(
+            Module.course_id.in_(self.course_ids)
+        ).group_by(Module.course_id).all())
+
+        completed = self._filter_students(
+            db.session.query(
+                ModuleProgress.student_id,
+                Module.course_id,
+                db.func.count(ModuleProgress.id)
+            ).join(
+                Module, ModuleProgress.module_id == Module.id
+            ).filter(
+                Module.course_id.in_(self.course_ids),
+                ModuleProgress.completed == True
+            ),
+            ModuleProgress.student_id
+        ).group_by(ModuleProgress.student_id, Module.course_id).all()
+        self.completed_modules = {(student_id, course_id): count for student_id, course_id, count in completed}
+
+    def assignment_grades(self, student_id, course_id):
+        """Graded assignments of a student in a course"""
+        self.load()
+        grades = []
+        for assignment in self.assignments.get(course_id, []):
+            submission = self.submissions.get((student_id, assignment.id))
+            if submission and submission.grade is not None:
+                grades.append({
+                    'name': assignment.title,
+                    'grade': submission.grade,
+                    'feedback': submission.feedback,
+                    'submitted_at': submission.submitted_at,
+                    'graded_at': submission.graded_at
+                })
+        return grades
+
+    def test_grades(self, student_id, course_id):
+        """Best scored attempt of a student for every test in a course"""
+        self.load()
+        grades = []
+        for test in self.tests.get(course_id, []):
+            best_attempt = self.best_attempts.get((student_id, test.id))
+            if best_attempt:
+                grades.append({
+                    'name': test.title,
+                    'grade': best_attempt.score,
+                    'passed': best_attempt.passed,
+                    'completed_at': best_attempt.completed_at
+                })
+        return grades
+
+    def completion_percentage(self, student_id, course_id):
+        """Percentage of the course's modules the student has completed"""
+        self.load()
+        total_modules = self.module_totals.get(course_id, 0)
+        completed_modules = self.completed_modules.get((student_id, course_id), 0)
+        return (completed_modules / total_modules * 100) if total_modules > 0 else 0
+
+    def overall_grade(self, student_id, course_id):
+        """Overall course grade, or None when nothing has been graded yet
+
+        Every graded assignment and every scored test is worth 100 points.
+        """
+        total_points = 0
+        earned_points = 0
+
+        for grade in self.assignment_grades(student_id, course_id) + self.test_grades(student_id, course_id):
+            total_points += 100
+            earned_points += grade['grade']
+
+        if total_points > 0:
+            return (earned_points / total_points) * 100
+        return None
+
+    def progress_summary(self, student_id, course_id, columns=None):
+        """Counters stored in EnrollmentProgress for a student in a course, or only the given ones"""
+        self.load()
+        submissions = [
+            self.submissions[(student_id, assignment.id)]
+            for assignment in self.assignments.get(course_id, [])
+            if (student_id, assignment.id) in self.submissions
+        ]
+        summary = {
+            'modules_completed': self.completed_modules.get((student_id, course_id), 0),
+            'tests_passed': self.passed_tests.get((student_id, course_id), 0),
+            'assignments_submitted': len(submissions),
+            'assignments_graded': sum(1 for s in submissions if s.grade is not None),
+            'overall_grade': self.overall_grade(student_id, course_id)
+        }
+        if columns is not None:
+            summary = {column: summary[column] for column in columns}
+        return summary
+
+    def has_assignments(self, course_id):
+        self.load()
+        return bool(self.assignments.get(course_id))
+
+
+def summary_parts(columns):
+    """Gradebook parts needed to compute some counters of progress_summary()"""
+    return {part for column in columns for part in SUMMARY_PARTS[column]}
+
+
+def recompute_course_grades(course_id):
+    """Recalculate overall_grade for every enrollment of a course. Does not commit."""
+    gradebook = Gradebook([course_id], parts=summary_parts(['overall_grade'])).load()
+    if not gradebook.has_assignments(course_id):
+        return 0
+
+    updated = 0
+    for enrollment in Enrollment.query.filter_by(course_id=course_id).all():
+        overall_grade = gradebook.overall_grade(enrollment.student_id, course_id)
+        if overall_grade is not None:
+            enrollment.overall_grade = overall_grade
+            updated += 1
+    return updated
@@ -0,0 +1,225 @@
+import threading
+from collections import OrderedDict, namedtuple
+from flask import has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, joinedload
+from lms.utils.db import db
+from lms.models.course import Module, Test, Question, QuestionOption, TestAttempt, TestAnswer
+
+CHOICE_TYPES = ('multiple_choice', 'true_false')
+
+QuestionKey = namedtuple('QuestionKey', ['id', 'question_type', 'points', 'correct_option_ids'])
+
+
+class AnswerKey:
+    """Everything needed to auto-grade a test, compiled from its questions and options"""
+
+    def __init__(self, test_id, questions):
+        self.test_id = test_id
+        self.questions = questions  # [QuestionKey] in question id order
+
+    @classmethod
+    def load(cls, test_id):
+        """Compile the answer key of a test with a single query"""
+        rows = db.session.query(
+            Question.id, Question.question_type, Question.points, QuestionOption.id
+        ).outerjoin(
+            QuestionOption, (QuestionOption.question_id == Question.id) & (QuestionOption.is_correct == True)
+        ).filter(
+            Question.test_id == test_id
+        ).order_by(Question.id, QuestionOption.id).all()
+
+        questions = OrderedDict()
+        for question_id, question_type, points, option_id in rows:
+            if question_id not in questions:
+                questions[question_id] = QuestionKey(question_id, question_type, points or 0, set())
+            if option_id is not None:
+                questions[question_id].correct_option_ids.add(str(option_id))
+        return cls(test_id, list(questions.values()))
+
+    @property
+    def total_points(self):
+        return sum(question.points for question in self.questions)
+
+    def grade(self, attempt_id, form):
+        """Grade submitted form data in memory
+
+        Returns the TestAnswer rows to insert and the score as a percentage.
+        Essay questions are saved with 0 points for the teacher to grade.
+        """
+        answers = []
+        earned_points = 0
+
+        for question in self.questions:
+            field = f'question_{question.id}'
+            answer = {'attempt_id': attempt_id, 'question_id': question.id, 'answer_text': None,
+                      'selected_options': None, 'points_earned': 0}
+
+            if question.question_type == 'multiple_choice':
+                # Only award points if the selection exactly matches the correct answers
+                selected_options = form.getlist(field)
+                answer['selected_options'] = ','.join(selected_options)
+                if set(selected_options) == question.correct_option_ids:
+                    answer['points_earned'] = question.points
+
+            elif question.question_type == 'true_false':
+                selected_option = form.get(field)
+                if selected_option:
+                    answer['selected_options'] = selected_option
+                    if selected_option in question.correct_option_ids:
+                        answer['points_earned'] = question.points
+
+            elif question.question_type == 'essay':
+                answer['answer_text'] = form.get(f'{field}_essay', '')
+
+            else:
+                continue
+
+            earned_points += answer['points_earned']
+            answers.append(answer)
+
+        total_points = self.total_points
+        score = (earned_points / total_points * 100) if total_points > 0 else 0
+        return answers, score
+
+
+class AnswerKeyCache:
+    """Compiled answer keys by test, validated against Test.answer_key_version
+
+    Every change to a test's questions or options bumps the version stored on
+    the test row, so a worker holding an older key recompiles it on next use.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()  # test id -> (version, AnswerKey)
+
+    def get(self, test):
+        version = test.answer_key_version or 0
+        with self._lock:
+            cached = self._keys.get(test.id)
+            if cached and cached[0] == version:
+                self._keys.move_to_end(test.id)
+                return cached[1]
+
+        answer_key = AnswerKey.load(test.id)
+        with self._lock:
+            self._keys[test.id] = (version, answer_key)
+            self._keys.move_to_end(test.id)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+        return answer_key
+
+    def invalidate(self, test_ids):
+        with self._lock:
+            for test_id in test_ids:
+                self._keys.pop(test_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+answer_keys = AnswerKeyCache()
+
+
+def get_answer_key(test):
+    return answer_keys.get(test)
+
+
+def save_answers(answers):
+    """Insert graded TestAnswer rows with one bulk statement. Does not commit."""
+    if answers:
+        db.session.execute(TestAnswer.__table__.insert(), answers)
+
+
+def _changed_tests(session):
+    """Ids of the tests whose questions or options are being flushed"""
+    test_ids, question_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Question):
+            test_ids.add(obj.test_id)
+        elif isinstance(obj, QuestionOption):
+            question_ids.add(obj.question_id)
+
+    question_ids.discard(None)
+    if question_ids:
+        test_ids.update(session.execute(
+            select(Question.test_id).where(Question.id.in_(list(question_ids)))
+        ).scalars())
+    test_ids.discard(None)
+    return test_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_answer_key_version(session, flush_context):
+    """Invalidate cached answer keys whenever a test's questions or options change"""
+    if not has_app_context() or session is not db.session():
+        return
+    test_ids = _changed_tests(session)
+    if not test_ids:
+        return
+
+    session.execute(Test.__table__.update().where(Test.id.in_(list(test_ids))).values(
+        answer_key_version=db.func.coalesce(Test.__table__.c.answer_key_version, 0) + 1
+    ))
+    answer_keys.invalidate(test_ids)
+    for test_id in test_ids:
+        key = session.identity_key(Test, test_id)
+        if key in session.identity_map:
+            session.expire(session.identity_map[key], ['answer_key_version'])
+
+
+def get_attempt_or_404(attempt_id):
+    """Test attempt with its test, module and course loaded in the same query"""
+    return TestAttempt.query.options(
+        joinedload(TestAttempt.test).joinedload(Test.module).joinedload(Module.course)
+    ).filter(TestAttempt.id == attempt_id).first_or_404()
+
+
+def load_questions(test_id):
+    """Questions of a test and a question id -> [QuestionOption] map, in two queries"""
+    questions = Question.query.filter_by(test_id=test_id).order_by(Question.id).all()
+    options = {}
+    if questions:
+        for option in QuestionOption.query.filter(
+            QuestionOption.question_id.in_([question.id for question in questions])
+        ).order_by(QuestionOption.id):
+            options.setdefault(option.question_id, []).append(option)
+    return questions, options
+
+
+def load_question_data(test_id):
+    """Questions and options for the take_test template"""
+    questions, options = load_questions(test_id)
+    return [{
+        'question': question,
+        'options': options.get(question.id, []) if question.question_type in CHOICE_TYPES else []
+    } for question in questions]
+
+
+def load_result_data(attempt):
+    """Questions, options and the attempt's answers for the test_results template"""
+    questions, options = load_questions(attempt.test_id)
+    answers = {}
+    for answer in TestAnswer.query.filter_by(attempt_id=attempt.id).order_by(TestAnswer.id):
+        answers.setdefault(answer.question_id, answer)
+
+    results = []
+    for question in questions:
+        answer = answers.get(question.id)
+        question_options = []
+        selected_options = []
+        if question.question_type in CHOICE_TYPES:
+            question_options = options.get(question.id, [])
+            if answer and answer.selected_options:
+                selected_options = [int(opt_id) for opt_id in answer.selected_options.split(',') if opt_id]
+
+        results.append({
+            'question': question,
+            'answer': answer,
+            'options': question_options,
+            'selected_options': selected_options
+        })
+    return results
@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import select
+from lms.utils.db import db
+from lms.models.job import Job
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+TASKS = {}  # task name -> Task
+
+logger = logging.getLogger(__name__)
+
+
+class Task:
+    """A function the worker can run from a queued job"""
+
+    def __init__(self, func, name, priority=PRIORITY_NORMAL, max_attempts=3, retry_delay=30):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay  # Seconds before the first retry, doubled on each further one
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def delay(self, priority=None, countdown=0, **kwargs):
+        """Queue a run of the task with JSON-serializable keyword arguments. Does not commit."""
+        return enqueue(self.name, kwargs, priority=self.priority if priority is None else priority,
+                       max_attempts=self.max_attempts, countdown=countdown)
+
+
+def task(name, priority=PRIORITY_NORMAL, max_attempts=3, retry_delay=30):
+    """Register a function as a background task
+
+    Tasks get their arguments as keywords and run in an app context. They
+    may be retried after a partial run, so they must be safe to repeat.
+    Whatever they leave uncommitted is committed with the job's status.
+    """
+    def decorator(f):
+        TASKS[name] = Task(f, name, priority, max_attempts, retry_delay)
+        return TASKS[name]
+    return decorator
+
+
+def enqueue(task_name, arguments=None, priority=PRIORITY_NORMAL, max_attempts=3, countdown=0):
+    """Add a job to the queue. Does not commit.
+
+    The job is written in the caller's transaction, so it only becomes
+    visible to workers if the change that asked for it is committed.
+    """
+    if task_name not in TASKS:
+        raise LookupError(f"Unknown task: {task_name}")
+    job = Job(
+        task=task_name,
+        payload=json.dumps(arguments or {}),
+        priority=priority,
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=countdown),
+        created_by_id=current_user.id if has_request_context() and current_user.is_authenticated else None
+    )
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def claim_job(worker_id):
+    """Mark the next due job as running by this worker and return it, or None when nothing is due"""
+    now = datetime.utcnow()
+    query = select(Job.id).where(
+        Job.status == Job.QUEUED, Job.run_at <= now
+    ).order_by(Job.priority.desc(), Job.run_at, Job.id).limit(1)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    # Another worker may claim the same row between the SELECT and the UPDATE; try the next one then
+    for _ in range(5):
+        job_id = db.session.execute(query).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+        claimed = db.session.execute(Job.__table__.update().where(
+            Job.__table__.c.id == job_id, Job.__table__.c.status == Job.QUEUED
+        ).values(
+            status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=Job.__table__.c.attempts + 1
+        )).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome, scheduling a retry with backoff when it fails"""
+    job_id = job.id
+    try:
+        task = TASKS.get(job.task)
+        if task is None:
+            raise LookupError(f"Unknown task: {job.task}")
+        result = task.func(**job.arguments)
+        job = db.session.get(Job, job_id)
+        job.status = Job.SUCCEEDED
+        job.result = json.dumps(result) if result is not None else None
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Job {job_id} failed")
+        job = db.session.get(Job, job_id)
+        job.last_error = f'{type(e).__name__}: {e}'
+        job.locked_by = None
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished_at = datetime.utcnow()
+        else:
+            retry_delay = TASKS[job.task].retry_delay if job.task in TASKS else 30
+            job.status = Job.QUEUED
+            job.run_at = datetime.utcnow() + timedelta(seconds=retry_delay * 2 ** (job.attempts - 1))
+        db.session.commit()
+        return False
+
+
+def renew_lease(job_id, worker_id):
+    """Record that a worker is still running a job, on a connection of its own outside the task's transaction"""
+    table = Job.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(table.update().where(
+            table.c.id == job_id, table.c.locked_by == worker_id, table.c.status == Job.RUNNING
+        ).values(locked_at=datetime.utcnow())).rowcount
+
+
+class Heartbeat:
+    """Renews the lease of a running job from a background thread until the job ends
+
+    Jobs are only given back to the queue when their lease has not been
+    renewed for a while, so a long job is never picked up by a second
+    worker while the first one is still alive.
+    """
+
+    def __init__(self, app, job_id, worker_id, interval):
+        self.app = app
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f'job-{job_id}-heartbeat', daemon=True)
+
+    def _beat(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    renew_lease(self.job_id, self.worker_id)
+            except Exception:
+                logger.warning(f"Could not renew the lease of job {self.job_id}", exc_info=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+def requeue_stale_jobs(timeout):
+    """Give jobs back to the queue whose worker stopped renewing their lease, failing those out of attempts"""
+    table = Job.__table__
+    now = datetime.utcnow()
+    stale = (table.c.status == Job.RUNNING) & (table.c.locked_at < now - timedelta(seconds=timeout))
+    db.session.execute(table.update().where(stale, table.c.attempts >= table.c.max_attempts).values(
+        status=Job.FAILED, locked_by=None, finished_at=now, last_error='Worker stopped while running the job'
+    ))
+    count = db.session.execute(table.update().where(stale).values(status=Job.QUEUED, locked_by=None)).rowcount
+    db.session.commit()
+    return count
+
+
+class Worker:
+    """Polls the jobs table and runs due jobs one at a time. Start more processes to run more at once."""
+
+    def __init__(self, app, worker_id=None, poll_interval=1.0, stale_after=60):
+        self.app = app
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after  # Seconds without a heartbeat after which a running job is presumed abandoned
+        self.stopped = False
+
+    def run_pending(self):
+        """Run every job that is due now and return how many ran"""
+        count = 0
+        with self.app.app_context():
+            try:
+                while not self.stopped:
+                    job = claim_job(self.worker_id)
+                    if job is None:
+                        break
+                    with Heartbeat(self.app, job.id, self.worker_id, self.stale_after / 4):
+                        run_job(job)
+                    count += 1
+            finally:
+                db.session.remove()
+        return count
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def run(self):
+        """Process jobs until SIGINT or SIGTERM, finishing the current job first"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self._loop()
+
+    def start(self):
+        """Process jobs in a daemon thread of the current process, e.g. next to the development server"""
+        thread = threading.Thread(target=self._loop, name='job-worker', daemon=True)
+        thread.start()
+        return thread
+
+    def _loop(self):
+        logger.info(f"Worker {self.worker_id} started")
+        last_recovery = float('-inf')
+        while not self.stopped:
+            if time.monotonic() - last_recovery > self.stale_after:
+                with self.app.app_context():
+                    requeue_stale_jobs(self.stale_after)
+                    db.session.remove()
+                last_recovery = time.monotonic()
+            if not self.run_pending():
+                time.sleep(self.poll_interval)
+        logger.info(f"Worker {self.worker_id} stopped")
@@ -0,0 +1,327 @@
+from datetime import datetime
+from flask import has_app_context
+from sqlalchemy import bindparam, event, inspect, select, tuple_
+from sqlalchemy.orm import Session, joinedload
+from lms.utils.db import db
+from lms.utils.gradebook import Gradebook, summary_parts
+from lms.models.course import (Course, Assignment, Submission, Enrollment, EnrollmentProgress,
+                               Module, Test, TestAttempt, ModuleProgress)
+
+# EnrollmentProgress columns that depend on each kind of row
+PROGRESS_COLUMNS = {
+    Submission: ('assignments_submitted', 'assignments_graded', 'overall_grade'),
+    TestAttempt: ('tests_passed', 'overall_grade'),
+    ModuleProgress: ('modules_completed',),
+}
+
+
+class StudentProgressService:
+    """Compute a student's course progress with a fixed number of grouped queries.
+
+    The number of queries issued does not depend on how many courses the student
+    is enrolled in or how many assignments those courses have.
+    """
+
+    def __init__(self, student_id):
+        self.student_id = student_id
+        self._enrollments = None
+        self._progress = None
+
+    @property
+    def enrollments(self):
+        """All enrollments of the student with their course, teacher and stored progress loaded"""
+        if self._enrollments is None:
+            rows = db.session.query(Enrollment, EnrollmentProgress).options(
+                joinedload(Enrollment.course).joinedload(Course.teacher)
+            ).outerjoin(
+                EnrollmentProgress, _progress_of(Enrollment)
+            ).filter(
+                Enrollment.student_id == self.student_id
+            ).order_by(Enrollment.id).all()
+            self._enrollments = [enrollment for enrollment, _ in rows]
+            self._progress = {enrollment.course_id: progress for enrollment, progress in rows
+                              if progress is not None}
+        return self._enrollments
+
+    @property
+    def course_ids(self):
+        return [enrollment.course_id for enrollment in self.enrollments]
+
+    def assignment_totals(self, course_ids=None):
+        """Map course id -> number of assignments in the course"""
+        course_ids = self.course_ids if course_ids is None else course_ids
+        if not course_ids:
+            return {}
+
+        rows = db.session.query(
+            Assignment.course_id,
+            db.func.count(Assignment.id)
+        ).filter(
+            Assignment.course_id.in_(course_ids)
+        ).group_by(Assignment.course_id).all()
+        return {course_id: total for course_id, total in rows}
+
+    def module_totals(self, course_ids=None):
+        """Map course id -> number of modules in the course"""
+        course_ids = self.course_ids if course_ids is None else course_ids
+        if not course_ids:
+            return {}
+
+        return dict(db.session.query(
+            Module.course_id,
+            db.func.count(Module.id)
+        ).filter(
+            Module.course_id.in_(course_ids)
+        ).group_by(Module.course_id).all())
+
+    def enrollment_progress(self):
+        """Map course id -> EnrollmentProgress row of the student, loaded with the enrollments"""
+        course_ids = self.course_ids
+        rows = dict(self._progress)
+
+        # Enrollments that predate the progress table are computed on the fly
+        missing = [course_id for course_id in course_ids if course_id not in rows]
+        if missing:
+            gradebook = Gradebook(missing, [self.student_id])
+            for course_id in missing:
+                rows[course_id] = EnrollmentProgress(
+                    student_id=self.student_id,
+                    course_id=course_id,
+                    **gradebook.progress_summary(self.student_id, course_id)
+                )
+        return rows
+
+    def submissions_by_assignment(self, assignment_ids):
+        """Map assignment id -> the student's submission for that assignment"""
+        if not assignment_ids:
+            return {}
+
+        submissions = Submission.query.filter(
+            Submission.student_id == self.student_id,
+            Submission.assignment_id.in_(assignment_ids)
+        ).order_by(Submission.id).all()
+
+        # Keep the first submission per assignment, matching Query.first() semantics
+        result = {}
+        for submission in submissions:
+            result.setdefault(submission.assignment_id, submission)
+        return result
+
+    def course_stats(self):
+        """Per-course assignment statistics used by the student dashboard"""
+        totals = self.assignment_totals()
+        progress_rows = self.enrollment_progress()
+
+        course_stats = []
+        for enrollment in self.enrollments:
+            course = enrollment.course
+            total_assignments = totals.get(course.id, 0)
+            completed_assignments = progress_rows[course.id].assignments_submitted
+
+            if total_assignments > 0:
+                progress = (completed_assignments / total_assignments) * 100
+            else:
+                progress = 100  # No assignments means 100% complete
+
+            course_stats.append({
+                'id': course.id,
+                'title': course.title,
+                'teacher': course.teacher.get_full_name(),
+                'total_assignments': total_assignments,
+                'completed_assignments': completed_assignments,
+                'progress': progress,
+                'enrollment_progress': progress_rows[course.id]
+            })
+        return course_stats
+
+    def assignment_data(self):
+        """Every assignment of the student's courses paired with its submission"""
+        course_ids = self.course_ids
+        if not course_ids:
+            return []
+
+        assignments = Assignment.query.options(
+            joinedload(Assignment.course)
+        ).filter(
+            Assignment.course_id.in_(course_ids)
+        ).all()
+        submissions = self.submissions_by_assignment([a.id for a in assignments])
+
+        return [{
+            'assignment': assignment,
+            'course': assignment.course,
+            'submission': submissions.get(assignment.id)
+        } for assignment in assignments]
+
+
+def _progress_of(enrollment):
+    return (EnrollmentProgress.student_id == enrollment.student_id) & \
+        (EnrollmentProgress.course_id == enrollment.course_id)
+
+
+def _computed_progress(student_id, course_id):
+    summary = Gradebook([course_id], [student_id]).progress_summary(student_id, course_id)
+    return EnrollmentProgress(student_id=student_id, course_id=course_id, **summary)
+
+
+def get_enrollment_with_progress(student_id, course_id):
+    """Enrollment of a student in a course and its progress, read together by primary key
+
+    Returns (None, None) when the student is not enrolled.
+    """
+    row = db.session.query(Enrollment, EnrollmentProgress).outerjoin(
+        EnrollmentProgress, _progress_of(Enrollment)
+    ).filter(
+        Enrollment.student_id == student_id, Enrollment.course_id == course_id
+    ).first()
+    if row is None:
+        return None, None
+    enrollment, progress = row
+    return enrollment, progress if progress is not None else _computed_progress(student_id, course_id)
+
+
+def _write_progress_rows(session, pairs, gradebook):
+    """Replace the EnrollmentProgress rows of the given pairs that still have an enrollment"""
+    table = EnrollmentProgress.__table__
+    enrollment_key = tuple_(Enrollment.student_id, Enrollment.course_id)
+    enrolled = set(session.execute(
+        select(Enrollment.student_id, Enrollment.course_id).where(enrollment_key.in_(list(pairs)))
+    ).all())
+
+    session.execute(table.delete().where(
+        tuple_(table.c.student_id, table.c.course_id).in_(list(pairs))
+    ))
+
+    now = datetime.utcnow()
+    rows = [dict(student_id=student_id, course_id=course_id, updated_at=now,
+                 **gradebook.progress_summary(student_id, course_id))
+            for student_id, course_id in enrolled]
+    if rows:
+        session.execute(table.insert(), rows)
+    return len(rows)
+
+
+def _update_progress_columns(session, pairs, gradebook, columns):
+    """Update some columns of the stored EnrollmentProgress rows of the given pairs
+
+    Pairs without a row are left alone: their progress is computed on the fly.
+    """
+    table = EnrollmentProgress.__table__
+    now = datetime.utcnow()
+    rows = [dict(pair_student_id=student_id, pair_course_id=course_id, updated_at=now,
+                 **gradebook.progress_summary(student_id, course_id, columns))
+            for student_id, course_id in pairs]
+    return session.execute(table.update().where(
+        table.c.student_id == bindparam('pair_student_id'), table.c.course_id == bindparam('pair_course_id')
+    ), rows).rowcount
+
+
+def refresh_enrollment_progress(pairs, columns=None):
+    """Recompute the stored progress of (student id, course id) pairs. Does not commit.
+
+    With columns, only those counters of the stored rows are recomputed,
+    running just the gradebook queries they need.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+
+    course_ids = {course_id for _, course_id in pairs}
+    student_ids = {student_id for student_id, _ in pairs}
+    if columns is None:
+        updated = _write_progress_rows(db.session, pairs, Gradebook(course_ids, student_ids))
+    else:
+        gradebook = Gradebook(course_ids, student_ids, parts=summary_parts(columns))
+        updated = _update_progress_columns(db.session, pairs, gradebook, columns)
+
+    # Make sure rows already in the identity map are reloaded on next access
+    for student_id, course_id in pairs:
+        key = db.session.identity_key(EnrollmentProgress, (student_id, course_id))
+        if key in db.session.identity_map:
+            db.session.expire(db.session.identity_map[key])
+    return updated
+
+
+def rebuild_enrollment_progress(course_id=None):
+    """Rebuild stored progress for one course or for every course. Does not commit."""
+    if course_id is not None:
+        course_ids = [course_id]
+    else:
+        course_ids = [cid for (cid,) in db.session.query(Enrollment.course_id).distinct().all()]
+
+    rebuilt = 0
+    for cid in course_ids:
+        pairs = {(student_id, cid) for (student_id,) in db.session.query(Enrollment.student_id).filter(
+            Enrollment.course_id == cid
+        ).all()}
+        db.session.execute(EnrollmentProgress.__table__.delete().where(
+            EnrollmentProgress.course_id == cid
+        ))
+        if pairs:
+            rebuilt += _write_progress_rows(db.session, pairs, Gradebook.for_course(cid))
+    return rebuilt
+
+
+def _enrollment_keys(session):
+    """(student id, course id) pairs of the enrollments added, removed or moved by a flush
+
+    Other changes to an enrollment, such as its overall grade written by
+    recompute_course_grades(), do not affect its progress.
+    """
+    pairs = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Enrollment):
+            pairs.add((obj.student_id, obj.course_id))
+    for obj in session.dirty:
+        if not isinstance(obj, Enrollment):
+            continue
+        student_id, course_id = inspect(obj).attrs.student_id.history, inspect(obj).attrs.course_id.history
+        if student_id.has_changes() or course_id.has_changes():
+            pairs.add((obj.student_id, obj.course_id))
+            pairs.add(((student_id.deleted or [obj.student_id])[0], (course_id.deleted or [obj.course_id])[0]))
+    return pairs
+
+
+def _touched_enrollments(session):
+    """Map (student id, course id) pair -> the progress columns the objects being flushed affect
+
+    None stands for every column, when the enrollment itself was added or removed.
+    """
+    students_by_id = {model: {} for model in PROGRESS_COLUMNS}
+    id_columns = {Submission: 'assignment_id', TestAttempt: 'test_id', ModuleProgress: 'module_id'}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        model = type(obj)
+        if model in students_by_id:
+            students_by_id[model].setdefault(getattr(obj, id_columns[model]), set()).add(obj.student_id)
+
+    touched = {}
+    lookups = (
+        (Submission, select(Assignment.id, Assignment.course_id), Assignment.id),
+        (TestAttempt, select(Test.id, Module.course_id).join(Module, Test.module_id == Module.id), Test.id),
+        (ModuleProgress, select(Module.id, Module.course_id), Module.id),
+    )
+    for model, statement, id_column in lookups:
+        by_id = students_by_id[model]
+        if not by_id:
+            continue
+        for object_id, course_id in session.execute(statement.where(id_column.in_(list(by_id)))):
+            for student_id in by_id[object_id]:
+                touched.setdefault((student_id, course_id), set()).update(PROGRESS_COLUMNS[model])
+
+    for pair in _enrollment_keys(session):
+        touched[pair] = None
+
+    return {(student_id, course_id): columns for (student_id, course_id), columns in touched.items()
+            if student_id is not None and course_id is not None}
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_touched_enrollment_progress(session, flush_context):
+    """Keep EnrollmentProgress current whenever enrollments, submissions, attempts or module progress change"""
+    if not has_app_context() or session is not db.session():
+        return
+    pairs_by_columns = {}
+    for pair, columns in _touched_enrollments(session).items():
+        pairs_by_columns.setdefault(columns and tuple(sorted(columns)), set()).add(pair)
+    for columns, pairs in pairs_by_columns.items():
+        refresh_enrollment_progress(pairs, columns)
@@ -0,0 +1,186 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+
+
+class Subscription:
+    """Events published to one channel, read by a single consumer"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue()
+
+    def get(self, timeout=None):
+        """Next (event, data) pair, or None when nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process pub/sub. Only reaches subscribers in the same worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # channel -> set of Subscription
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channel, event, data):
+        self._deliver(channel, event, data)
+
+    def _deliver(self, channel, event, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.queue.put((event, data))
+
+
+class SQLiteBroker(LocalBroker):
+    """Pub/sub shared by several worker processes through an SQLite file
+
+    Events are appended to a table and every process polls it from a single
+    background thread, then fans them out to its local subscribers.
+    """
+
+    def __init__(self, path, poll_interval=0.5, retention=300):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS pubsub_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM pubsub_events').fetchone()[0]
+        self._poller = None
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def subscribe(self, channel):
+        subscription = super().subscribe(channel)
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='pubsub-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def publish(self, channel, event, data):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT INTO pubsub_events (channel, event, data, created_at) VALUES (?, ?, ?, ?)',
+                         (channel, event, json.dumps(data), now))
+            conn.execute('DELETE FROM pubsub_events WHERE created_at < ?', (now - self.retention,))
+
+    def poll_once(self):
+        """Deliver the events published since the last poll"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, channel, event, data FROM pubsub_events WHERE id > ? ORDER BY id',
+                                (self._last_id,)).fetchall()
+        for event_id, channel, event, data in rows:
+            self._last_id = event_id
+            self._deliver(channel, event, json.loads(data))
+        return len(rows)
+
+    def _poll(self):
+        while True:
+            try:
+                self.poll_once()
+            except sqlite3.Error as e:
+                logging.error(f"Error polling pub/sub events: {str(e)}")
+            time.sleep(self.poll_interval)
+
+
+def create_broker(url):
+    """Build a broker from a PUBSUB_URL setting: 'local' or 'sqlite:///path/to/file.db'"""
+    if not url or url == 'local':
+        return LocalBroker()
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported PUBSUB_URL: {url}")
+
+
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Broker of the current app, created on first use"""
+    with _broker_lock:
+        broker = current_app.extensions.get('pubsub')
+        if broker is None:
+            broker = current_app.extensions['pubsub'] = create_broker(current_app.config.get('PUBSUB_URL'))
+    return broker
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def publish(channel, event, data):
+    """Publish an event, logging instead of raising so callers never fail on delivery"""
+    try:
+        get_broker().publish(channel, event, data)
+    except Exception as e:
+        current_app.logger.error(f"Error publishing {event} event: {str(e)}")
+
+
+class StreamSlots:
+    """Count of the event streams a process holds open, each of which occupies a worker thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+
+    def acquire(self, limit):
+        """Take a slot, or return False when limit streams are already open"""
+        with self._lock:
+            if self.open >= limit:
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+
+stream_slots = StreamSlots()
+
+
+def format_sse(event, data):
+    """Encode an event in the Server-Sent Events wire format"""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
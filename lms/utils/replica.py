@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from flask import current_app, has_request_context, request, session as login_session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+_replica_lock = threading.Lock()
+
+
+def get_replica_engine():
+    """Engine of the read replica named by SQLALCHEMY_REPLICA_URI, or None when there is none"""
+    uri = current_app.config.get('SQLALCHEMY_REPLICA_URI')
+    if not uri:
+        return None
+    with _replica_lock:
+        engine = current_app.extensions.get('db_replica')
+        if engine is None:
+            url = make_url(uri)
+            # Relative SQLite paths are resolved like Flask-SQLAlchemy does for the primary
+            if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:' \
+                    and not os.path.isabs(url.database):
+                url = url.set(database=os.path.join(current_app.instance_path, url.database))
+            engine = current_app.extensions['db_replica'] = create_engine(
+                url, echo=current_app.config.get('SQLALCHEMY_ECHO', False),
+                **current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+            )
+    return engine
+
+
+class RoutingSession(FlaskSession):
+    """Session that sends reads to the replica while session.info['read_from_replica'] is set
+
+    Flushes and any statement other than a SELECT go to the primary and turn
+    the routing off for the rest of the session, so a request reads its own
+    writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_from_replica'):
+            if self._flushing or (clause is not None and not isinstance(clause, Select)):
+                self.info['read_from_replica'] = False
+            else:
+                engine = get_replica_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _read_from_replica():
+    """Route the reads of a GET request to the replica, unless the user wrote something moments ago"""
+    from lms.utils.db import db
+
+    if request.method not in ('GET', 'HEAD') or get_replica_engine() is None:
+        return
+    last_write_at = login_session.get('last_write_at')
+    if last_write_at and time.time() - last_write_at < current_app.config.get('REPLICA_STICKY_SECONDS', 10):
+        return
+    db.session.info['read_from_replica'] = True
+
+
+def _stop_reading_from_replica(exc):
+    from lms.utils.db import db
+
+    db.session.info.pop('read_from_replica', None)
+
+
+def route_reads_to_replica(blueprint):
+    """Serve the GET handlers of a blueprint from the read replica when one is configured"""
+    blueprint.before_request(_read_from_replica)
+    blueprint.teardown_request(_stop_reading_from_replica)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_write(session):
+    """Keep the user's reads on the primary until the replica has caught up with their write"""
+    if session.info.pop('wrote', False) and has_request_context():
+        login_session['last_write_at'] = time.time()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
@@ -0,0 +1,179 @@
+import re
+from flask import has_app_context
+from sqlalchemy import DDL, Float, Integer, bindparam, event, select, text
+from sqlalchemy.orm import Session
+from lms.utils.db import db
+from lms.models.course import Course, Module, Material
+
+
+class SearchBackend:
+    """Full-text index of course documents: a title and a body built from the
+    course description, its modules and its materials."""
+
+    create_statements = ()
+    drop_statements = ('DROP TABLE IF EXISTS course_search',)
+
+    @staticmethod
+    def terms(query):
+        return re.findall(r'\w+', query or '')
+
+    def replace_documents(self, session, documents):
+        """Insert (course id, title, body) documents, replacing older versions"""
+        self.delete_documents(session, [course_id for course_id, _, _ in documents])
+        if documents:
+            session.execute(text(self.insert_statement), [
+                {'course_id': course_id, 'title': title, 'body': body}
+                for course_id, title, body in documents
+            ])
+
+    def delete_documents(self, session, course_ids):
+        if course_ids:
+            session.execute(text(self.delete_statement).bindparams(bindparam('course_ids', expanding=True)),
+                            {'course_ids': list(course_ids)})
+
+    def clear(self, session):
+        session.execute(text('DELETE FROM course_search'))
+
+    def matches(self, query):
+        """Subquery of (course_id, rank) for courses matching every term as a prefix, best rank highest"""
+        terms = self.terms(query)
+        if terms:
+            statement = text(self.match_statement).bindparams(query=self.match_query(terms))
+        else:
+            statement = text('SELECT NULL AS course_id, NULL AS rank WHERE 1 = 0')
+        return statement.columns(course_id=Integer, rank=Float).subquery('search_matches')
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """SQLite FTS5 virtual table keyed by the course id as rowid"""
+
+    create_statements = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5("
+        "title, body, tokenize = 'unicode61 remove_diacritics 2')",
+    )
+    insert_statement = 'INSERT INTO course_search (rowid, title, body) VALUES (:course_id, :title, :body)'
+    delete_statement = 'DELETE FROM course_search WHERE rowid IN :course_ids'
+    # bm25() is lower for better matches; titles weigh ten times more than the body
+    match_statement = ('SELECT rowid AS course_id, -bm25(course_search, 10.0, 1.0) AS rank '
+                       'FROM course_search WHERE course_search MATCH :query')
+
+    def match_query(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """PostgreSQL table with a weighted, GIN-indexed tsvector"""
+
+    create_statements = (
+        "CREATE TABLE IF NOT EXISTS course_search ("
+        "course_id INTEGER PRIMARY KEY REFERENCES courses (id) ON DELETE CASCADE, "
+        "title TEXT, body TEXT, "
+        "document tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED)",
+        'CREATE INDEX IF NOT EXISTS ix_course_search_document ON course_search USING GIN (document)',
+    )
+    insert_statement = 'INSERT INTO course_search (course_id, title, body) VALUES (:course_id, :title, :body)'
+    delete_statement = 'DELETE FROM course_search WHERE course_id IN :course_ids'
+    match_statement = ("SELECT course_id, ts_rank_cd(document, to_tsquery('english', :query)) AS rank "
+                       "FROM course_search WHERE document @@ to_tsquery('english', :query)")
+
+    def match_query(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend(),
+    'postgresql': PostgresSearchBackend(),
+}
+
+
+def get_backend(dialect_name=None):
+    return BACKENDS[dialect_name or db.engine.dialect.name]
+
+
+# Create and drop the index together with the rest of the schema
+for _dialect, _backend in BACKENDS.items():
+    for _statement in _backend.create_statements:
+        event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+    for _statement in _backend.drop_statements:
+        event.listen(db.metadata, 'before_drop', DDL(_statement).execute_if(dialect=_dialect))
+
+
+def ensure_schema():
+    """Create the search index if it does not exist yet"""
+    for statement in get_backend().create_statements:
+        db.session.execute(text(statement))
+
+
+def build_documents(session, course_ids):
+    """(course id, title, body) of each course, built from its modules and materials"""
+    course_ids = list(course_ids)
+    if not course_ids:
+        return []
+
+    parts = {}
+    courses = session.execute(
+        select(Course.id, Course.title, Course.description).where(Course.id.in_(course_ids))
+    ).all()
+    for course_id, title, description in courses:
+        parts[course_id] = [description]
+
+    for course_id, title, description in session.execute(
+        select(Module.course_id, Module.title, Module.description).where(Module.course_id.in_(course_ids))
+    ):
+        parts[course_id] += [title, description]
+
+    for course_id, title, content_type, content in session.execute(
+        select(Material.course_id, Material.title, Material.content_type, Material.content).where(
+            Material.course_id.in_(course_ids)
+        )
+    ):
+        # Links and files only contribute their title
+        parts[course_id] += [title, content if content_type == 'text' else None]
+
+    return [(course_id, title, '\n'.join(part for part in parts[course_id] if part))
+            for course_id, title, _ in courses]
+
+
+def index_courses(course_ids, session=None):
+    """Rebuild the search documents of some courses. Does not commit."""
+    session = session or db.session
+    course_ids = set(course_ids)
+    documents = build_documents(session, course_ids)
+    backend = get_backend(session.get_bind().dialect.name)
+    backend.delete_documents(session, course_ids - {course_id for course_id, _, _ in documents})
+    backend.replace_documents(session, documents)
+    return len(documents)
+
+
+def rebuild_search_index(batch_size=500):
+    """Reindex every course. Does not commit."""
+    ensure_schema()
+    get_backend().clear(db.session)
+    course_ids = [course_id for (course_id,) in db.session.query(Course.id).order_by(Course.id)]
+    for start in range(0, len(course_ids), batch_size):
+        index_courses(course_ids[start:start + batch_size])
+    return len(course_ids)
+
+
+def _touched_courses(session):
+    """Ids of the courses whose search document depends on the objects being flushed"""
+    course_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Course):
+            course_ids.add(obj.id)
+        elif isinstance(obj, (Module, Material)):
+            course_ids.add(obj.course_id)
+    course_ids.discard(None)
+    return course_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _reindex_touched_courses(session, flush_context):
+    """Keep the search index current whenever courses, modules or materials change"""
+    if not has_app_context() or session is not db.session():
+        return
+    course_ids = _touched_courses(session)
+    if course_ids:
+        index_courses(course_ids, session)
@@ -0,0 +1,260 @@
+import hashlib
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select, case, func, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+from lms.utils.db import db
+from lms.utils.files import UPLOADS_PREFIX, is_content_addressed
+from lms.models.user import User
+from lms.models.course import Course, Material, Submission, Enrollment
+from lms.models.stored_file import StoredFile
+
+# Columns holding paths of uploaded files, relative to the static folder
+FILE_COLUMNS = (
+    Material.file_path,
+    Submission.file_path,
+    Course.image_path,
+    Course.payment_receipt_path,
+    Enrollment.payment_receipt_path,
+    User.certificate_path,
+)
+
+CHUNK_SIZE = 64 * 1024
+_STORED_PATH = re.compile(r'uploads/([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})(\.[a-z0-9]{1,10})?')
+
+
+def _full_path(path):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *path[len(UPLOADS_PREFIX):].split('/'))
+
+
+def content_path(sha256, filename=None):
+    """Stored path of a file with this content: 'uploads/ab/cd/<sha256><ext>'
+
+    The extension of the uploaded name is kept so the file is served with
+    the right mimetype; the same bytes under another extension are a
+    separate file.
+    """
+    extension = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', extension):
+        extension = ''
+    return f'{UPLOADS_PREFIX}{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def store_upload(file):
+    """Store an uploaded file under the hash of its content and return its path. Does not commit.
+
+    The upload is streamed through the hash into a temporary file, so it is
+    never held in memory, and moved into place once its row is claimed; a
+    file with the same content is stored only once. The file counts as
+    referenced when a row holding the returned path is flushed.
+    """
+    tmp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+
+        path = content_path(digest.hexdigest(), file.filename)
+        _claim(path, digest.hexdigest(), size)
+        full_path = _full_path(path)
+        if os.path.isfile(full_path) and os.path.getsize(full_path) == size:
+            os.remove(tmp_path)  # Already stored
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(tmp_path, full_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _claim(path, sha256, size):
+    """Lock the row of a stored file, creating it if needed, so reclaim() leaves the file alone
+
+    reclaim() only deletes rows without references, and this transaction
+    holds the row until the rows referencing the file are committed.
+    """
+    table = StoredFile.__table__
+    now = datetime.utcnow()
+    claim = table.update().where(table.c.path == path).values(
+        released_at=case((table.c.ref_count <= 0, now), else_=table.c.released_at)
+    )
+    if db.session.execute(claim).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(StoredFile(path=path, sha256=sha256, size=size, ref_count=0, released_at=now))
+    except IntegrityError:
+        # Stored concurrently by another request
+        db.session.execute(claim)
+
+
+def change_references(session, deltas):
+    """Add to the reference counts of stored files, by path. Does not commit.
+
+    Files left without references are reclaimed by a background job once
+    the transaction commits.
+    """
+    table = StoredFile.__table__
+    now = datetime.utcnow()
+    released = session.info.setdefault('released_files', set())
+    for path, delta in deltas.items():
+        if not delta or not path or not is_content_addressed(path):
+            continue
+        count = table.c.ref_count + delta
+        session.execute(table.update().where(table.c.path == path).values(
+            ref_count=count, released_at=case((count <= 0, now), else_=None)
+        ))
+        if delta < 0:
+            released.add(path)
+
+
+def _file_attributes(obj):
+    return [column.key for column in FILE_COLUMNS if isinstance(obj, column.class_)]
+
+
+def _reference_changes(session):
+    """Paths referenced and no longer referenced by the objects of a flush, with multiplicity"""
+    deltas = Counter()
+    for obj in session.new:
+        for key in _file_attributes(obj):
+            deltas[getattr(obj, key)] += 1
+    for obj in session.deleted:
+        for key in _file_attributes(obj):
+            value = inspect(obj).attrs[key].loaded_value
+            if isinstance(value, str):
+                deltas[value] -= 1
+    for obj in session.dirty:
+        for key in _file_attributes(obj):
+            history = inspect(obj).attrs[key].history
+            for value in history.added:
+                deltas[value] += 1
+            for value in history.deleted:
+                deltas[value] -= 1
+    return deltas
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_references(session, flush_context):
+    """Keep the reference counts of stored files in step with the rows holding their paths"""
+    if not has_app_context() or session is not db.session():
+        return
+    change_references(session, _reference_changes(session))
+
+
+@event.listens_for(Session, 'before_commit')
+def _queue_reclaim(session):
+    """Queue the removal of files released in the transaction, committed along with it"""
+    if not has_app_context() or session is not db.session() or session.in_nested_transaction():
+        return
+    paths = session.info.pop('released_files', None)
+    if paths:
+        from lms.utils.tasks import reclaim_files
+        reclaim_files.delay(paths=sorted(paths))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_released(session):
+    session.info.pop('released_files', None)
+
+
+def reclaim(paths):
+    """Delete stored files that nothing refers to any more, committing after each one
+
+    The row is deleted first and the file removed while the delete holds its
+    lock, so an upload of the same content waits in store_upload() and then
+    stores the file again instead of reusing one that is going away.
+    """
+    table = StoredFile.__table__
+    removed = 0
+    for path in paths:
+        if not db.session.execute(table.delete().where(table.c.path == path, table.c.ref_count <= 0)).rowcount:
+            db.session.commit()
+            continue
+        try:
+            os.remove(_full_path(path))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error removing file {path}: {str(e)}")
+            continue
+        db.session.commit()
+    return removed
+
+
+def _orphaned_files(cutoff):
+    """Stored paths of files on disk older than cutoff, whether or not a row knows them"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    for root, dirs, files in os.walk(upload_folder):
+        relative = os.path.relpath(root, upload_folder).replace(os.sep, '/')
+        if relative != '.' and not re.fullmatch(r'[0-9a-f]{2}(/[0-9a-f]{2})?', relative):
+            dirs[:] = []
+            continue
+        for name in files:
+            path = f'{UPLOADS_PREFIX}{relative}/{name}'
+            if _STORED_PATH.fullmatch(path) and \
+                    datetime.utcfromtimestamp(os.path.getmtime(os.path.join(root, name))) < cutoff:
+                yield path
+
+
+def collect_garbage(grace_seconds=3600):
+    """Remove stored files unreferenced for longer than the grace period and return how many went
+
+    This catches what the reclaim jobs missed: files released before a job
+    ran, claimed by an upload whose row was never saved, or written to disk
+    by a request that then rolled back, which have no row at all. Those are
+    given one so reclaim() can delete them under the same lock as any other.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    paths = db.session.execute(
+        select(StoredFile.path).where(StoredFile.ref_count <= 0, StoredFile.released_at < cutoff)
+    ).scalars().all()
+    removed = reclaim(paths)
+
+    for path in _orphaned_files(cutoff):
+        if db.session.get(StoredFile, path) is not None:
+            continue
+        match = _STORED_PATH.fullmatch(path)
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredFile(path=path, sha256=match.group(3), size=os.path.getsize(_full_path(path)),
+                                          ref_count=0, released_at=cutoff))
+        except IntegrityError:
+            continue  # Stored concurrently by an upload
+        removed += reclaim([path])
+
+    tmp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+    if os.path.isdir(tmp_dir):
+        for name in os.listdir(tmp_dir):
+            tmp_path = os.path.join(tmp_dir, name)
+            if datetime.utcfromtimestamp(os.path.getmtime(tmp_path)) < cutoff:
+                os.remove(tmp_path)
+    return removed
+
+
+def recount_references():
+    """Recompute the reference counts of all stored files from the rows holding their paths. Does not commit."""
+    table = StoredFile.__table__
+    references = union_all(*[
+        select(column.label('path')).where(column.isnot(None)) for column in FILE_COLUMNS
+    ]).subquery()
+    count = select(func.count()).select_from(references).where(references.c.path == table.c.path).scalar_subquery()
+    return db.session.execute(table.update().values(
+        ref_count=count,
+        released_at=case((count > 0, None), else_=func.coalesce(table.c.released_at, datetime.utcnow()))
+    )).rowcount
@@ -0,0 +1,77 @@
+from datetime import datetime
+from sqlalchemy import select
+from lms.utils.db import db
+from lms.utils.jobs import task, PRIORITY_HIGH, PRIORITY_LOW
+from lms.utils.deletion import delete_courses
+from lms.utils.storage import reclaim, collect_garbage
+from lms.utils.gradebook import Gradebook
+from lms.utils.pubsub import publish, user_channel
+from lms.models.course import Enrollment
+from lms.models.message import Message, Conversation
+
+
+@task('grades.recompute', priority=PRIORITY_HIGH)
+def recompute_course_grade(student_id, course_id):
+    """Calculate and update the overall grade for a student in a course"""
+    gradebook = Gradebook(course_ids=[course_id], student_ids=[student_id])
+
+    if not gradebook.has_assignments(course_id):
+        return None  # No assignments to grade
+
+    overall_grade = gradebook.overall_grade(student_id, course_id)
+    if overall_grade is not None:
+        enrollment = Enrollment.query.filter_by(student_id=student_id, course_id=course_id).first()
+        if enrollment:
+            enrollment.overall_grade = overall_grade
+    return overall_grade
+
+
+@task('courses.delete', priority=PRIORITY_LOW)
+def delete_course(course_id):
+    """Delete a course with all its content, then its orphaned upload files"""
+    report = delete_courses([course_id])
+    db.session.commit()
+    report.remove_files()
+    return report.counts
+
+
+@task('storage.reclaim', priority=PRIORITY_LOW)
+def reclaim_files(paths):
+    """Remove the stored files released by a committed transaction that are still unreferenced"""
+    return {'removed': reclaim(paths)}
+
+
+@task('storage.collect_garbage', priority=PRIORITY_LOW)
+def collect_stored_garbage(grace_seconds=3600):
+    """Remove stored files left unreferenced or orphaned for longer than the grace period"""
+    return {'removed': collect_garbage(grace_seconds)}
+
+
+@task('messages.notify_course')
+def notify_course_students(sender_id, course_id, content, sent_at=None):
+    """Send the same message to every student enrolled in a course
+
+    The messages are all created at sent_at, so a retry recognizes the
+    students who already got this one and skips them.
+    """
+    created_at = datetime.fromisoformat(sent_at) if sent_at else datetime.utcnow()
+    query = select(Enrollment.student_id).where(Enrollment.course_id == course_id, Enrollment.student_id != sender_id)
+    if sent_at:
+        query = query.where(Enrollment.student_id.not_in(select(Message.recipient_id).where(
+            Message.sender_id == sender_id, Message.created_at == created_at, Message.content == content
+        )))
+    student_ids = db.session.execute(query).scalars().all()
+    messages = [Message(sender_id=sender_id, recipient_id=student_id, content=content, created_at=created_at)
+                for student_id in student_ids]
+    db.session.add_all(messages)
+    db.session.flush()
+    for message in messages:
+        Conversation.record_message(message)
+    db.session.commit()
+
+    # Reaches open pages directly with a shared PUBSUB_URL; otherwise they pick it up on their next poll
+    for message in messages:
+        publish(user_channel(message.recipient_id), 'message', message.to_dict())
+        publish(user_channel(message.recipient_id), 'unread',
+                {'count': Message.count_unread_messages(message.recipient_id)})
+    return {'sent': len(messages)}
@@ -0,0 +1,142 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+from flask import current_app
+from flask_login import UserMixin
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from lms.utils.db import db
+from lms.models.token import RevokedToken
+
+TOKEN_SALT = 'api-access-token'
+DEFAULT_TTL = 900
+
+
+class TokenUser(UserMixin):
+    """API caller authenticated by the claims of an access token, without a database lookup
+
+    The id and role come from the token. Any other attribute loads the user
+    row on first use, so handlers that need more than that pay one query.
+    """
+
+    def __init__(self, claims, expires_at):
+        self.id = claims['sub']
+        self.role_name = claims['role']
+        self.token_id = claims['jti']
+        self.expires_at = expires_at
+        self._user = None
+
+    def is_admin(self):
+        return self.role_name == 'admin'
+
+    def is_teacher(self):
+        return self.role_name == 'teacher'
+
+    def is_student(self):
+        return self.role_name == 'student'
+
+    def load(self):
+        """The User row behind the token"""
+        from lms.models.user import User
+
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+class RevocationList:
+    """Ids of revoked tokens that have not expired yet, reloaded from the database every few seconds
+
+    Revoking writes a row, so every process sees it after its next reload;
+    checking a token is a dictionary lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._loaded_at = None
+
+    def is_revoked(self, jti):
+        self._reload_if_stale()
+        return jti in self._revoked
+
+    def revoke(self, jti, expires_at, user_id=None):
+        """Revoke a token until it expires. Does not commit."""
+        now = datetime.utcnow()
+        db.session.query(RevokedToken).filter(RevokedToken.expires_at <= now).delete(synchronize_session=False)
+        if db.session.get(RevokedToken, jti) is None:
+            db.session.add(RevokedToken(jti=jti, user_id=user_id, expires_at=expires_at))
+        self._revoked[jti] = expires_at
+
+    def clear(self):
+        with self._lock:
+            self._revoked = {}
+            self._loaded_at = None
+
+    def _reload_if_stale(self):
+        max_age = current_app.config.get('TOKEN_REVOCATION_REFRESH_SECONDS', 30)
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < max_age:
+            return
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < max_age:
+                return
+            rows = db.session.query(RevokedToken.jti, RevokedToken.expires_at).filter(
+                RevokedToken.expires_at > datetime.utcnow()
+            ).all()
+            self._revoked = dict(rows)
+            self._loaded_at = time.monotonic()
+
+
+revocations = RevocationList()
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def token_ttl():
+    return current_app.config.get('API_TOKEN_TTL', DEFAULT_TTL)
+
+
+def issue_token(user):
+    """Signed access token embedding the user's id and role; returns (token, seconds until it expires)"""
+    claims = {'sub': user.id, 'role': user.role_name, 'jti': uuid.uuid4().hex}
+    return _serializer().dumps(claims), token_ttl()
+
+
+def verify_token(token):
+    """TokenUser for a valid, unexpired and unrevoked token, otherwise None"""
+    try:
+        claims, issued_at = _serializer().loads(token, max_age=token_ttl(), return_timestamp=True)
+    except (SignatureExpired, BadSignature):
+        return None
+    if not isinstance(claims, dict) or revocations.is_revoked(claims.get('jti')):
+        return None
+    expires_at = datetime.utcfromtimestamp(issued_at.timestamp() + token_ttl())
+    return TokenUser(claims, expires_at)
+
+
+def bearer_token(request):
+    """Token of an 'Authorization: Bearer <token>' header, or None"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return token.strip() or None
+
+
+def load_user_from_request(request):
+    """Flask-Login request loader: authenticate API requests by their bearer token"""
+    if request.blueprint != 'api':
+        return None
+    token = bearer_token(request)
+    return verify_token(token) if token else None
+
+
+def revoke_token(user):
+    """Revoke the token a TokenUser was authenticated with. Does not commit."""
+    revocations.revoke(user.token_id, user.expires_at, user_id=user.id)
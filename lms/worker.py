@@ -0,0 +1,32 @@
+"""Background job worker: python -m lms.worker [--once] [--poll-interval SECONDS]
+
+Runs the jobs queued in the app's database (see lms/utils/jobs.py). Start
+one per CPU or more for I/O-bound work; workers coordinate through the
+jobs table, so no broker is needed.
+"""
+import argparse
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run queued background jobs')
+    parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+    parser.add_argument('--stale-after', type=int, default=60,
+                        help='Seconds without a heartbeat after which a running job is queued again')
+    args = parser.parse_args(argv)
+
+    from app import app
+    import lms.utils.tasks  # registers the tasks
+    from lms.utils.jobs import Worker
+
+    worker = Worker(app, poll_interval=args.poll_interval, stale_after=args.stale_after)
+    if args.once:
+        print(f"Ran {worker.run_pending()} jobs")
+    else:
+        worker.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
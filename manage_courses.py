@@ -30,6 +30,12 @@ from lms.models.course import (
     Course, Category, Material, Module, Test, 
     Question, QuestionOption, Assignment, Enrollment
 )
+from lms.models.message import Conversation
+from lms.utils.progress import rebuild_enrollment_progress
+from lms.utils.search import rebuild_search_index
+from lms.utils.enrollment import recount_enrollments
+from lms.utils.deletion import CascadeDelete
+from lms.utils.storage import recount_references, collect_garbage
 
 MOCK_COURSE_TITLES = ["Introduction to Programming", "Web Development Fundamentals"]
 
@@ -37,6 +43,12 @@ MOCK_COURSE_TITLES = ["Introduction to Programming", "Web Development Fundamenta
 # DELETION FUNCTIONS
 #======================================================================
 
+def print_deletion_report(report, indent="  "):
+    """Print the rows deleted per table"""
+    for table, count in report.counts.items():
+        if count:
+            print(f"{indent}- Deleted {count} {table}")
+
 def delete_course(course_id=None, course_title=None, commit=True):
     """Delete a course and all its associated content"""
     with app.app_context():
@@ -52,44 +64,17 @@ def delete_course(course_id=None, course_title=None, commit=True):
             print(f"No course found with {'ID ' + str(course_id) if course_id else 'title ' + course_title}")
             return False
         
-        print(f"Deleting course: {course.title} (ID: {course.id})")
-        
-        # Delete enrollments
-        enrollments = Enrollment.query.filter_by(course_id=course.id).all()
-        for enrollment in enrollments:
-            db.session.delete(enrollment)
-        print(f"  - Deleted {len(enrollments)} enrollments")
-        
-        # Delete assignments
-        assignments = Assignment.query.filter_by(course_id=course.id).all()
-        for assignment in assignments:
-            # Delete submissions for each assignment
-            from lms.models.course import Submission
-            submissions = Submission.query.filter_by(assignment_id=assignment.id).all()
-            for submission in submissions:
-                db.session.delete(submission)
-            db.session.delete(assignment)
-        print(f"  - Deleted {len(assignments)} assignments")
-        
-        # Delete modules and associated content
-        modules = Module.query.filter_by(course_id=course.id).all()
-        module_count = len(modules)
-        
-        for module in modules:
-            delete_module(module.id, commit=False)
-        
-        # Delete any course materials that aren't associated with modules
-        materials = Material.query.filter_by(course_id=course.id, module_id=None).all()
-        for material in materials:
-            db.session.delete(material)
-        print(f"  - Deleted {len(materials)} course-level materials")
+        title = course.title
+        print(f"Deleting course: {title} (ID: {course.id})")
         
-        # Finally, delete the course
-        db.session.delete(course)
+        # One DELETE per table for the course and everything below it
+        report = CascadeDelete().courses([course.id])
+        print_deletion_report(report)
         
         if commit:
             db.session.commit()
-            print(f"Course '{course.title}' and all associated content deleted successfully!")
+            report.remove_files()
+            print(f"Course '{title}' and all associated content deleted successfully!")
         
         return True
 
@@ -101,32 +86,16 @@ def delete_module(module_id, commit=True):
             print(f"No module found with ID {module_id}")
             return False
         
-        print(f"  - Deleting module: {module.title} (ID: {module.id})")
+        title = module.title
+        print(f"  - Deleting module: {title} (ID: {module.id})")
         
-        # Delete materials in this module
-        materials = Material.query.filter_by(module_id=module.id).all()
-        for material in materials:
-            db.session.delete(material)
-        print(f"    - Deleted {len(materials)} materials")
-        
-        # Delete tests and associated content
-        tests = Test.query.filter_by(module_id=module.id).all()
-        for test in tests:
-            delete_test(test.id, commit=False)
-        
-        # Delete module progress records
-        from lms.models.course import ModuleProgress
-        progress_records = ModuleProgress.query.filter_by(module_id=module.id).all()
-        for record in progress_records:
-            db.session.delete(record)
-        print(f"    - Deleted {len(progress_records)} progress records")
-        
-        # Delete the module itself
-        db.session.delete(module)
+        report = CascadeDelete().modules([module.id])
+        print_deletion_report(report, indent="    ")
         
         if commit:
             db.session.commit()
-            print(f"Module '{module.title}' deleted successfully!")
+            report.remove_files()
+            print(f"Module '{title}' deleted successfully!")
         
         return True
 
@@ -138,42 +107,15 @@ def delete_test(test_id, commit=True):
             print(f"No test found with ID {test_id}")
             return False
         
-        print(f"    - Deleting test: {test.title} (ID: {test.id})")
-        
-        # Delete test attempts and answers
-        from lms.models.course import TestAttempt, TestAnswer
-        attempts = TestAttempt.query.filter_by(test_id=test.id).all()
-        for attempt in attempts:
-            # Delete answers for this attempt
-            answers = TestAnswer.query.filter_by(attempt_id=attempt.id).all()
-            for answer in answers:
-                db.session.delete(answer)
-            db.session.delete(attempt)
-        print(f"      - Deleted {len(attempts)} test attempts")
-        
-        # Delete questions and options
-        questions = Question.query.filter_by(test_id=test.id).all()
-        question_count = 0
-        option_count = 0
-        
-        for question in questions:
-            # Delete options for this question
-            options = QuestionOption.query.filter_by(question_id=question.id).all()
-            for option in options:
-                db.session.delete(option)
-            option_count += len(options)
-            
-            db.session.delete(question)
-            question_count += 1
+        title = test.title
+        print(f"    - Deleting test: {title} (ID: {test.id})")
         
-        print(f"      - Deleted {question_count} questions with {option_count} options")
-        
-        # Delete the test itself
-        db.session.delete(test)
+        report = CascadeDelete().tests([test.id])
+        print_deletion_report(report, indent="      ")
         
         if commit:
             db.session.commit()
-            print(f"Test '{test.title}' deleted successfully!")
+            print(f"Test '{title}' deleted successfully!")
         
         return True
 
@@ -1086,6 +1028,76 @@ def list_materials(module_id):
         
         print("-" * 90)
 
+#======================================================================
+# PROGRESS FUNCTIONS
+#======================================================================
+
+def rebuild_progress(course_id=None):
+    """Rebuild the stored enrollment progress for one course or all courses"""
+    with app.app_context():
+        if course_id and not Course.query.get(course_id):
+            print(f"No course found with ID {course_id}")
+            return False
+        
+        rebuilt = rebuild_enrollment_progress(course_id)
+        db.session.commit()
+        
+        target = f"course ID {course_id}" if course_id else "all courses"
+        print(f"Rebuilt progress for {rebuilt} enrollments in {target}")
+        return True
+
+def recount_enrollment_counts(course_id=None):
+    """Recompute the stored enrollment counters for one course or all courses"""
+    with app.app_context():
+        updated = recount_enrollments(course_id)
+        db.session.commit()
+        
+        if course_id and not updated:
+            print(f"No course found with ID {course_id}")
+            return False
+        print(f"Recounted enrollments for {updated} courses")
+        return True
+
+def recount_stored_files():
+    """Recompute the reference counts of stored upload files"""
+    with app.app_context():
+        updated = recount_references()
+        db.session.commit()
+        print(f"Recounted references of {updated} stored files")
+        return True
+
+def collect_stored_garbage(grace_seconds=3600):
+    """Remove stored upload files that have been unreferenced for longer than the grace period"""
+    with app.app_context():
+        removed = collect_garbage(grace_seconds)
+        print(f"Removed {removed} unreferenced files")
+        return True
+
+#======================================================================
+# MESSAGE FUNCTIONS
+#======================================================================
+
+def backfill_conversations():
+    """Rebuild the conversations table from existing messages"""
+    with app.app_context():
+        Conversation.__table__.create(db.engine, checkfirst=True)
+        rebuilt = Conversation.backfill()
+        db.session.commit()
+        print(f"Rebuilt {rebuilt} conversations from existing messages")
+        return True
+
+#======================================================================
+# SEARCH FUNCTIONS
+#======================================================================
+
+def reindex():
+    """Rebuild the full-text search index from all courses, modules and materials"""
+    with app.app_context():
+        indexed = rebuild_search_index()
+        db.session.commit()
+        print(f"Indexed {indexed} courses for search")
+        return True
+
 #======================================================================
 # MAIN FUNCTION
 #======================================================================
@@ -1104,6 +1116,12 @@ def print_help():
     print("  delete-course  - Delete a specific course (requires --id)")
     print("  delete-module  - Delete a specific module (requires --id)")
     print("  delete-test    - Delete a specific test (requires --id)")
+    print("  rebuild-progress - Rebuild stored enrollment progress (optional --id for one course)")
+    print("  recount-enrollments - Recompute stored enrollment counts (optional --id for one course)")
+    print("  backfill-conversations - Rebuild the conversation list from existing messages")
+    print("  reindex   - Rebuild the course search index")
+    print("  recount-files - Recompute the reference counts of stored upload files")
+    print("  collect-garbage - Remove upload files unreferenced for over an hour")
     print("\nOptions:")
     print("  --id <id> - Specify ID for commands that require it")
     print("  --help    - Show this help message")
@@ -1113,13 +1131,18 @@ def print_help():
     print("  python manage_courses.py list")
     print("  python manage_courses.py modules --id 1")
     print("  python manage_courses.py delete-course --id 5")
+    print("  python manage_courses.py rebuild-progress")
+    print("  python manage_courses.py backfill-conversations")
+    print("  python manage_courses.py reindex")
 
 def main():
     """Main function to handle command-line arguments"""
     parser = argparse.ArgumentParser(description='LMS Course Management Script')
     parser.add_argument('command', nargs='?', 
                         choices=['create', 'delete', 'list', 'modules', 'tests', 'materials', 
-                                 'delete-course', 'delete-module', 'delete-test', 'help'],
+                                 'delete-course', 'delete-module', 'delete-test', 'rebuild-progress',
+                                 'recount-enrollments', 'backfill-conversations', 'reindex', 'recount-files',
+                                 'collect-garbage', 'help'],
                         help='Command to execute')
     parser.add_argument('--id', type=int, help='ID to use with the command (course, module, or test ID)')
     
@@ -1173,6 +1196,24 @@ def main():
             print("Error: --id argument is required for 'delete-test' command")
             return
         delete_test(test_id=args.id)
+    
+    elif args.command == 'rebuild-progress':
+        rebuild_progress(course_id=args.id)
+    
+    elif args.command == 'recount-enrollments':
+        recount_enrollment_counts(course_id=args.id)
+    
+    elif args.command == 'backfill-conversations':
+        backfill_conversations()
+    
+    elif args.command == 'reindex':
+        reindex()
+    
+    elif args.command == 'recount-files':
+        recount_stored_files()
+    
+    elif args.command == 'collect-garbage':
+        collect_stored_garbage()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
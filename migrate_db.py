@@ -118,7 +118,42 @@ def upgrade_database():
             FOREIGN KEY (recipient_id) REFERENCES users (id)
         )
         ''')
-        
+
+        # Indexes used by the inbox and unread count queries
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_messages_sender_recipient_created
+        ON messages (sender_id, recipient_id, created_at)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_messages_recipient_read
+        ON messages (recipient_id, read)
+        ''')
+
+        # Create conversations table if it doesn't exist
+        # (fill it with: python manage_courses.py backfill-conversations)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_low_id INTEGER NOT NULL,
+            user_high_id INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_activity_at TIMESTAMP,
+            unread_low INTEGER NOT NULL DEFAULT 0,
+            unread_high INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_low_id, user_high_id),
+            FOREIGN KEY (user_low_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_high_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (last_message_id) REFERENCES messages (id) ON DELETE SET NULL
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_conversations_low_activity
+        ON conversations (user_low_id, last_activity_at)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_conversations_high_activity
+        ON conversations (user_high_id, last_activity_at)
+        ''')
+
         # Create new tables
         print("Creating new tables...")
         
@@ -144,10 +179,19 @@ def upgrade_database():
             passing_score FLOAT DEFAULT 70.0,
             module_id INTEGER NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            answer_key_version INTEGER DEFAULT 0,
             FOREIGN KEY (module_id) REFERENCES modules (id)
         )
         ''')
         
+        # Check if tests table has the answer key version used by the grading cache
+        cursor.execute("PRAGMA table_info(tests)")
+        test_columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'answer_key_version' not in test_columns:
+            print("Adding answer_key_version column to tests table...")
+            cursor.execute("ALTER TABLE tests ADD COLUMN answer_key_version INTEGER DEFAULT 0")
+        
         # Create questions table if it doesn't exist
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS questions (
@@ -238,6 +282,87 @@ def upgrade_database():
         )
         ''')
         
+        # Create enrollment_progress table if it doesn't exist
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS enrollment_progress (
+            student_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            modules_completed INTEGER NOT NULL DEFAULT 0,
+            tests_passed INTEGER NOT NULL DEFAULT 0,
+            assignments_submitted INTEGER NOT NULL DEFAULT 0,
+            assignments_graded INTEGER NOT NULL DEFAULT 0,
+            overall_grade FLOAT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (student_id, course_id),
+            FOREIGN KEY (student_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE CASCADE
+        )
+        ''')
+
+        # Create the full-text search index if it doesn't exist (fill it with manage_courses.py reindex)
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5(
+            title, body, tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''')
+
+        # Create the background job queue table if it doesn't exist
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task VARCHAR(100) NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            priority INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_by VARCHAR(100),
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            result TEXT,
+            created_by_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (created_by_id) REFERENCES users (id) ON DELETE SET NULL
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_jobs_status_priority_run_at ON jobs (status, priority, run_at)
+        ''')
+
+        # Create the table of revoked API tokens if it doesn't exist
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti VARCHAR(32) PRIMARY KEY,
+            user_id INTEGER,
+            expires_at TIMESTAMP NOT NULL,
+            revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_revoked_tokens_expires_at ON revoked_tokens (expires_at)
+        ''')
+
+        # Create the table of content-addressed upload files if it doesn't exist
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stored_files (
+            path VARCHAR(255) PRIMARY KEY,
+            sha256 VARCHAR(64) NOT NULL,
+            size BIGINT NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            released_at TIMESTAMP
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_stored_files_sha256 ON stored_files (sha256)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_stored_files_released_at ON stored_files (released_at)
+        ''')
+
         # Check if we need to add payment-related columns to courses
         cursor.execute("PRAGMA table_info(courses)")
         course_columns = [column[1] for column in cursor.fetchall()]
@@ -258,6 +383,24 @@ def upgrade_database():
             print("Adding payment_verified column to courses table...")
             cursor.execute("ALTER TABLE courses ADD COLUMN payment_verified BOOLEAN DEFAULT 0")
         
+        if 'content_version' not in course_columns:
+            print("Adding content_version column to courses table...")
+            cursor.execute("ALTER TABLE courses ADD COLUMN content_version INTEGER DEFAULT 0")
+        
+        cursor.execute("PRAGMA table_info(modules)")
+        if 'content_version' not in [column[1] for column in cursor.fetchall()]:
+            print("Adding content_version column to modules table...")
+            cursor.execute("ALTER TABLE modules ADD COLUMN content_version INTEGER DEFAULT 0")
+        
+        if 'enrollment_count' not in course_columns:
+            print("Adding enrollment_count column to courses table...")
+            cursor.execute("ALTER TABLE courses ADD COLUMN enrollment_count INTEGER NOT NULL DEFAULT 0")
+            cursor.execute('''
+            UPDATE courses SET enrollment_count = (
+                SELECT COUNT(*) FROM enrollments WHERE enrollments.course_id = courses.id
+            )
+            ''')
+        
         # Check if we need to add payment-related columns to enrollments
         cursor.execute("PRAGMA table_info(enrollments)")
         enrollment_columns = [column[1] for column in cursor.fetchall()]
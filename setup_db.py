@@ -24,6 +24,10 @@ db.init_app(app)
 # Import models
 from lms.models.user import Role, User
 from lms.models.course import Category
+from lms.models.job import Job
+from lms.models.token import RevokedToken
+from lms.models.stored_file import StoredFile
+import lms.utils.search  # creates the full-text search index with the other tables
 
 def setup_database():
     with app.app_context():
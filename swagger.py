@@ -1,16 +1,34 @@
-from flask import Blueprint
-from flask_restx import Api, Resource, fields
-from lms.models.user import User
-from lms.models.course import Course, Module, Material, Assignment, Enrollment, Test, Question
-from lms.models.message import Message
+from datetime import datetime
+from flask import Blueprint, request
+from flask_login import current_user
+from flask_restx import Api, Resource, abort, fields
+from lms.utils.db import db
+from lms.models.user import User, Role
+from lms.models.course import (Course, Module, Material, Assignment, Submission, Enrollment, Test,
+                              Question, QuestionOption, TestAttempt)
+from lms.models.message import Message, Conversation
+from lms.utils.api import (api_login_required, protect_cookie_sessions, output, parse_ids, keyset_page,
+                           visible_courses, can_edit_course, can_read_course, readable_course_ids, course_trees)
+from lms.utils.tokens import TokenUser, issue_token, revoke_token
+from lms.utils.conditional import (conditional, api_caller, add_body_etag, catalog_version, course_version,
+                                   module_version, tree_version)
+from lms.utils.deletion import delete_modules
+from lms.utils.enrollment import CourseFullError
+from lms.utils.pubsub import publish, user_channel
+from lms.utils.replica import route_reads_to_replica
+from lms.utils.tasks import delete_course as delete_course_task
 
 # Create blueprint for Swagger/API docs
 swagger_bp = Blueprint('api', __name__, url_prefix='/api')
+route_reads_to_replica(swagger_bp)
+swagger_bp.before_request(protect_cookie_sessions)
+swagger_bp.after_request(add_body_etag)
 authorizations = {
     'apikey': {
         'type': 'apiKey',
         'in': 'header',
-        'name': 'Authorization'
+        'name': 'Authorization',
+        'description': "Access token from /api/auth/login, sent as 'Bearer <token>'"
     }
 }
 
@@ -20,7 +38,8 @@ api = Api(
     title='LMS API',
     description='API documentation for Learning Management System',
     doc='/docs',
-    authorizations=authorizations
+    authorizations=authorizations,
+    security='apikey'
 )
 
 # Define namespaces
@@ -48,8 +67,17 @@ login_model = api.model('Login', {
     'password': fields.String(required=True, description='Password')
 })
 
+registration_model = api.model('Registration', {
+    'first_name': fields.String(required=True, description='First name'),
+    'last_name': fields.String(required=True, description='Last name'),
+    'email': fields.String(required=True, description='Email address'),
+    'password': fields.String(required=True, description='Password (at least 6 characters)')
+})
+
 token_model = api.model('Token', {
-    'access_token': fields.String(description='JWT Access token'),
+    'access_token': fields.String(description='Signed access token carrying the user id and role'),
+    'token_type': fields.String(description='Always Bearer'),
+    'expires_in': fields.Integer(description='Seconds until the token expires; get a new one from /api/auth/refresh'),
     'user': fields.Nested(user_model)
 })
 
@@ -59,8 +87,11 @@ course_model = api.model('Course', {
     'description': fields.String(required=True, description='Course description'),
     'category_id': fields.Integer(required=True, description='Category ID'),
     'teacher_id': fields.Integer(required=True, description='Teacher ID'),
-    'image_path': fields.String(description='Course image path'),
+    'image_path': fields.String(readonly=True, description='Course image path; set by uploading an image on the site'),
     'is_active': fields.Boolean(description='Is course active and visible to students'),
+    'is_approved': fields.Boolean(readonly=True, description='Has the course been approved by an admin'),
+    'enrollment_price': fields.Integer(description='Enrollment price in KZT'),
+    'enrollment_count': fields.Integer(readonly=True, description='Number of enrolled students'),
     'created_at': fields.DateTime(description='Creation timestamp')
 })
 
@@ -119,7 +150,12 @@ question_model = api.model('Question', {
     'question_text': fields.String(required=True, description='Question text'),
     'question_type': fields.String(required=True, description='Question type (multiple_choice, true_false, essay)'),
     'points': fields.Float(required=True, description='Points value'),
-    'test_id': fields.Integer(required=True, description='Test ID')
+    'test_id': fields.Integer(required=True, description='Test ID'),
+    'options': fields.List(fields.Nested(api.model('QuestionOption', {
+        'id': fields.Integer(readonly=True, description='Option unique identifier'),
+        'option_text': fields.String(description='Option text'),
+        'is_correct': fields.Boolean(description='Whether the option is correct (teachers only)')
+    })), description='Answer options')
 })
 
 message_model = api.model('Message', {
@@ -133,208 +169,544 @@ message_model = api.model('Message', {
 
 conversation_model = api.model('Conversation', {
     'contact_id': fields.Integer(description='Contact user ID'),
-    'contact_name': fields.String(description='Contact name'),
+    'contact_name': fields.String(attribute=lambda conv: f"{conv['contact'].first_name} {conv['contact'].last_name}",
+                                  description='Contact name'),
     'latest_message': fields.Nested(message_model),
     'unread_count': fields.Integer(description='Number of unread messages')
 })
 
+module_tree_model = api.inherit('ModuleTree', module_model, {
+    'materials': fields.List(fields.Nested(material_model)),
+    'tests': fields.List(fields.Nested(test_model))
+})
+
+course_tree_model = api.inherit('CourseTree', course_model, {
+    'modules': fields.List(fields.Nested(module_tree_model)),
+    'materials': fields.List(fields.Nested(material_model), description='Materials outside any module')
+})
+
+attempt_model = api.model('TestAttempt', {
+    'id': fields.Integer(readonly=True, description='Attempt unique identifier'),
+    'test_id': fields.Integer(description='Test ID'),
+    'student_id': fields.Integer(description='Student ID'),
+    'score': fields.Float(description='Score percentage'),
+    'passed': fields.Boolean(description='Whether the attempt passed'),
+    'started_at': fields.DateTime(description='Start timestamp'),
+    'completed_at': fields.DateTime(description='Completion timestamp')
+})
+
+def page_model(model):
+    """Model of one keyset page of items, for the docs"""
+    return api.model(f'{model.name}Page', {
+        'items': fields.List(fields.Nested(model)),
+        'next_after': fields.Integer(description='Pass as ?after= to get the next page; null on the last page')
+    })
+
+fields_param = {'fields': 'Comma separated fields to return, nested as modules{id,title}'}
+page_params = dict(fields_param, after='Key of the last item of the previous page', limit='Page size (max 200)')
+
+def course_validator(id):
+    parts = course_version(id)
+    return parts and parts + (can_read_course(id),)
+
+def module_validator(id):
+    parts = module_version(id)
+    return parts and parts + (can_read_course(parts[0]),)
+
+def tree_validator(id=None):
+    readable = sorted(readable_course_ids([id] if id is not None else parse_ids() or []))
+    return (readable, tree_version(readable))
+
+def get_or_404(model, id):
+    obj = db.session.get(model, id)
+    if obj is None:
+        abort(404, f'{model.__name__} not found')
+    return obj
+
+def course_for_editing(course_id):
+    course = get_or_404(Course, course_id)
+    if not can_edit_course(course):
+        abort(403, 'You do not have permission to manage this course')
+    return course
+
+def course_for_reading(course_id):
+    course = get_or_404(Course, course_id)
+    if not can_read_course(course.id):
+        abort(403, 'You do not have access to this course')
+    return course
+
+def module_for_reading(module_id):
+    module = get_or_404(Module, module_id)
+    course_for_reading(module.course_id)
+    return module
+
 # API Routes
 
+def token_response(user):
+    token, expires_in = issue_token(user)
+    return {'access_token': token, 'token_type': 'Bearer', 'expires_in': expires_in, 'user': user}
+
 @ns_auth.route('/login')
 class Login(Resource):
-    @api.doc('login')
+    @api.doc('login', security=None)
     @api.expect(login_model)
+    @api.response(401, 'Invalid email or password')
+    @api.marshal_with(token_model)
+    def post(self):
+        """Exchange an email and password for an access token"""
+        data = api.payload or {}
+        user = User.query.filter_by(email=(data.get('email') or '').strip()).first()
+        if user is None or not user.is_active or not user.verify_password(data.get('password') or ''):
+            abort(401, 'Invalid email or password')
+        return token_response(user)
+
+@ns_auth.route('/refresh')
+class Refresh(Resource):
+    @api.doc('refresh_token')
+    @api.response(401, 'Token invalid, expired or revoked')
     @api.marshal_with(token_model)
+    @api_login_required
     def post(self):
-        """User login endpoint"""
-        return {'message': 'This endpoint would authenticate a user and return a token'}
+        """Exchange a valid access token for a new one, revoking the old token"""
+        if not isinstance(current_user._get_current_object(), TokenUser):
+            abort(400, 'Send the access token to refresh in the Authorization header')
+        user = current_user.load()
+        if user is None or not user.is_active:
+            abort(401, 'Account is inactive')
+        revoke_token(current_user)
+        db.session.commit()
+        return token_response(user)
+
+@ns_auth.route('/logout')
+class Logout(Resource):
+    @api.doc('logout')
+    @api.response(204, 'Token revoked')
+    @api_login_required
+    def post(self):
+        """Revoke the access token of the request"""
+        if isinstance(current_user._get_current_object(), TokenUser):
+            revoke_token(current_user)
+            db.session.commit()
+        return '', 204
 
 @ns_auth.route('/register')
 class Register(Resource):
-    @api.doc('register')
-    @api.expect(user_model)
+    @api.doc('register', security=None)
+    @api.expect(registration_model)
+    @api.response(409, 'Email already registered')
     @api.marshal_with(user_model, code=201)
     def post(self):
-        """User registration endpoint"""
-        return {'message': 'This endpoint would register a new user'}, 201
+        """Register a new student account"""
+        data = api.payload or {}
+        email = (data.get('email') or '').strip()
+        if not (data.get('first_name') and data.get('last_name') and email and data.get('password')):
+            abort(400, 'first_name, last_name, email and password are required')
+        if len(data['password']) < 6:
+            abort(400, 'password must be at least 6 characters')
+        if User.query.filter_by(email=email).first():
+            abort(409, 'Email already registered')
+        student_role = Role.query.filter_by(name='student').first()
+        if student_role is None:
+            abort(500, 'Registration is not available')
+        user = User(first_name=data['first_name'], last_name=data['last_name'], email=email,
+                    password=data['password'], role_id=student_role.id)
+        db.session.add(user)
+        db.session.commit()
+        return user, 201
 
 @ns_users.route('/')
 class UserList(Resource):
-    @api.doc('list_users')
-    @api.marshal_list_with(user_model)
+    @api.doc('list_users', params=page_params)
+    @api.response(200, 'Success', page_model(user_model))
+    @api_login_required
     def get(self):
-        """List all users"""
-        return {'message': 'This endpoint would return all users'}
+        """List all users (admins only)"""
+        if not current_user.is_admin():
+            abort(403, 'Only admins can list users')
+        return keyset_page(User.query, User.id, user_model)
     
 @ns_users.route('/<int:id>')
 @api.response(404, 'User not found')
 class UserResource(Resource):
-    @api.doc('get_user')
-    @api.marshal_with(user_model)
+    @api.doc('get_user', params=fields_param)
+    @api.response(200, 'Success', user_model)
+    @api_login_required
     def get(self, id):
         """Get a specific user"""
-        return {'message': f'This endpoint would return user with ID {id}'}
+        if id != current_user.id and not current_user.is_admin():
+            abort(403, 'You can only view your own account')
+        return output(get_or_404(User, id), user_model)
 
 @ns_courses.route('/')
 class CourseList(Resource):
-    @api.doc('list_courses')
-    @api.marshal_list_with(course_model)
+    @api.doc('list_courses', params=dict(page_params, ids='Comma separated course ids to fetch in one call'))
+    @api.response(200, 'Success', page_model(course_model))
+    @api_login_required
+    @conditional(lambda: catalog_version(current_user.id), owner=api_caller)
     def get(self):
-        """List all courses"""
-        return {'message': 'This endpoint would return all courses'}
+        """List courses, or fetch several by id with ?ids=1,2,3"""
+        ids = parse_ids()
+        if ids is not None:
+            courses = {course.id: course for course in visible_courses().filter(Course.id.in_(ids))}
+            return output([courses[id] for id in ids if id in courses], course_model)
+        return keyset_page(visible_courses(), Course.id, course_model)
     
     @api.doc('create_course')
     @api.expect(course_model)
-    @api.marshal_with(course_model, code=201)
+    @api.response(201, 'Course created', course_model)
+    @api_login_required
     def post(self):
-        """Create a new course"""
-        return {'message': 'This endpoint would create a new course'}, 201
+        """Create a new course, pending admin approval"""
+        if not current_user.is_teacher() or not current_user.can_create_courses():
+            abort(403, 'Only teachers with a verified certificate can create courses')
+        data = api.payload or {}
+        if not data.get('title'):
+            abort(400, 'title is required')
+        course = Course(
+            title=data['title'],
+            description=data.get('description'),
+            category_id=data.get('category_id'),
+            enrollment_price=data.get('enrollment_price') or 0,
+            teacher_id=current_user.id,
+            is_approved=False
+        )
+        db.session.add(course)
+        db.session.commit()
+        return output(course, course_model), 201
+
+@ns_courses.route('/tree')
+class CourseTreeList(Resource):
+    @api.doc('get_course_trees', params=dict(fields_param, ids='Comma separated course ids'))
+    @api.response(200, 'Success', [course_tree_model])
+    @api_login_required
+    @conditional(tree_validator, owner=api_caller)
+    def get(self):
+        """Get several courses with their modules, materials and tests in one call"""
+        ids = parse_ids() or []
+        readable = readable_course_ids(ids)
+        courses = {course.id: course for course in Course.query.filter(Course.id.in_(readable))} if readable else {}
+        return output(course_trees([courses[id] for id in ids if id in courses]), course_tree_model)
 
 @ns_courses.route('/<int:id>')
 @api.response(404, 'Course not found')
 class CourseResource(Resource):
-    @api.doc('get_course')
-    @api.marshal_with(course_model)
+    @api.doc('get_course', params=fields_param)
+    @api.response(200, 'Success', course_model)
+    @api_login_required
+    @conditional(course_validator, owner=api_caller)
     def get(self, id):
         """Get a specific course"""
-        return {'message': f'This endpoint would return course with ID {id}'}
+        course = visible_courses().filter(Course.id == id).first()
+        if course is None:
+            abort(404, 'Course not found')
+        return output(course, course_model)
     
     @api.doc('update_course')
     @api.expect(course_model)
-    @api.marshal_with(course_model)
+    @api.response(200, 'Success', course_model)
+    @api_login_required
     def put(self, id):
         """Update a course"""
-        return {'message': f'This endpoint would update course with ID {id}'}
+        course = course_for_editing(id)
+        data = api.payload or {}
+        # image_path is not writable: any stored path would make that file readable as a course image
+        for field in ('title', 'description', 'category_id', 'is_active', 'enrollment_price'):
+            if field in data:
+                setattr(course, field, data[field])
+        if not course.title:
+            abort(400, 'title is required')
+        db.session.commit()
+        return output(course, course_model)
     
     @api.doc('delete_course')
-    @api.response(204, 'Course deleted')
+    @api.response(202, 'Course deletion queued')
+    @api_login_required
     def delete(self, id):
-        """Delete a course"""
-        return {'message': f'This endpoint would delete course with ID {id}'}, 204
+        """Delete a course in the background; poll /jobs/<job_id> for the outcome"""
+        course = course_for_editing(id)
+        course.is_active = False
+        job = delete_course_task.delay(course_id=course.id)
+        db.session.commit()
+        return {'job_id': job.id}, 202
+
+@ns_courses.route('/<int:id>/tree')
+@api.response(404, 'Course not found')
+class CourseTree(Resource):
+    @api.doc('get_course_tree', params=fields_param)
+    @api.response(200, 'Success', course_tree_model)
+    @api_login_required
+    @conditional(tree_validator, owner=api_caller)
+    def get(self, id):
+        """Get a course with its modules, materials and tests"""
+        return output(course_trees([course_for_reading(id)])[0], course_tree_model)
 
 @ns_courses.route('/<int:id>/modules')
 class CourseModules(Resource):
-    @api.doc('get_course_modules')
-    @api.marshal_list_with(module_model)
+    @api.doc('get_course_modules', params=fields_param)
+    @api.response(200, 'Success', [module_model])
+    @api_login_required
+    @conditional(course_validator, owner=api_caller)
     def get(self, id):
         """Get all modules for a course"""
-        return {'message': f'This endpoint would return all modules for course with ID {id}'}
+        course = course_for_reading(id)
+        modules = Module.query.filter_by(course_id=course.id).order_by(Module.order, Module.id).all()
+        return output(modules, module_model)
 
 @ns_courses.route('/<int:id>/enrollments')
 class CourseEnrollments(Resource):
     @api.doc('enroll_in_course')
+    @api.response(409, 'Course is full')
+    @api_login_required
     def post(self, id):
-        """Enroll current user in a course"""
-        return {'message': f'This endpoint would enroll user in course with ID {id}'}
+        """Enroll current user in a free course"""
+        if not current_user.is_student():
+            abort(403, 'Only students can enroll in courses')
+        course = get_or_404(Course, id)
+        if not course.is_active or not course.is_approved:
+            abort(400, 'This course is not currently available for enrollment')
+        if course.enrollment_price:
+            abort(400, 'Paid courses need a payment receipt; enroll through the website')
+        if Enrollment.query.filter_by(student_id=current_user.id, course_id=course.id).first():
+            return {'message': 'Already enrolled'}, 200
+        db.session.add(Enrollment(student_id=current_user.id, course_id=course.id, payment_verified=True))
+        try:
+            db.session.commit()
+        except CourseFullError:
+            db.session.rollback()
+            abort(409, 'This course has reached its maximum student capacity')
+        return {'message': 'Enrolled'}, 201
     
     @api.doc('unenroll_from_course')
+    @api.response(204, 'Unenrolled')
+    @api_login_required
     def delete(self, id):
         """Unenroll current user from a course"""
-        return {'message': f'This endpoint would unenroll user from course with ID {id}'}, 204
+        enrollment = Enrollment.query.filter_by(student_id=current_user.id, course_id=id).first()
+        if enrollment is None:
+            abort(404, 'You are not enrolled in this course')
+        db.session.delete(enrollment)
+        db.session.commit()
+        return '', 204
 
 @ns_modules.route('/')
 class ModuleList(Resource):
     @api.doc('create_module')
     @api.expect(module_model)
-    @api.marshal_with(module_model, code=201)
+    @api.response(201, 'Module created', module_model)
+    @api_login_required
     def post(self):
         """Create a new module"""
-        return {'message': 'This endpoint would create a new module'}, 201
+        data = api.payload or {}
+        if not isinstance(data.get('course_id'), int):
+            abort(400, 'course_id is required')
+        course = course_for_editing(data['course_id'])
+        if not data.get('title'):
+            abort(400, 'title is required')
+        module = Module(
+            title=data['title'],
+            description=data.get('description'),
+            order=data.get('order') or 0,
+            course_id=course.id
+        )
+        db.session.add(module)
+        db.session.commit()
+        return output(module, module_model), 201
 
 @ns_modules.route('/<int:id>')
 @api.response(404, 'Module not found')
 class ModuleResource(Resource):
-    @api.doc('get_module')
-    @api.marshal_with(module_model)
+    @api.doc('get_module', params=fields_param)
+    @api.response(200, 'Success', module_model)
+    @api_login_required
+    @conditional(module_validator, owner=api_caller)
     def get(self, id):
         """Get a specific module"""
-        return {'message': f'This endpoint would return module with ID {id}'}
+        return output(module_for_reading(id), module_model)
     
     @api.doc('update_module')
     @api.expect(module_model)
-    @api.marshal_with(module_model)
+    @api.response(200, 'Success', module_model)
+    @api_login_required
     def put(self, id):
         """Update a module"""
-        return {'message': f'This endpoint would update module with ID {id}'}
+        module = get_or_404(Module, id)
+        course_for_editing(module.course_id)
+        data = api.payload or {}
+        for field in ('title', 'description', 'order'):
+            if field in data:
+                setattr(module, field, data[field])
+        if not module.title:
+            abort(400, 'title is required')
+        db.session.commit()
+        return output(module, module_model)
     
     @api.doc('delete_module')
     @api.response(204, 'Module deleted')
+    @api_login_required
     def delete(self, id):
-        """Delete a module"""
-        return {'message': f'This endpoint would delete module with ID {id}'}, 204
+        """Delete a module with its materials and tests"""
+        module = get_or_404(Module, id)
+        course_for_editing(module.course_id)
+        report = delete_modules([module.id])
+        db.session.commit()
+        report.remove_files()
+        return '', 204
 
 @ns_modules.route('/<int:id>/materials')
 class ModuleMaterials(Resource):
-    @api.doc('get_module_materials')
-    @api.marshal_list_with(material_model)
+    @api.doc('get_module_materials', params=fields_param)
+    @api.response(200, 'Success', [material_model])
+    @api_login_required
+    @conditional(module_validator, owner=api_caller)
     def get(self, id):
         """Get all materials for a module"""
-        return {'message': f'This endpoint would return all materials for module with ID {id}'}
+        module = module_for_reading(id)
+        materials = Material.query.filter_by(module_id=module.id).order_by(Material.order, Material.id).all()
+        return output(materials, material_model)
 
 @ns_modules.route('/<int:id>/tests')
 class ModuleTests(Resource):
-    @api.doc('get_module_tests')
-    @api.marshal_list_with(test_model)
+    @api.doc('get_module_tests', params=fields_param)
+    @api.response(200, 'Success', [test_model])
+    @api_login_required
+    @conditional(module_validator, owner=api_caller)
     def get(self, id):
         """Get all tests for a module"""
-        return {'message': f'This endpoint would return all tests for module with ID {id}'}
+        module = module_for_reading(id)
+        return output(Test.query.filter_by(module_id=module.id).order_by(Test.id).all(), test_model)
 
 @ns_assignments.route('/<int:id>/submissions')
 class AssignmentSubmissions(Resource):
-    @api.doc('get_assignment_submissions')
-    @api.marshal_list_with(submission_model)
+    @api.doc('get_assignment_submissions', params=page_params)
+    @api.response(200, 'Success', page_model(submission_model))
+    @api_login_required
     def get(self, id):
-        """Get all submissions for an assignment"""
-        return {'message': f'This endpoint would return all submissions for assignment with ID {id}'}
+        """Get the submissions for an assignment; students only see their own"""
+        assignment = get_or_404(Assignment, id)
+        course = course_for_reading(assignment.course_id)
+        query = Submission.query.filter_by(assignment_id=assignment.id)
+        if not can_edit_course(course):
+            query = query.filter_by(student_id=current_user.id)
+        return keyset_page(query, Submission.id, submission_model)
     
     @api.doc('submit_assignment')
     @api.expect(submission_model)
-    @api.marshal_with(submission_model, code=201)
+    @api.response(201, 'Submitted', submission_model)
+    @api_login_required
     def post(self, id):
-        """Submit an assignment"""
-        return {'message': f'This endpoint would submit an assignment with ID {id}'}, 201
+        """Submit an assignment as text"""
+        assignment = get_or_404(Assignment, id)
+        if not current_user.is_student() or not can_read_course(assignment.course_id):
+            abort(403, 'You must be enrolled in the course to submit this assignment')
+        content = ((api.payload or {}).get('content') or '').strip()
+        if not content:
+            abort(400, 'content is required')
+        if Submission.query.filter_by(assignment_id=assignment.id, student_id=current_user.id).first():
+            abort(409, 'You have already submitted this assignment')
+        submission = Submission(content=content, student_id=current_user.id, assignment_id=assignment.id)
+        db.session.add(submission)
+        db.session.commit()
+        return output(submission, submission_model), 201
 
 @ns_tests.route('/<int:id>/questions')
 class TestQuestions(Resource):
-    @api.doc('get_test_questions')
-    @api.marshal_list_with(question_model)
+    @api.doc('get_test_questions', params=fields_param)
+    @api.response(200, 'Success', [question_model])
+    @api_login_required
     def get(self, id):
-        """Get all questions for a test"""
-        return {'message': f'This endpoint would return all questions for test with ID {id}'}
+        """Get all questions of a test with their options"""
+        test = get_or_404(Test, id)
+        module = module_for_reading(test.module_id)
+        questions = Question.query.filter_by(test_id=test.id).order_by(Question.id).all()
+        options = QuestionOption.query.filter(
+            QuestionOption.question_id.in_([question.id for question in questions])
+        ).order_by(QuestionOption.id).all() if questions else []
+
+        show_answers = can_edit_course(module.course)
+        by_question = {question.id: [] for question in questions}
+        for option in options:
+            by_question[option.question_id].append({
+                'id': option.id,
+                'option_text': option.option_text,
+                'is_correct': option.is_correct if show_answers else None
+            })
+        return output([dict(
+            id=question.id, question_text=question.question_text, question_type=question.question_type,
+            points=question.points, test_id=question.test_id, options=by_question[question.id]
+        ) for question in questions], question_model)
 
 @ns_tests.route('/<int:id>/attempts')
 class TestAttempts(Resource):
     @api.doc('start_test_attempt')
+    @api.response(201, 'Attempt started', attempt_model)
+    @api_login_required
     def post(self, id):
-        """Start a new test attempt"""
-        return {'message': f'This endpoint would start a new attempt for test with ID {id}'}
+        """Start a new test attempt, or return the one in progress"""
+        test = get_or_404(Test, id)
+        module = get_or_404(Module, test.module_id)
+        if not current_user.is_student() or not can_read_course(module.course_id):
+            abort(403, 'You must be enrolled in this course to take tests')
+        attempt = TestAttempt.query.filter_by(test_id=test.id, student_id=current_user.id, completed_at=None).first()
+        if attempt is not None:
+            return output(attempt, attempt_model), 200
+        attempt = TestAttempt(student_id=current_user.id, test_id=test.id, started_at=datetime.utcnow())
+        db.session.add(attempt)
+        db.session.commit()
+        return output(attempt, attempt_model), 201
 
 @ns_messages.route('/')
 class MessageInbox(Resource):
-    @api.doc('get_conversations')
-    @api.marshal_list_with(conversation_model)
+    @api.doc('get_conversations', params=fields_param)
+    @api.response(200, 'Success', [conversation_model])
+    @api_login_required
     def get(self):
         """Get all conversations for the current user"""
-        return {'message': 'This endpoint would return all conversations'}
+        return output(Conversation.for_user(current_user.id), conversation_model)
 
 @ns_messages.route('/<int:user_id>')
 class MessageConversation(Resource):
-    @api.doc('get_conversation')
-    @api.marshal_list_with(message_model)
+    @api.doc('get_conversation', params=dict(
+        fields_param, before_id='Page backwards from this message', after_id='Messages sent after this one',
+        limit='Page size (max 100)'
+    ))
+    @api.response(200, 'Success')
+    @api_login_required
     def get(self, user_id):
-        """Get conversation with a specific user"""
-        return {'message': f'This endpoint would return conversation with user {user_id}'}
+        """Get one page of the conversation with a specific user, oldest message first"""
+        get_or_404(User, user_id)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 100)
+        messages, has_more = Message.get_conversation_page(
+            current_user.id, user_id,
+            before_id=request.args.get('before_id', type=int),
+            after_id=request.args.get('after_id', type=int),
+            limit=limit
+        )
+        return {'items': output(messages, message_model), 'has_more': has_more}
     
     @api.doc('send_message')
     @api.expect(message_model)
-    @api.marshal_with(message_model, code=201)
+    @api.response(201, 'Sent', message_model)
+    @api_login_required
     def post(self, user_id):
         """Send a message to another user"""
-        return {'message': f'This endpoint would send a message to user {user_id}'}, 201
+        get_or_404(User, user_id)
+        content = ((api.payload or {}).get('content') or '').strip()
+        if not content:
+            abort(400, 'Message cannot be empty')
+        message = Message(sender_id=current_user.id, recipient_id=user_id, content=content)
+        db.session.add(message)
+        db.session.flush()
+        Conversation.record_message(message)
+        db.session.commit()
+
+        publish(user_channel(user_id), 'message', message.to_dict())
+        publish(user_channel(user_id), 'unread', {'count': Message.count_unread_messages(user_id)})
+        return output(message, message_model), 201
 
 @ns_messages.route('/unread/count')
 class UnreadMessageCount(Resource):
     @api.doc('unread_count')
+    @api_login_required
     def get(self):
         """Get the count of unread messages"""
-        return {'count': 0}
\ No newline at end of file
+        return {'count': Message.count_unread_messages(current_user.id)}
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import unittest
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.models.user import User, Role
+from lms.models.course import Course, Module, Material, Test, Enrollment
+from test_student_progress import count_queries
+import os
+
+class ApiTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        self.teacher = User(first_name='Api', last_name='Teacher', email='api_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        self.student = User(first_name='Api', last_name='Student', email='api_student@example.com',
+                            password='studentpass', role_id=student_role.id)
+        db.session.add_all([self.teacher, self.student])
+        db.session.flush()
+
+        self.course_ids = []
+        for c in range(3):
+            course = Course(title=f'Course {c}', teacher_id=self.teacher.id, is_approved=True)
+            db.session.add(course)
+            db.session.flush()
+            db.session.add(Enrollment(student_id=self.student.id, course_id=course.id, payment_verified=True))
+            for m in range(3):
+                module = Module(title=f'Module {c}.{m}', order=m, course_id=course.id)
+                db.session.add(module)
+                db.session.flush()
+                db.session.add(Material(title=f'Material {c}.{m}', content_type='text', content='Read me',
+                                        course_id=course.id, module_id=module.id))
+                db.session.add(Test(title=f'Test {c}.{m}', module_id=module.id))
+            self.course_ids.append(course.id)
+        db.session.commit()
+
+        self.client.post('/login', data={'email': 'api_student@example.com', 'password': 'studentpass'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def test_batch_courses_and_field_selection(self):
+        """Test ?ids= returns the requested courses in order and ?fields= trims them"""
+        ids = f'{self.course_ids[2]},{self.course_ids[0]}'
+        response = self.client.get(f'/api/courses/?ids={ids}&fields=id,title')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, [
+            {'id': self.course_ids[2], 'title': 'Course 2'},
+            {'id': self.course_ids[0], 'title': 'Course 0'}
+        ])
+
+        first = self.client.get('/api/courses/?limit=2&fields=id').json
+        self.assertEqual([course['id'] for course in first['items']], self.course_ids[:2])
+        rest = self.client.get(f"/api/courses/?limit=2&fields=id&after={first['next_after']}").json
+        self.assertEqual(rest, {'items': [{'id': self.course_ids[2]}], 'next_after': None})
+
+    def test_course_tree_query_count_does_not_grow_with_courses(self):
+        """Test the tree endpoint loads every course, module, material and test in a fixed number of queries"""
+        with count_queries() as one:
+            response = self.client.get(f'/api/courses/{self.course_ids[0]}/tree')
+        tree = response.json
+        self.assertEqual([module['title'] for module in tree['modules']], ['Module 0.0', 'Module 0.1', 'Module 0.2'])
+        self.assertEqual(tree['modules'][1]['materials'][0]['title'], 'Material 0.1')
+        self.assertEqual(tree['modules'][2]['tests'][0]['title'], 'Test 0.2')
+
+        ids = ','.join(str(id) for id in self.course_ids)
+        with count_queries() as three:
+            response = self.client.get(f'/api/courses/tree?ids={ids}&fields=id,modules{{title,tests{{title}}}}')
+        self.assertEqual(len(response.json), 3)
+        self.assertEqual(response.json[2]['modules'][0], {'title': 'Module 2.0', 'tests': [{'title': 'Test 2.0'}]})
+        self.assertLessEqual(len(three), len(one))
+
+    def test_unpaid_enrollments_do_not_open_course_content(self):
+        """Test a student whose payment is not verified cannot read the course tree or its modules"""
+        course_id = self.course_ids[1]
+        Enrollment.query.filter_by(course_id=course_id).update({'payment_verified': False})
+        db.session.commit()
+        module_id = Module.query.filter_by(course_id=course_id).first().id
+
+        self.assertEqual(self.client.get(f'/api/courses/{course_id}/tree').status_code, 403)
+        self.assertEqual(self.client.get(f'/api/modules/{module_id}').status_code, 403)
+        ids = ','.join(str(id) for id in self.course_ids)
+        response = self.client.get(f'/api/courses/tree?ids={ids}&fields=id')
+        self.assertEqual(response.json, [{'id': self.course_ids[0]}, {'id': self.course_ids[2]}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -139,6 +139,22 @@ class AuthenticationTests(TestCase):
         response = self.client.get('/logout', follow_redirects=True)
         self.assert200(response)
         self.assertIn(b'You have been logged out', response.data)
+    
+    def test_load_user_and_role_checks_use_one_query(self):
+        """Test the user loader joins the role and role checks are served from the role cache"""
+        from app import load_user
+        from test_student_progress import count_queries
+        admin = User.query.filter_by(email='test_admin@example.com').first()
+        user_id = admin.id
+        Role.name_for(admin.role_id)  # warm the role cache
+        db.session.expunge_all()
+        
+        with count_queries() as statements:
+            user = load_user(str(user_id))
+            self.assertTrue(user.is_admin())
+            self.assertFalse(user.is_teacher() or user.is_student())
+            self.assertEqual(user.role.name, 'admin')
+        self.assertEqual(len(statements), 1)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
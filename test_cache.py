@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import unittest
+import tempfile
+import time
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.cache import MemoryCache, SQLiteCache, get_cache, memoize
+from lms.utils.catalog import CourseCatalog
+from lms.models.user import User, Role
+from lms.models.course import Course, Module, Material, Enrollment
+from test_student_progress import count_queries
+import os
+
+calls = []
+
+@memoize(ttl=60, tags=['user:{user_id}'])
+def profile_name(user_id):
+    calls.append(user_id)
+    return f'user {user_id}'
+
+class CacheTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        get_cache().clear()
+        calls.clear()
+        teacher_role = Role(name='teacher', description='Teacher')
+        db.session.add(teacher_role)
+        db.session.flush()
+        self.teacher = User(first_name='Cache', last_name='Teacher', email='cache_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        db.session.add(self.teacher)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def test_memory_cache_evicts_expires_and_invalidates_tags(self):
+        """Test the in-process backend is an LRU with TTL and tag invalidation"""
+        cache = MemoryCache(max_size=2)
+        cache.set('a', 1, tags=['course:1'])
+        cache.set('b', 2, tags=['course:2'])
+        cache.get('a')
+        cache.set('c', 3, tags=['course:1'])
+        self.assertIsNone(cache.get('b'))
+
+        cache.invalidate(['course:1'])
+        self.assertEqual((cache.get('a'), cache.get('c')), (None, None))
+
+        cache.set('d', 4, ttl=0.01)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('d', 'gone'), 'gone')
+
+    def test_sqlite_cache_is_shared_between_instances(self):
+        """Test the shared backend stores values and drops them by tag for every worker"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            writer, reader = SQLiteCache(path), SQLiteCache(path)
+            writer.set('stats', {'courses': 3}, tags=['catalog'])
+            self.assertEqual(reader.get('stats'), {'courses': 3})
+
+            reader.invalidate(['catalog'])
+            self.assertIsNone(writer.get('stats'))
+
+    def test_memoize_is_invalidated_on_commit(self):
+        """Test memoized values carry their tags and are dropped when tagged rows are committed"""
+        self.assertEqual(profile_name(self.teacher.id), f'user {self.teacher.id}')
+        profile_name(self.teacher.id)
+        self.assertEqual(len(calls), 1)
+
+        self.teacher.about_me = 'Changed'
+        db.session.commit()
+        profile_name(self.teacher.id)
+        self.assertEqual(len(calls), 2)
+
+    def test_catalog_pages_are_cached_until_courses_change(self):
+        """Test a cached catalog page only loads its courses and sees new courses after commit"""
+        db.session.add(Course(title='Cached Course', teacher_id=self.teacher.id, is_approved=True))
+        db.session.commit()
+        self.assertEqual(CourseCatalog().page(1).total, 1)
+
+        with count_queries() as statements:
+            results = CourseCatalog().page(1)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([course.title for course in results.courses], ['Cached Course'])
+
+        db.session.add(Course(title='Another Course', teacher_id=self.teacher.id, is_approved=True))
+        db.session.commit()
+        self.assertEqual(CourseCatalog().page(1).total, 2)
+
+    def test_course_fragments_follow_content_version(self):
+        """Test course and module fragments are reused until their content version is bumped"""
+        student_role = Role(name='student', description='Student')
+        db.session.add(student_role)
+        db.session.flush()
+        student = User(first_name='Cache', last_name='Student', email='cache_student@example.com',
+                       password='studentpass', role_id=student_role.id)
+        course = Course(title='Fragment Course', description='Cached description', teacher_id=self.teacher.id,
+                        is_approved=True)
+        db.session.add_all([student, course])
+        db.session.flush()
+        module = Module(title='Fragment Module', course_id=course.id)
+        db.session.add_all([module, Enrollment(student_id=student.id, course_id=course.id)])
+        db.session.flush()
+        db.session.add(Material(title='First Reading', content_type='text', content='One',
+                                course_id=course.id, module_id=module.id))
+        db.session.commit()
+        course_id, module_id = course.id, module.id
+        version = course.content_version
+        self.client.post('/login', data={'email': 'cache_student@example.com', 'password': 'studentpass'})
+
+        self.assertIn(b'First Reading', self.client.get(f'/student/courses/{course_id}').data)
+        self.assertIn(b'First Reading', self.client.get(f'/student/modules/{module_id}').data)
+        with count_queries() as statements:
+            response = self.client.get(f'/student/courses/{course_id}')
+            self.client.get(f'/student/modules/{module_id}')
+        self.assertIn(b'Cached description', response.data)
+        self.assertFalse([s for s in statements if s.startswith('SELECT materials')])
+
+        db.session.add(Material(title='Second Reading', content_type='text', content='Two',
+                                course_id=course_id, module_id=module_id))
+        db.session.commit()
+        self.assertGreater(db.session.get(Course, course_id).content_version, version)
+        self.assertIn(b'Second Reading', self.client.get(f'/student/courses/{course_id}').data)
+        self.assertIn(b'Second Reading', self.client.get(f'/student/modules/{module_id}').data)
+
+        # The teacher's name is rendered in the cached course details
+        db.session.get(User, self.teacher.id).last_name = 'Renamed'
+        db.session.commit()
+        self.assertIn(b'Cache Renamed', self.client.get(f'/student/courses/{course_id}').data)
+
+if __name__ == '__main__':
+    unittest.main()
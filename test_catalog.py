@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import datetime, timedelta
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.catalog import CourseCatalog
+from lms.utils.search import rebuild_search_index
+from lms.models.user import User, Role
+from lms.models.course import Course, Category, Enrollment, Module, Material
+from test_student_progress import count_queries
+import os
+
+class CatalogTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        self.student_role = Role.query.filter_by(name='student').first()
+        self.teacher = User(first_name='Catalog', last_name='Teacher', email='catalog_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        self.student = User(first_name='Catalog', last_name='Student', email='catalog_student@example.com',
+                            password='studentpass', role_id=self.student_role.id)
+        self.science = Category(name='Science')
+        self.art = Category(name='Art')
+        db.session.add_all([self.teacher, self.student, self.science, self.art])
+        db.session.commit()
+        self.course_count = 0
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def add_courses(self, count, category, enrollments_per_course=0):
+        """Create approved courses, each with a number of enrolled students"""
+        start = datetime.utcnow()
+        courses = []
+        for i in range(count):
+            n = self.course_count + i
+            course = Course(title=f'Course {n:03d}', description='About', teacher_id=self.teacher.id,
+                            category_id=category.id, is_approved=True, created_at=start + timedelta(minutes=n))
+            db.session.add(course)
+            db.session.flush()
+            for j in range(enrollments_per_course):
+                student = User(first_name='Enrolled', last_name=str(j), email=f'enrolled{n}_{j}@example.com',
+                               password='studentpass', role_id=self.student_role.id)
+                db.session.add(student)
+                db.session.flush()
+                db.session.add(Enrollment(student_id=student.id, course_id=course.id, payment_verified=True))
+            courses.append(course)
+        self.course_count += count
+        db.session.commit()
+        return courses
+
+    def test_sorting_facets_and_pagination(self):
+        """Test popularity sorting, category facets and page totals come from SQL"""
+        self.add_courses(3, self.science)
+        popular = self.add_courses(1, self.art, enrollments_per_course=2)[0]
+
+        results = CourseCatalog(sort_by='popular', per_page=2).page(1)
+        self.assertEqual(results.courses[0].id, popular.id)
+        self.assertEqual(results.enrollment_counts[popular.id], 2)
+        self.assertEqual((results.total, results.pages, results.has_next), (4, 2, True))
+
+        # Pages are walked with keyset cursors in both directions, for every sort order
+        for sort_by in ('popular', 'newest', 'title'):
+            catalog = CourseCatalog(sort_by=sort_by, per_page=3)
+            first = catalog.page()
+            second = catalog.page(2, after=first.next_after)
+            self.assertEqual((len(second.courses), second.has_prev, second.has_next), (1, True, False))
+            self.assertEqual(len({c.id for c in first.courses + second.courses}), 4, sort_by)
+            back = catalog.page(1, before=second.prev_before)
+            self.assertEqual([c.id for c in back.courses], [c.id for c in first.courses], sort_by)
+            self.assertEqual((back.page, back.has_prev, back.has_next), (1, False, True))
+
+        newest = CourseCatalog(sort_by='newest', category_id=self.science.id).page(1)
+        self.assertEqual([c.title for c in newest.courses], ['Course 002', 'Course 001', 'Course 000'])
+
+        facets = CourseCatalog(category_id=self.science.id).category_facets()
+        self.assertEqual([(category.name, count) for category, count in facets], [('Art', 1), ('Science', 3)])
+
+    def test_search_is_ranked_and_kept_current(self):
+        """Test search matches prefixes in modules and materials, ranks titles first and follows edits"""
+        titled, described, other = self.add_courses(3, self.science)
+        titled.title = 'Photosynthesis Basics'
+        module = Module(title='Plants', description='How photosynthesis works', course_id=described.id)
+        db.session.add(module)
+        db.session.flush()
+        material = Material(title='Reading', content_type='text', content='Chlorophyll and light',
+                            course_id=other.id, module_id=module.id)
+        db.session.add(material)
+        db.session.commit()
+
+        results = CourseCatalog(search='photosynth').page(1)
+        self.assertEqual([c.id for c in results.courses], [titled.id, described.id])
+        ranked = CourseCatalog(search='photosynth', per_page=1)
+        second = ranked.page(2, after=ranked.page().next_after)
+        self.assertEqual(([c.id for c in second.courses], second.has_next), ([described.id], False))
+        self.assertEqual(CourseCatalog(search='chloro').page(1).total, 1)
+
+        material.content = 'Mitochondria'
+        db.session.commit()
+        self.assertEqual(CourseCatalog(search='chloro').page(1).total, 0)
+
+        db.session.delete(material)
+        db.session.commit()
+        self.assertEqual(rebuild_search_index(), 3)
+        db.session.commit()
+        self.assertEqual(CourseCatalog(search='mitochondria').page(1).total, 0)
+        self.assertEqual(CourseCatalog(search='photosynthesis basics').page(1).total, 1)
+        self.assertEqual(CourseCatalog(search='!!!').page(1).total, 0)
+
+    def test_browse_courses_query_count_is_constant(self):
+        """Test the catalog page does not issue queries per course or per category"""
+        self.client.post('/login', data={
+            'email': 'catalog_student@example.com',
+            'password': 'studentpass'
+        })
+        self.add_courses(1, self.science, enrollments_per_course=1)
+        with count_queries() as small:
+            response = self.client.get('/student/courses')
+        self.assert200(response)
+
+        self.add_courses(10, self.art, enrollments_per_course=2)
+        with count_queries() as large:
+            response = self.client.get('/student/courses')
+        self.assert200(response)
+        self.assertIn(b'Found 11 courses', response.data)
+
+        self.assertEqual(len(small), len(large))
+
+if __name__ == '__main__':
+    unittest.main()
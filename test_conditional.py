@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import unittest
+import warnings
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.models.user import User, Role
+from lms.models.course import Course, Module, Material, Enrollment
+from test_student_progress import count_queries
+import os
+
+class ConditionalGetTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        teacher = User(first_name='Etag', last_name='Teacher', email='etag_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        student = User(first_name='Etag', last_name='Student', email='etag_student@example.com',
+                       password='studentpass', role_id=student_role.id)
+        db.session.add_all([teacher, student])
+        db.session.flush()
+        course = Course(title='Etag Course', description='About', teacher_id=teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.flush()
+        module = Module(title='Etag Module', description='About', course_id=course.id)
+        db.session.add(module)
+        db.session.add(Enrollment(student_id=student.id, course_id=course.id, payment_verified=True))
+        db.session.commit()
+        self.course_id, self.module_id = course.id, module.id
+
+        self.client.post('/login', data={'email': 'etag_student@example.com', 'password': 'studentpass'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        with count_queries() as statements:
+            second = self.client.get(url, headers={'If-None-Match': etag})
+        return etag, second, statements
+
+    def test_unchanged_pages_answer_304_until_content_changes(self):
+        """Test course, module and catalog pages revalidate with one query and change with their content"""
+        for url in (f'/student/courses/{self.course_id}', f'/student/modules/{self.module_id}', '/student/courses'):
+            etag, response, statements = self.revalidate(url)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(len(statements), 1, url)
+
+        etag, _, _ = self.revalidate(f'/student/modules/{self.module_id}')
+        db.session.add(Material(title='New', content_type='text', content='New', course_id=self.course_id,
+                                module_id=self.module_id))
+        db.session.commit()
+        response = self.client.get(f'/student/modules/{self.module_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # Renaming the user changes the name shown on every page
+        etag, _, _ = self.revalidate('/student/courses')
+        self.client.post('/profile', data={'first_name': 'Renamed', 'last_name': 'Student',
+                                           'email': 'etag_student@example.com', 'about_me': ''})
+        response = self.client.get('/student/courses', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Renamed', response.data)
+
+    def test_api_resources_revalidate(self):
+        """Test the course tree and other API resources answer 304 when unchanged"""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')  # e.g. a cartesian product in the validator query
+            _, response, statements = self.revalidate(f'/api/courses/{self.course_id}/tree')
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(statements), 2)
+
+        _, response, _ = self.revalidate('/api/messages/unread/count')
+        self.assertEqual(response.status_code, 304)
+
+if __name__ == '__main__':
+    unittest.main()
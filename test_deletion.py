@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import unittest
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.deletion import delete_courses, delete_tests
+from lms.models.user import User, Role
+from lms.models.course import (Course, Module, Material, Assignment, Submission, Test, Question,
+                               QuestionOption, TestAttempt, TestAnswer, ModuleProgress, Enrollment)
+from test_student_progress import count_queries
+import os
+import shutil
+import tempfile
+
+class CascadeDeleteTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        self.static_folder = tempfile.mkdtemp()
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = os.path.join(self.static_folder, 'uploads')
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        self.teacher = User(first_name='Cascade', last_name='Teacher', email='cascade_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        self.student = User(first_name='Cascade', last_name='Student', email='cascade_student@example.com',
+                            password='studentpass', role_id=student_role.id)
+        db.session.add_all([self.teacher, self.student])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+        app.config['UPLOAD_FOLDER'] = self.upload_folder
+        shutil.rmtree(self.static_folder)
+
+    def upload(self, name):
+        path = f'uploads/{name}'
+        with open(os.path.join(self.static_folder, path), 'w') as f:
+            f.write(name)
+        return path
+
+    def create_course(self, title, modules=2, questions=3):
+        course = Course(title=title, teacher_id=self.teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.flush()
+        db.session.add(Enrollment(student_id=self.student.id, course_id=course.id))
+        assignment = Assignment(title='Essay', description='Write', course_id=course.id)
+        db.session.add(assignment)
+        db.session.flush()
+        db.session.add(Submission(student_id=self.student.id, assignment_id=assignment.id,
+                                  file_path=self.upload(f'{course.id}-essay.txt')))
+        for m in range(modules):
+            module = Module(title=f'Module {m}', course_id=course.id, order=m)
+            db.session.add(module)
+            db.session.flush()
+            db.session.add(Material(title='Notes', content_type='file', course_id=course.id, module_id=module.id,
+                                    file_path=self.upload(f'{module.id}-notes.pdf')))
+            db.session.add(ModuleProgress(student_id=self.student.id, module_id=module.id))
+            test = Test(title=f'Quiz {m}', module_id=module.id)
+            db.session.add(test)
+            db.session.flush()
+            attempt = TestAttempt(student_id=self.student.id, test_id=test.id)
+            db.session.add(attempt)
+            for q in range(questions):
+                question = Question(question_text=f'Question {q}', question_type='multiple_choice', test_id=test.id)
+                db.session.add(question)
+                db.session.flush()
+                db.session.add_all([QuestionOption(option_text='Yes', is_correct=True, question_id=question.id),
+                                    QuestionOption(option_text='No', question_id=question.id)])
+                db.session.flush()
+                db.session.add(TestAnswer(attempt_id=attempt.id, question_id=question.id))
+        db.session.commit()
+        return course
+
+    def test_course_is_deleted_table_by_table(self):
+        """Test deleting a course removes everything below it with a fixed number of statements"""
+        small = self.create_course('Small', modules=1, questions=1)
+        large = self.create_course('Large', modules=3, questions=4)
+        keeper = self.create_course('Keeper', modules=1, questions=1)
+        shared = Material.query.filter_by(course_id=keeper.id).first().file_path
+        db.session.add(Material(title='Shared', content_type='file', course_id=large.id, file_path=shared))
+        db.session.commit()
+        small_id, large_id = small.id, large.id
+
+        with count_queries() as small_statements:
+            delete_courses([small_id])
+        db.session.commit()
+        with count_queries() as statements:
+            report = delete_courses([large_id])
+        db.session.commit()
+
+        self.assertEqual(len(statements), len(small_statements))
+        self.assertEqual(report.counts['courses'], 1)
+        self.assertEqual(report.counts['modules'], 3)
+        self.assertEqual(report.counts['question_options'], 24)
+        self.assertEqual(report.counts['test_answers'], 12)
+        self.assertEqual(report.counts['materials'], 4)
+        self.assertIsNone(db.session.get(Course, large_id))
+        self.assertEqual(Question.query.count(), 1)
+        self.assertEqual(Submission.query.count(), 1)
+        self.assertEqual(Enrollment.query.count(), 1)
+
+        self.assertNotIn(shared, report.files)
+        self.assertEqual(len(report.files), 4)
+        self.assertEqual(report.remove_files(), 4)
+        self.assertTrue(os.path.exists(os.path.join(self.static_folder, shared)))
+        self.assertNotIn(f'{large_id}-essay.txt', os.listdir(app.config['UPLOAD_FOLDER']))
+
+    def test_test_deletion_keeps_module(self):
+        """Test deleting a test leaves its module and the module's materials in place"""
+        course = self.create_course('Quizzes', modules=1, questions=2)
+        test = Test.query.join(Module).filter(Module.course_id == course.id).first()
+
+        report = delete_tests([test.id])
+        db.session.commit()
+
+        self.assertEqual(report.counts['questions'], 2)
+        self.assertEqual(report.counts['test_attempts'], 1)
+        self.assertEqual(TestAnswer.query.count(), 0)
+        self.assertEqual(Module.query.filter_by(course_id=course.id).count(), 1)
+        self.assertEqual(Material.query.filter_by(course_id=course.id).count(), 1)
+        self.assertEqual(report.files, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+from sqlalchemy import create_engine, text
+from flask import Flask
+from lms.utils import engine as engine_config
+from lms.utils.engine import configure_engine, engine_options, pool_size_for, get_profile
+
+class EngineProfileTests(unittest.TestCase):
+    def setUp(self):
+        self.pragmas = dict(engine_config._sqlite_pragmas)
+
+    def tearDown(self):
+        engine_config._sqlite_pragmas.clear()
+        engine_config._sqlite_pragmas.update(self.pragmas)
+
+    def test_postgres_pool_follows_gunicorn_threads(self):
+        """Test the production profile sizes the pool per thread and sets Postgres timeouts"""
+        self.assertEqual(pool_size_for(threads=8, workers=4, max_connections=40), (8, 2))
+        self.assertEqual(pool_size_for(threads=8), (8, 8))
+
+        options = engine_options('postgresql://lms@db/lms', get_profile('prod')[1])
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['pool_recycle'], 1800)
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=30000'})
+        self.assertEqual(engine_options('sqlite:///lms.db', get_profile('prod')[1]), {})
+
+    def test_sqlite_connections_use_wal(self):
+        """Test new SQLite connections get WAL journaling, NORMAL sync and a busy timeout"""
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.assertEqual(configure_engine(app, 'production'), 'production')
+        self.assertFalse(app.config['SQLALCHEMY_ECHO'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'wal.db')}")
+            with engine.connect() as conn:
+                self.assertEqual(conn.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+                self.assertEqual(conn.execute(text('PRAGMA synchronous')).scalar(), 1)
+                self.assertEqual(conn.execute(text('PRAGMA busy_timeout')).scalar(), 15000)
+            engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import unittest
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.enrollment import CourseFullError, recount_enrollments
+from lms.models.user import User, Role
+from lms.models.course import Course, Enrollment, TeacherSubscriptionPlan
+from test_student_progress import count_queries
+import os
+
+class EnrollmentCounterTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        teacher = User(first_name='Seat', last_name='Teacher', email='seat_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        self.students = [User(first_name='Seat', last_name=str(i), email=f'seat_student{i}@example.com',
+                              password='studentpass', role_id=student_role.id) for i in range(3)]
+        plan = TeacherSubscriptionPlan(name='Tiny', max_students=2, price_per_month=0)
+        db.session.add_all([teacher, plan] + self.students)
+        db.session.flush()
+        self.course = Course(title='Small Course', teacher_id=teacher.id, is_approved=True,
+                             subscription_plan_id=plan.id)
+        db.session.add(self.course)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def enroll(self, student):
+        enrollment = Enrollment(student_id=student.id, course_id=self.course.id)
+        db.session.add(enrollment)
+        db.session.commit()
+        return enrollment
+
+    def test_counter_follows_enrollments(self):
+        """Test the stored counter changes on enroll and unenroll and is read without a COUNT"""
+        first = self.enroll(self.students[0])
+        self.enroll(self.students[1])
+        self.assertEqual(self.course.enrollment_count, 2)
+
+        db.session.delete(first)
+        db.session.commit()
+        course = db.session.get(Course, self.course.id)
+        with count_queries() as statements:
+            self.assertEqual(course.enrollment_count, 1)
+            self.assertFalse(course.is_at_capacity)
+        self.assertEqual(statements, [])
+
+        db.session.execute(Course.__table__.update().values(enrollment_count=7))
+        self.assertEqual(recount_enrollments(), 1)
+        db.session.commit()
+        self.assertEqual(db.session.get(Course, self.course.id).enrollment_count, 1)
+
+    def test_enrollment_over_capacity_is_refused(self):
+        """Test the flush that would take a seat beyond the plan's limit fails and rolls back"""
+        self.enroll(self.students[0])
+        self.enroll(self.students[1])
+        self.assertTrue(self.course.is_at_capacity)
+
+        with self.assertRaises(CourseFullError):
+            self.enroll(self.students[2])
+        db.session.rollback()
+        self.assertEqual(Enrollment.query.filter_by(course_id=self.course.id).count(), 2)
+        self.assertEqual(self.course.enrollment_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
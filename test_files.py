@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import unittest
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.models.user import User, Role
+from lms.models.course import Course, Material, Enrollment
+import os
+import shutil
+import tempfile
+
+CONTENT_HASH = 'ab' * 32
+
+class FileServingTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], 'lecture.pdf'), 'wb') as f:
+            f.write(b'0123456789' * 100)
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], f'{CONTENT_HASH}.mp4'), 'wb') as f:
+            f.write(b'video')
+
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        teacher = User(first_name='File', last_name='Teacher', email='file_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        enrolled = User(first_name='File', last_name='Enrolled', email='file_enrolled@example.com',
+                        password='studentpass', role_id=student_role.id)
+        outsider = User(first_name='File', last_name='Outsider', email='file_outsider@example.com',
+                        password='studentpass', role_id=student_role.id)
+        db.session.add_all([teacher, enrolled, outsider])
+        db.session.flush()
+        course = Course(title='File Course', teacher_id=teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.flush()
+        db.session.add(Enrollment(student_id=enrolled.id, course_id=course.id, payment_verified=True))
+        for path in ('uploads/lecture.pdf', f'uploads/{CONTENT_HASH}.mp4'):
+            db.session.add(Material(title=path, content_type='file', file_path=path, course_id=course.id))
+        db.session.commit()
+
+    def tearDown(self):
+        app.config['UPLOAD_ACCEL_REDIRECT'] = None
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+        shutil.rmtree(app.config['UPLOAD_FOLDER'])
+        app.config['UPLOAD_FOLDER'] = self.upload_folder
+
+    def login(self, email):
+        self.client.get('/logout')
+        self.client.post('/login', data={'email': email, 'password': 'studentpass'})
+
+    def test_enrolled_students_get_ranges_and_others_get_404(self):
+        """Test material files are served with Range support only to users who may see them"""
+        self.login('file_enrolled@example.com')
+        response = self.client.get('/courses/uploads/lecture.pdf', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'0123456789')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 10-19/1000')
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        response.close()
+
+        hashed = self.client.get(f'/courses/uploads/{CONTENT_HASH}.mp4')
+        self.assertEqual(hashed.headers['ETag'], f'"{CONTENT_HASH}"')
+        self.assertIn('immutable', hashed.headers['Cache-Control'])
+        hashed.close()
+        again = self.client.get(f'/courses/uploads/{CONTENT_HASH}.mp4', headers={'If-None-Match': f'"{CONTENT_HASH}"'})
+        self.assertEqual(again.status_code, 304)
+
+        self.assertEqual(self.client.get('/static/uploads/lecture.pdf').status_code, 404)
+        self.assertEqual(self.client.get('/static/css/../uploads/lecture.pdf').status_code, 404)
+
+        self.login('file_outsider@example.com')
+        self.assertEqual(self.client.get('/courses/uploads/lecture.pdf').status_code, 404)
+
+    def test_accel_redirect_hands_the_file_to_the_proxy(self):
+        """Test X-Accel-Redirect responses carry the internal location and no body"""
+        app.config['UPLOAD_ACCEL_REDIRECT'] = '/protected-uploads/'
+        self.login('file_enrolled@example.com')
+        response = self.client.get('/courses/uploads/uploads/lecture.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-uploads/lecture.pdf')
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertEqual(response.data, b'')
+
+if __name__ == '__main__':
+    unittest.main()
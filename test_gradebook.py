@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import datetime
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.gradebook import Gradebook, recompute_course_grades
+from lms.models.user import User, Role
+from lms.models.course import (Course, Assignment, Submission, Enrollment, Module, Test,
+                               TestAttempt, ModuleProgress)
+from test_student_progress import count_queries
+import os
+
+class GradebookTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+
+        self.teacher = User(first_name='Grade', last_name='Teacher', email='grade_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        db.session.add(self.teacher)
+        db.session.flush()
+
+        self.course = Course(title='Graded Course', teacher_id=self.teacher.id, is_approved=True)
+        db.session.add(self.course)
+        db.session.flush()
+
+        self.assignment = Assignment(title='Essay', description='Write', course_id=self.course.id)
+        self.module = Module(title='Module 1', course_id=self.course.id)
+        db.session.add_all([self.assignment, self.module, Module(title='Module 2', course_id=self.course.id)])
+        db.session.flush()
+
+        self.test = Test(title='Quiz', module_id=self.module.id)
+        db.session.add(self.test)
+        db.session.flush()
+
+        self.students = []
+        for i in range(3):
+            student = User(first_name='Student', last_name=str(i), email=f'grade_student{i}@example.com',
+                           password='studentpass', role_id=student_role.id)
+            db.session.add(student)
+            db.session.flush()
+            db.session.add(Enrollment(student_id=student.id, course_id=self.course.id, payment_verified=True))
+            db.session.add(Submission(content='Done', grade=80 + i, student_id=student.id,
+                                      assignment_id=self.assignment.id))
+            db.session.add(TestAttempt(student_id=student.id, test_id=self.test.id, score=40, passed=False,
+                                       completed_at=datetime.utcnow()))
+            db.session.add(TestAttempt(student_id=student.id, test_id=self.test.id, score=90, passed=True,
+                                       completed_at=datetime.utcnow()))
+            db.session.add(TestAttempt(student_id=student.id, test_id=self.test.id, score=None))
+            db.session.add(ModuleProgress(student_id=student.id, module_id=self.module.id, completed=True))
+            self.students.append(student)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def test_student_gradebook(self):
+        """Test grades, best test attempts and completion for one student"""
+        student = self.students[1]
+        gradebook = Gradebook.for_student(student.id)
+
+        assignment_grades = gradebook.assignment_grades(student.id, self.course.id)
+        self.assertEqual([g['grade'] for g in assignment_grades], [81])
+
+        test_grades = gradebook.test_grades(student.id, self.course.id)
+        self.assertEqual(len(test_grades), 1)
+        self.assertEqual(test_grades[0]['grade'], 90)
+        self.assertTrue(test_grades[0]['passed'])
+
+        self.assertEqual(gradebook.completion_percentage(student.id, self.course.id), 50)
+        self.assertEqual(gradebook.overall_grade(student.id, self.course.id), (81 + 90) / 2)
+
+    def test_course_gradebook_query_count(self):
+        """Test a whole course is graded in a fixed number of queries"""
+        course_id = self.course.id
+        with count_queries() as statements:
+            recompute_course_grades(course_id)
+        db.session.commit()
+
+        self.assertLessEqual(len(statements), 8)
+        grades = sorted(e.overall_grade for e in Enrollment.query.filter_by(course_id=course_id))
+        self.assertEqual(grades, [85, 85.5, 86])
+
+    def test_view_grades_page(self):
+        """Test the grades page renders the best test score"""
+        self.client.post('/login', data={
+            'email': 'grade_student0@example.com',
+            'password': 'studentpass'
+        })
+        response = self.client.get('/student/grades')
+
+        self.assert200(response)
+        self.assertIn(b'Graded Course', response.data)
+        self.assertIn(b'90.0%', response.data)
+
+if __name__ == '__main__':
+    unittest.main()
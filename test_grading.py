@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import unittest
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.grading import answer_keys, get_answer_key
+from lms.models.user import User, Role
+from lms.models.course import (Course, Enrollment, Module, Test, Question, QuestionOption,
+                               TestAttempt, TestAnswer)
+from test_student_progress import count_queries
+import os
+
+class GradingTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        answer_keys.clear()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        self.teacher = User(first_name='Quiz', last_name='Teacher', email='quiz_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        self.student = User(first_name='Quiz', last_name='Student', email='quiz_student@example.com',
+                            password='studentpass', role_id=student_role.id)
+        db.session.add_all([self.teacher, self.student])
+        db.session.flush()
+
+        course = Course(title='Quiz Course', teacher_id=self.teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.flush()
+        module = Module(title='Quiz Module', course_id=course.id)
+        db.session.add_all([module, Enrollment(student_id=self.student.id, course_id=course.id,
+                                               payment_verified=True)])
+        db.session.flush()
+        self.test = Test(title='Quiz', module_id=module.id, passing_score=50)
+        db.session.add(self.test)
+        db.session.flush()
+
+        self.multiple = Question(question_text='Pick two', question_type='multiple_choice', points=2,
+                                 test_id=self.test.id)
+        self.true_false = Question(question_text='True?', question_type='true_false', points=1,
+                                   test_id=self.test.id)
+        self.essay = Question(question_text='Explain', question_type='essay', points=1, test_id=self.test.id)
+        db.session.add_all([self.multiple, self.true_false, self.essay])
+        db.session.flush()
+
+        self.options = [QuestionOption(option_text=text, is_correct=correct, question_id=self.multiple.id)
+                        for text, correct in (('A', True), ('B', True), ('C', False))]
+        self.true_option = QuestionOption(option_text='True', is_correct=True, question_id=self.true_false.id)
+        self.false_option = QuestionOption(option_text='False', is_correct=False, question_id=self.true_false.id)
+        db.session.add_all(self.options + [self.true_option, self.false_option])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def submit(self, data):
+        self.client.post('/login', data={'email': 'quiz_student@example.com', 'password': 'studentpass'})
+        attempt = TestAttempt(student_id=self.student.id, test_id=self.test.id)
+        db.session.add(attempt)
+        db.session.commit()
+        attempt_id = attempt.id
+        with count_queries() as statements:
+            self.client.post(f'/student/test-attempts/{attempt_id}', data=data)
+        return db.session.get(TestAttempt, attempt_id), statements
+
+    def test_take_test_grades_with_answer_key(self):
+        """Test a submission is graded in memory and its answers inserted in bulk"""
+        attempt, statements = self.submit({
+            f'question_{self.multiple.id}': [str(self.options[0].id), str(self.options[1].id)],
+            f'question_{self.true_false.id}': str(self.false_option.id),
+            f'question_{self.essay.id}_essay': 'Because'
+        })
+
+        self.assertEqual(attempt.score, 50)
+        self.assertTrue(attempt.passed)
+        answers = {a.question_id: a for a in TestAnswer.query.filter_by(attempt_id=attempt.id)}
+        self.assertEqual(answers[self.multiple.id].points_earned, 2)
+        self.assertEqual(answers[self.true_false.id].points_earned, 0)
+        self.assertEqual(answers[self.essay.id].answer_text, 'Because')
+        self.assertEqual(len([s for s in statements if s.startswith('SELECT question_options')]), 0)
+        self.assertEqual(len([s for s in statements if s.startswith('INSERT INTO test_answers')]), 1)
+
+    def test_results_page_query_count_is_constant(self):
+        """Test the results page loads questions, options and answers in bulk"""
+        attempt, _ = self.submit({f'question_{self.true_false.id}': str(self.true_option.id)})
+        with count_queries() as small:
+            response = self.client.get(f'/student/test-attempts/{attempt.id}/results')
+        self.assert200(response)
+
+        for i in range(10):
+            question = Question(question_text=f'Extra {i}', question_type='multiple_choice', points=1,
+                                test_id=self.test.id)
+            db.session.add(question)
+            db.session.flush()
+            db.session.add(QuestionOption(option_text='Yes', is_correct=True, question_id=question.id))
+        db.session.commit()
+        attempt, _ = self.submit({})
+        with count_queries() as large:
+            response = self.client.get(f'/student/test-attempts/{attempt.id}/results')
+        self.assert200(response)
+        self.assertIn(b'Extra 9', response.data)
+
+        self.assertEqual(len(small), len(large))
+
+    def test_answer_key_invalidated_when_options_change(self):
+        """Test changing an option's correctness recompiles the cached answer key"""
+        key = get_answer_key(self.test)
+        self.assertIs(get_answer_key(self.test), key)
+
+        self.false_option.is_correct = True
+        db.session.commit()
+
+        key = get_answer_key(self.test)
+        self.assertEqual(key.questions[1].correct_option_ids,
+                         {str(self.true_option.id), str(self.false_option.id)})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import datetime, timedelta
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.jobs import (task, enqueue, claim_job, run_job, renew_lease, requeue_stale_jobs, Worker,
+                            PRIORITY_HIGH, PRIORITY_LOW)
+from lms.utils.tasks import notify_course_students
+from lms.models.job import Job
+from lms.models.user import User, Role
+from lms.models.course import Course, Assignment, Submission, Enrollment
+from lms.models.message import Message
+import os
+
+calls = []
+
+@task('tests.record', retry_delay=0)
+def record(value):
+    calls.append(value)
+    return value
+
+@task('tests.flaky', max_attempts=2, retry_delay=0)
+def flaky():
+    raise RuntimeError('still broken')
+
+class JobQueueTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+        del calls[:]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def test_jobs_run_by_priority_and_retry_until_failed(self):
+        """Test due jobs are claimed highest priority first and failures are retried up to max_attempts"""
+        enqueue('tests.record', {'value': 'low'}, priority=PRIORITY_LOW)
+        enqueue('tests.record', {'value': 'high'}, priority=PRIORITY_HIGH)
+        enqueue('tests.record', {'value': 'later'}, priority=PRIORITY_HIGH, countdown=3600)
+        failing = flaky.delay()
+        db.session.commit()
+        failing_id = failing.id
+
+        self.assertEqual(Worker(app, worker_id='test').run_pending(), 4)
+        self.assertEqual(calls, ['high', 'low'])
+
+        db.session.expire_all()
+        failing = db.session.get(Job, failing_id)
+        self.assertEqual(failing.status, Job.FAILED)
+        self.assertEqual(failing.attempts, 2)
+        self.assertIn('still broken', failing.last_error)
+        self.assertEqual(Job.query.filter_by(status=Job.SUCCEEDED).count(), 2)
+        self.assertEqual(Job.query.filter_by(status=Job.QUEUED).count(), 1)
+
+        # A job is handed to one worker only
+        Job.query.filter_by(status=Job.QUEUED).update({'run_at': datetime.utcnow()})
+        db.session.commit()
+        job = claim_job('first')
+        self.assertIsNone(claim_job('second'))
+        self.assertTrue(run_job(job))
+        self.assertEqual(db.session.get(Job, job.id).result, '"later"')
+
+    def test_grading_queues_grade_recompute(self):
+        """Test grading returns before the course grade is updated and the job status can be polled"""
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        teacher = User(first_name='Job', last_name='Teacher', email='job_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        student = User(first_name='Job', last_name='Student', email='job_student@example.com',
+                       password='studentpass', role_id=student_role.id)
+        db.session.add_all([teacher, student])
+        db.session.flush()
+        course = Course(title='Queued Grades', teacher_id=teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.flush()
+        assignment = Assignment(title='Essay', description='Write', course_id=course.id)
+        db.session.add_all([assignment, Enrollment(student_id=student.id, course_id=course.id)])
+        db.session.flush()
+        submission = Submission(student_id=student.id, assignment_id=assignment.id, content='Done')
+        db.session.add(submission)
+        db.session.commit()
+        submission_id, enrollment_id = submission.id, Enrollment.query.first().id
+
+        self.client.post('/login', data={'email': 'job_teacher@example.com', 'password': 'teacherpass'})
+        self.client.post(f'/teacher/submissions/{submission_id}/grade', data={'grade': 80, 'feedback': 'Good'})
+        job = Job.query.filter_by(task='grades.recompute').one()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIsNone(db.session.get(Enrollment, enrollment_id).overall_grade)
+
+        Worker(app, worker_id='test').run_pending()
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Enrollment, enrollment_id).overall_grade, 80.0)
+
+        response = self.client.get(f'/jobs/{job.id}')
+        self.assertEqual(response.json['status'], Job.SUCCEEDED)
+        self.assertEqual(response.json['result'], 80.0)
+
+        # Only the user who queued a job and admins can see it
+        self.client.get('/logout')
+        self.client.post('/login', data={'email': 'job_student@example.com', 'password': 'studentpass'})
+        self.assertEqual(self.client.get(f'/jobs/{job.id}').status_code, 404)
+
+    def test_live_jobs_keep_their_lease_and_retries_do_not_resend(self):
+        """Test only jobs without a recent heartbeat are requeued and a retried notification skips notified students"""
+        record.delay(value='slow')
+        db.session.commit()
+        job = claim_job('first')
+        an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+        Job.query.filter_by(id=job.id).update({'locked_at': an_hour_ago})
+        db.session.commit()
+        self.assertEqual(renew_lease(job.id, 'first'), 1)
+        self.assertEqual(requeue_stale_jobs(60), 0)
+        Job.query.filter_by(id=job.id).update({'locked_at': an_hour_ago})
+        db.session.commit()
+        self.assertEqual(requeue_stale_jobs(60), 1)
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+        teacher = User(first_name='Job', last_name='Teacher', email='job_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        students = [User(first_name='Job', last_name=str(i), email=f'job_student{i}@example.com',
+                         password='studentpass', role_id=student_role.id) for i in range(2)]
+        db.session.add_all([teacher, *students])
+        db.session.flush()
+        course = Course(title='Notified', teacher_id=teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.flush()
+        db.session.add_all([Enrollment(student_id=student.id, course_id=course.id) for student in students])
+        db.session.commit()
+
+        sent_at = datetime.utcnow().isoformat()
+        arguments = {'sender_id': teacher.id, 'course_id': course.id, 'content': 'Exam moved', 'sent_at': sent_at}
+        self.assertEqual(notify_course_students(**arguments), {'sent': 2})
+        self.assertEqual(notify_course_students(**arguments), {'sent': 0})
+        self.assertEqual(Message.query.filter_by(sender_id=teacher.id).count(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
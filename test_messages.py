@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.models.user import User, Role
+from lms.models.message import Message, Conversation
+from lms.utils.pubsub import SQLiteBroker, get_broker, user_channel
+from test_student_progress import count_queries
+import os
+
+class MessageTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        self.admin_role = Role.query.filter_by(name='admin').first()
+        self.student_role = Role.query.filter_by(name='student').first()
+
+        self.admin = User(first_name='Message', last_name='Admin', email='message_admin@example.com',
+                          password='adminpass', role_id=self.admin_role.id)
+        db.session.add(self.admin)
+        db.session.commit()
+        self.contact_count = 0
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def add_contacts(self, count):
+        """Create students who each exchanged a few messages with the admin"""
+        start = datetime.utcnow()
+        for i in range(count):
+            n = self.contact_count + i
+            student = User(first_name='Student', last_name=str(n), email=f'message_student{n}@example.com',
+                           password='studentpass', role_id=self.student_role.id)
+            db.session.add(student)
+            db.session.flush()
+            db.session.add_all([
+                Message(sender_id=student.id, recipient_id=self.admin.id, content='Hello',
+                        created_at=start - timedelta(minutes=3)),
+                Message(sender_id=self.admin.id, recipient_id=student.id, content='Hi',
+                        created_at=start - timedelta(minutes=2)),
+                Message(sender_id=student.id, recipient_id=self.admin.id, content=f'Question {n}',
+                        created_at=start - timedelta(minutes=1), read=(n % 2 == 0)),
+            ])
+        self.contact_count += count
+        db.session.flush()
+        Conversation.backfill()
+        db.session.commit()
+
+    def test_conversations_for_user(self):
+        """Test each conversation has its latest message, contact and unread count"""
+        self.add_contacts(2)
+        conversations = Message.get_conversations_for_user(self.admin.id)
+
+        self.assertEqual(len(conversations), 2)
+        by_contact = {c['contact'].last_name: c for c in conversations}
+        self.assertEqual(by_contact['0']['latest_message'].content, 'Question 0')
+        self.assertEqual(by_contact['0']['unread_count'], 1)
+        self.assertEqual(by_contact['1']['unread_count'], 2)
+
+        student_conversations = Message.get_conversations_for_user(by_contact['1']['contact_id'])
+        self.assertEqual(student_conversations[0]['contact_id'], self.admin.id)
+        self.assertEqual(student_conversations[0]['unread_count'], 1)
+
+    def login(self, email, password):
+        self.client.post('/login', data={'email': email, 'password': password})
+
+    def test_conversation_counters(self):
+        """Test sending and reading messages keeps the conversation row current"""
+        self.add_contacts(1)
+        student = User.query.filter_by(email='message_student0@example.com').first()
+        self.assertEqual(Message.count_unread_messages(self.admin.id), 1)
+
+        self.login('message_student0@example.com', 'studentpass')
+        self.client.post(f'/messages/{self.admin.id}/send', data={'content': 'Another question'})
+        self.client.post(f'/messages/{self.admin.id}/send', data={'content': 'And one more'})
+        self.client.get('/logout')
+
+        conversation = db.session.get(Conversation, Conversation.pair(self.admin.id, student.id))
+        self.assertEqual(conversation.last_message.content, 'And one more')
+        self.assertEqual(Message.count_unread_messages(self.admin.id), 3)
+        self.assertEqual(self.client.get('/messages/unread/count').status_code, 302)
+
+        self.login('message_admin@example.com', 'adminpass')
+        self.assertEqual(self.client.get('/messages/unread/count').json['count'], 3)
+        self.client.get(f'/messages/{student.id}')
+        self.assertEqual(self.client.get('/messages/unread/count').json['count'], 0)
+
+    def test_mark_conversation_as_read(self):
+        """Test marking a conversation read is one UPDATE and a no-op once read"""
+        self.add_contacts(2)
+        student = User.query.filter_by(email='message_student1@example.com').first()
+        admin_id, student_id = self.admin.id, student.id
+
+        with count_queries() as statements:
+            self.assertEqual(Message.mark_conversation_as_read(admin_id, student_id), 2)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE messages')]), 1)
+        self.assertEqual(Message.count_unread_messages(admin_id), 1)
+
+        with count_queries() as statements:
+            self.assertEqual(Message.mark_conversation_as_read(admin_id, student_id), 0)
+        self.assertEqual(len(statements), 1)
+
+    def test_history_pages(self):
+        """Test the history endpoint pages backwards and forwards with cursors"""
+        self.add_contacts(1)
+        student = User.query.filter_by(email='message_student0@example.com').first()
+        start = datetime.utcnow()
+        for i in range(7):
+            # Same timestamp for several messages to exercise the id tiebreak
+            db.session.add(Message(sender_id=student.id, recipient_id=self.admin.id, content=f'Page {i}',
+                                   created_at=start + timedelta(seconds=i // 3)))
+        db.session.commit()
+
+        self.login('message_admin@example.com', 'adminpass')
+        url = f'/messages/{student.id}/history'
+        contents = []
+        data = self.client.get(f'{url}?limit=4').json
+        while True:
+            contents = [m['content'] for m in data['messages']] + contents
+            if not data['has_more']:
+                break
+            data = self.client.get(f"{url}?limit=4&before_id={data['messages'][0]['id']}").json
+
+        self.assertEqual(contents, ['Hello', 'Hi', 'Question 0'] + [f'Page {i}' for i in range(7)])
+
+        newer = self.client.get(f"{url}?after_id={Message.query.filter_by(content='Page 2').first().id}").json
+        self.assertEqual([m['content'] for m in newer['messages']], [f'Page {i}' for i in range(3, 7)])
+        self.assertFalse(newer['has_more'])
+
+    def test_polling_an_empty_conversation_gets_new_messages(self):
+        """Test a cursor that is not a message, as polled by an empty conversation page, starts from the beginning"""
+        student = User(first_name='Quiet', last_name='Student', email='quiet_student@example.com',
+                       password='studentpass', role_id=self.student_role.id)
+        db.session.add(student)
+        db.session.commit()
+        student_id = student.id
+
+        self.login('message_admin@example.com', 'adminpass')
+        url = f'/messages/{student_id}/history'
+        self.assertEqual(self.client.get(f'{url}?after_id=0').json['messages'], [])
+
+        db.session.add(Message(sender_id=student_id, recipient_id=self.admin.id, content='First words'))
+        db.session.commit()
+        for query in ('?after_id=0', '?before_id=0', ''):
+            data = self.client.get(url + query).json
+            self.assertEqual([m['content'] for m in data['messages']], ['First words'], query)
+
+    def test_send_message_pushes_events(self):
+        """Test sending a message pushes it and the unread count to the recipient's stream"""
+        self.add_contacts(1)
+        student = User.query.filter_by(email='message_student0@example.com').first()
+        subscription = get_broker().subscribe(user_channel(self.admin.id))
+        try:
+            self.login('message_student0@example.com', 'studentpass')
+            self.client.post(f'/messages/{self.admin.id}/send', data={'content': 'Pushed'})
+
+            event, data = subscription.get(timeout=1)
+            self.assertEqual((event, data['content'], data['sender_id']), ('message', 'Pushed', student.id))
+            self.assertEqual(subscription.get(timeout=1), ('unread', {'count': 2}))
+        finally:
+            subscription.close()
+
+        self.client.get('/logout')
+        self.login('message_admin@example.com', 'adminpass')
+        response = self.client.get('/messages/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(next(response.response), b'event: unread\ndata: {"count": 2}\n\n')
+        response.close()
+
+    def test_streams_are_capped_and_open_pages_mark_messages_read(self):
+        """Test streams beyond SSE_MAX_STREAMS are turned away and pushed messages can be marked read"""
+        self.add_contacts(1)
+        student = User.query.filter_by(email='message_student0@example.com').first()
+        self.login('message_admin@example.com', 'adminpass')
+
+        max_streams = app.config['SSE_MAX_STREAMS']
+        app.config['SSE_MAX_STREAMS'] = 1
+        try:
+            first = self.client.get('/messages/stream', buffered=False)
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(self.client.get('/messages/stream').status_code, 503)
+            first.close()
+            second = self.client.get('/messages/stream', buffered=False)
+            self.assertEqual(second.status_code, 200)
+            second.close()
+        finally:
+            app.config['SSE_MAX_STREAMS'] = max_streams
+
+        self.assertEqual(self.client.post(f'/messages/{student.id}/read').json, {'count': 0})
+        self.assertEqual(Message.query.filter_by(recipient_id=self.admin.id, read=False).count(), 0)
+
+    def test_sqlite_broker_delivers_between_instances(self):
+        """Test events published by one process-level broker reach another one"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.db')
+            publisher, listener = SQLiteBroker(path), SQLiteBroker(path)
+            subscription = super(SQLiteBroker, listener).subscribe('user:1')
+
+            publisher.publish('user:1', 'unread', {'count': 4})
+            publisher.publish('user:2', 'unread', {'count': 1})
+            self.assertEqual(listener.poll_once(), 2)
+            self.assertEqual(subscription.get(timeout=0), ('unread', {'count': 4}))
+            self.assertIsNone(subscription.get(timeout=0))
+
+    def test_inbox_query_count_is_constant(self):
+        """Test the inbox does not issue a query per conversation"""
+        self.login('message_admin@example.com', 'adminpass')
+        self.add_contacts(1)
+        with count_queries() as small:
+            response = self.client.get('/messages/')
+        self.assert200(response)
+
+        self.add_contacts(20)
+        with count_queries() as large:
+            response = self.client.get('/messages/')
+        self.assert200(response)
+        self.assertIn(b'Question 20', response.data)
+
+        self.assertEqual(len(small), len(large))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import unittest
+import sqlite3
+from flask_testing import TestCase
+from sqlalchemy import select
+from app import app
+from lms.utils.db import db
+from lms.models.user import User, Role
+from lms.models.course import Course
+import os
+
+REPLICA_PATH = os.path.abspath('test_lms_replica.db')
+
+class ReplicaRoutingTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        self.teacher = User(first_name='Replica', last_name='Teacher', email='replica_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        self.other = User(first_name='Replica', last_name='Other', email='replica_other@example.com',
+                          password='otherpass', role_id=teacher_role.id)
+        db.session.add_all([self.teacher, self.other])
+        db.session.flush()
+        self.course = Course(title='Current Title', teacher_id=self.teacher.id, is_approved=True)
+        db.session.add(self.course)
+        db.session.commit()
+        self.course_id, self.other_id = self.course.id, self.other.id
+
+        # The replica is a copy of the primary that has not yet seen the latest title
+        with db.engine.connect() as conn:
+            primary = conn.connection.driver_connection
+            replica = sqlite3.connect(REPLICA_PATH)
+            primary.backup(replica)
+        replica.execute('UPDATE courses SET title = ?', ('Stale Title',))
+        replica.commit()
+        replica.close()
+        app.config['SQLALCHEMY_REPLICA_URI'] = f'sqlite:///{REPLICA_PATH}'
+        db.session.expire_all()
+
+    def tearDown(self):
+        app.config['SQLALCHEMY_REPLICA_URI'] = None
+        replica = app.extensions.pop('db_replica', None)
+        if replica is not None:
+            replica.dispose()
+        db.session.remove()
+        db.drop_all()
+        for path in ('test_lms.db', REPLICA_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_get_handlers_read_from_replica_until_user_writes(self):
+        """Test GET pages read the replica, and the user's own write pins their reads to the primary"""
+        self.client.post('/login', data={'email': 'replica_teacher@example.com', 'password': 'teacherpass'})
+
+        response = self.client.get(f'/courses/{self.course_id}')
+        self.assertIn(b'Stale Title', response.data)
+
+        self.client.post(f'/messages/{self.other_id}/send', data={'content': 'Hello'})
+        response = self.client.get(f'/courses/{self.course_id}')
+        self.assertIn(b'Current Title', response.data)
+
+    def test_writes_in_a_get_request_go_to_primary(self):
+        """Test a flush during a replica-routed request goes to the primary and later reads follow it"""
+        with app.test_request_context(f'/courses/{self.course_id}', method='GET'):
+            app.preprocess_request()
+            title = select(Course.title).where(Course.id == self.course_id)
+            self.assertEqual(db.session.scalar(title), 'Stale Title')
+
+            db.session.add(Course(title='Written', teacher_id=self.other_id))
+            db.session.flush()
+            self.assertEqual(db.session.scalar(title), 'Current Title')
+            db.session.rollback()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import unittest
+from io import BytesIO
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.deletion import delete_courses
+from lms.utils.jobs import Worker
+from lms.utils.storage import collect_garbage
+from lms.models.user import User, Role
+from lms.models.course import Course, Material
+from lms.models.job import Job
+from lms.models.stored_file import StoredFile
+import os
+import shutil
+import tempfile
+
+class StorageTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        teacher = User(first_name='Store', last_name='Teacher', email='store_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        db.session.add(teacher)
+        db.session.flush()
+        courses = [Course(title=f'Store Course {i}', teacher_id=teacher.id, is_approved=True) for i in range(2)]
+        db.session.add_all(courses)
+        db.session.commit()
+        self.course_ids = [course.id for course in courses]
+
+        self.client.post('/login', data={'email': 'store_teacher@example.com', 'password': 'teacherpass'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+        shutil.rmtree(app.config['UPLOAD_FOLDER'])
+        app.config['UPLOAD_FOLDER'] = self.upload_folder
+
+    def upload(self, course_id, filename):
+        return self.client.post(f'/teacher/courses/{course_id}/materials/add', data={
+            'title': filename, 'content_type': 'file', 'file': (BytesIO(b'%PDF same slides'), filename)
+        }, content_type='multipart/form-data')
+
+    def stored_files(self):
+        tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')
+        return [os.path.join(root, name) for root, dirs, files in os.walk(app.config['UPLOAD_FOLDER'])
+                for name in files if root != tmp_dir]
+
+    def test_identical_uploads_are_stored_once(self):
+        """Test the same content uploaded twice shares one file counted by both materials"""
+        self.upload(self.course_ids[0], 'week1.pdf')
+        self.upload(self.course_ids[1], 'Copy of week1.PDF')
+
+        paths = {material.file_path for material in Material.query.all()}
+        self.assertEqual(len(paths), 1)
+        path = paths.pop()
+        self.assertRegex(path, r'^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(db.session.get(StoredFile, path).ref_count, 2)
+
+        response = self.client.get('/courses/uploads/' + path[len('uploads/'):])
+        self.assertEqual(response.data, b'%PDF same slides')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        response.close()
+
+        db.session.delete(Material.query.filter_by(course_id=self.course_ids[0]).first())
+        db.session.commit()
+        Worker(app, worker_id='test').run_pending()
+        self.assertEqual(db.session.get(StoredFile, path).ref_count, 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_cascade_delete_reclaims_unreferenced_files(self):
+        """Test deleting the last course using a file removes it, and garbage collection sweeps orphans"""
+        self.upload(self.course_ids[0], 'week1.pdf')
+        self.upload(self.course_ids[0], 'week1-again.pdf')
+        path = Material.query.first().file_path
+
+        report = delete_courses([self.course_ids[0]])
+        db.session.commit()
+        self.assertEqual(report.files, [])
+        self.assertEqual(db.session.get(StoredFile, path).ref_count, 0)
+        self.assertEqual(Job.query.filter_by(task='storage.reclaim').count(), 1)
+
+        Worker(app, worker_id='test').run_pending()
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(StoredFile, path))
+        self.assertEqual(self.stored_files(), [])
+
+        # A file written by a request that rolled back has no row at all
+        orphan = os.path.join(app.config['UPLOAD_FOLDER'], 'ab', 'cd', 'abcd' + '0' * 60 + '.pdf')
+        os.makedirs(os.path.dirname(orphan))
+        with open(orphan, 'wb') as f:
+            f.write(b'orphan')
+        self.assertEqual(collect_garbage(grace_seconds=3600), 0)
+        os.utime(orphan, (0, 0))
+        self.assertEqual(collect_garbage(grace_seconds=3600), 1)
+        self.assertFalse(os.path.exists(orphan))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import unittest
+from contextlib import contextmanager
+from flask_testing import TestCase
+from sqlalchemy import event
+from app import app
+from lms.utils.db import db
+from lms.utils.progress import StudentProgressService, rebuild_enrollment_progress
+from lms.utils.gradebook import recompute_course_grades
+from lms.models.user import User, Role
+from lms.models.course import (Course, Assignment, Submission, Enrollment, EnrollmentProgress,
+                               Module, ModuleProgress)
+import os
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+class StudentProgressTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        student_role = Role.query.filter_by(name='student').first()
+
+        self.teacher = User(first_name='Test', last_name='Teacher', email='progress_teacher@example.com',
+                            password='teacherpass', role_id=teacher_role.id)
+        self.student = User(first_name='Test', last_name='Student', email='progress_student@example.com',
+                            password='studentpass', role_id=student_role.id)
+        db.session.add_all([self.teacher, self.student])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def add_courses(self, course_count, assignments_per_course, submitted_per_course):
+        """Enroll the student in courses and submit some of their assignments"""
+        for i in range(course_count):
+            course = Course(title=f'Course {i}', teacher_id=self.teacher.id, is_approved=True)
+            db.session.add(course)
+            db.session.flush()
+            db.session.add(Enrollment(student_id=self.student.id, course_id=course.id, payment_verified=True))
+
+            for j in range(assignments_per_course):
+                assignment = Assignment(title=f'Assignment {j}', description='Do it', course_id=course.id)
+                db.session.add(assignment)
+                db.session.flush()
+                if j < submitted_per_course:
+                    db.session.add(Submission(content='Done', student_id=self.student.id,
+                                              assignment_id=assignment.id))
+        db.session.commit()
+
+    def login(self):
+        self.client.post('/login', data={
+            'email': 'progress_student@example.com',
+            'password': 'studentpass'
+        })
+
+    def test_course_stats(self):
+        """Test progress statistics are computed per course"""
+        self.add_courses(course_count=2, assignments_per_course=4, submitted_per_course=1)
+        course_stats = StudentProgressService(self.student.id).course_stats()
+
+        self.assertEqual(len(course_stats), 2)
+        for stats in course_stats:
+            self.assertEqual(stats['total_assignments'], 4)
+            self.assertEqual(stats['completed_assignments'], 1)
+            self.assertEqual(stats['progress'], 25)
+            self.assertEqual(stats['teacher'], 'Test Teacher')
+
+    def test_course_stats_query_count_is_constant(self):
+        """Test the service issues the same number of queries regardless of enrollment size"""
+        student_id = self.student.id
+        self.add_courses(course_count=1, assignments_per_course=1, submitted_per_course=1)
+        db.session.expire_all()
+        with count_queries() as small:
+            StudentProgressService(student_id).course_stats()
+
+        self.add_courses(course_count=10, assignments_per_course=20, submitted_per_course=5)
+        db.session.expire_all()
+        with count_queries() as large:
+            StudentProgressService(student_id).course_stats()
+
+        self.assertEqual(len(small), len(large))
+        self.assertLessEqual(len(large), 3)
+
+    def test_dashboard_query_count_is_constant(self):
+        """Test the dashboard does not fan out into per-course or per-assignment queries"""
+        self.login()
+        self.add_courses(course_count=1, assignments_per_course=1, submitted_per_course=0)
+        with count_queries() as small:
+            response = self.client.get('/student/dashboard')
+        self.assert200(response)
+
+        self.add_courses(course_count=10, assignments_per_course=20, submitted_per_course=5)
+        with count_queries() as large:
+            response = self.client.get('/student/dashboard')
+        self.assert200(response)
+
+        self.assertEqual(len(small), len(large))
+
+    def test_my_assignments_query_count_is_constant(self):
+        """Test the assignment list loads submissions in bulk"""
+        self.login()
+        self.add_courses(course_count=1, assignments_per_course=1, submitted_per_course=1)
+        with count_queries() as small:
+            response = self.client.get('/student/my-assignments')
+        self.assert200(response)
+
+        self.add_courses(course_count=5, assignments_per_course=10, submitted_per_course=3)
+        with count_queries() as large:
+            response = self.client.get('/student/my-assignments')
+        self.assert200(response)
+
+        self.assertEqual(len(small), len(large))
+
+    def test_enrollment_progress_maintained_on_write(self):
+        """Test submissions and grading keep the stored progress row current"""
+        self.add_courses(course_count=1, assignments_per_course=3, submitted_per_course=2)
+        course = Course.query.first()
+        key = (self.student.id, course.id)
+
+        progress = db.session.get(EnrollmentProgress, key)
+        self.assertEqual(progress.assignments_submitted, 2)
+        self.assertEqual(progress.assignments_graded, 0)
+        self.assertIsNone(progress.overall_grade)
+
+        submission = Submission.query.first()
+        submission.grade = 75
+        db.session.commit()
+
+        progress = db.session.get(EnrollmentProgress, key)
+        self.assertEqual(progress.assignments_graded, 1)
+        self.assertEqual(progress.overall_grade, 75)
+
+        db.session.delete(Enrollment.query.filter_by(course_id=course.id).first())
+        db.session.commit()
+        self.assertIsNone(db.session.get(EnrollmentProgress, key))
+
+    def test_progress_pages_read_the_stored_counters(self):
+        """Test the dashboard, grades and modules pages show the counters of the stored progress row"""
+        self.login()
+        self.add_courses(course_count=1, assignments_per_course=2, submitted_per_course=1)
+        course_id = Course.query.first().id
+        db.session.execute(EnrollmentProgress.__table__.update().values(
+            modules_completed=7, tests_passed=5, assignments_graded=3, overall_grade=42.0
+        ))
+        db.session.commit()
+
+        for url in ('/student/dashboard', '/student/grades', f'/student/courses/{course_id}/modules'):
+            response = self.client.get(url)
+            self.assert200(response)
+            self.assertIn(b'5 tests passed', response.data, url)
+            self.assertIn(b'42.0%', response.data, url)
+        self.assertIn(b'7 modules completed', self.client.get('/student/grades').data)
+
+    def test_progress_refresh_runs_only_the_queries_it_needs(self):
+        """Test grade writes skip the progress refresh and module progress reloads only module counts"""
+        self.add_courses(course_count=1, assignments_per_course=2, submitted_per_course=1)
+        course = Course.query.first()
+        key = (self.student.id, course.id)
+        module = Module(title='Module', course_id=course.id)
+        db.session.add(module)
+        Submission.query.first().grade = 80
+        db.session.commit()
+
+        recompute_course_grades(course.id)
+        with count_queries() as statements:
+            db.session.flush()
+        self.assertEqual(len(statements), 1)  # The UPDATE of enrollments, without a progress refresh
+        db.session.commit()
+        self.assertEqual(Enrollment.query.first().overall_grade, 80)
+
+        db.session.add(ModuleProgress(student_id=self.student.id, module_id=module.id, completed=True))
+        with count_queries() as statements:
+            db.session.flush()
+        # INSERT, course lookup, completed module count, progress UPDATE
+        self.assertLessEqual(len(statements), 5)
+        self.assertFalse([s for s in statements if 'submissions' in s or 'test_attempts' in s])
+        db.session.commit()
+
+        progress = db.session.get(EnrollmentProgress, key)
+        self.assertEqual((progress.modules_completed, progress.assignments_submitted,
+                          progress.assignments_graded, progress.overall_grade), (1, 1, 1, 80))
+
+    def test_rebuild_enrollment_progress(self):
+        """Test the bulk rebuild recreates missing progress rows"""
+        self.add_courses(course_count=3, assignments_per_course=2, submitted_per_course=1)
+        EnrollmentProgress.query.delete()
+        db.session.commit()
+
+        self.assertEqual(rebuild_enrollment_progress(), 3)
+        db.session.commit()
+
+        rows = EnrollmentProgress.query.filter_by(student_id=self.student.id).all()
+        self.assertEqual([row.assignments_submitted for row in rows], [1, 1, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import unittest
+from flask import g
+from flask_testing import TestCase
+from app import app
+from lms.utils.db import db
+from lms.utils.tokens import revocations
+from lms.models.user import User, Role
+from lms.models.course import Course
+from test_student_progress import count_queries
+import os
+
+class TokenAuthTests(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_lms.db'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for role_name in ('admin', 'teacher', 'student'):
+            if not Role.query.filter_by(name=role_name).first():
+                db.session.add(Role(name=role_name, description=role_name.title()))
+        db.session.commit()
+
+        teacher_role = Role.query.filter_by(name='teacher').first()
+        teacher = User(first_name='Token', last_name='Teacher', email='token_teacher@example.com',
+                       password='teacherpass', role_id=teacher_role.id)
+        db.session.add(teacher)
+        db.session.flush()
+        course = Course(title='Token Course', teacher_id=teacher.id, is_approved=True)
+        db.session.add(course)
+        db.session.commit()
+        self.course_id = course.id
+        revocations.clear()
+
+    def tearDown(self):
+        revocations.clear()
+        db.session.remove()
+        db.drop_all()
+        if os.path.exists('test_lms.db'):
+            os.remove('test_lms.db')
+
+    def call(self, method, url, **kwargs):
+        # The test client shares one app context, and Flask-Login keeps the user in g
+        g.pop('_login_user', None)
+        return getattr(self.client, method)(url, **kwargs)
+
+    def login(self):
+        response = self.call('post', '/api/auth/login', json={'email': 'token_teacher@example.com', 'password': 'teacherpass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['user']['email'], 'token_teacher@example.com')
+        return {'Authorization': f"Bearer {response.json['access_token']}"}
+
+    def test_token_requests_do_not_load_the_user(self):
+        """Test a bearer token authenticates API calls without querying the users table"""
+        headers = self.login()
+        self.call('get', '/api/courses/', headers=headers)  # Loads the revocation list
+
+        with count_queries() as statements:
+            response = self.call('get', '/api/courses/?fields=id,title', headers=headers)
+        self.assertEqual(response.json['items'], [{'id': self.course_id, 'title': 'Token Course'}])
+        self.assertFalse([statement for statement in statements if 'FROM users' in statement])
+
+        self.assertEqual(self.call('get', '/api/courses/', headers={'Authorization': 'Bearer forged'}).status_code, 401)
+        bad = self.call('post', '/api/auth/login', json={'email': 'token_teacher@example.com', 'password': 'wrong'})
+        self.assertEqual(bad.status_code, 401)
+
+    def test_revoked_tokens_are_rejected_and_writes_skip_csrf(self):
+        """Test logout revokes the token and token clients need no CSRF token to log in or write"""
+        browser = app.test_client()
+        browser.post('/login', data={'email': 'token_teacher@example.com', 'password': 'teacherpass'})
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            headers = self.login()
+            response = self.call('put', f'/api/courses/{self.course_id}',
+                                 json={'title': 'Renamed', 'image_path': 'uploads/receipt.pdf'}, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.json['title'], response.json['image_path']), ('Renamed', None))
+            g.pop('_login_user', None)
+            rejected = browser.put(f'/api/courses/{self.course_id}', json={'title': 'x'})
+            self.assertEqual(rejected.status_code, 400)
+            self.assertIn(b'CSRF', rejected.data)
+
+            refreshed = self.call('post', '/api/auth/refresh', headers=headers)
+            self.assertEqual(refreshed.status_code, 200)
+            self.assertEqual(self.call('get', '/api/courses/', headers=headers).status_code, 401)
+
+            new_headers = {'Authorization': f"Bearer {refreshed.json['access_token']}"}
+            self.assertEqual(self.call('post', '/api/auth/logout', headers=new_headers).status_code, 204)
+            self.assertEqual(self.call('get', '/api/courses/', headers=new_headers).status_code, 401)
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+if __name__ == '__main__':
+    unittest.main()